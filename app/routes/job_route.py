@@ -0,0 +1,7 @@
+from fastapi import APIRouter
+
+from app.src.endpoints.job_endpoints  import router as endpoints_router
+
+router = APIRouter()
+
+router.include_router(endpoints_router, prefix="/jobs", tags=["jobs"])
@@ -0,0 +1,18 @@
+from fastapi import HTTPException
+from app.src.services.resilience import UpstreamError
+from app.src.services.workspaces import WorkspaceFullError
+
+def upstream_unavailable(error: UpstreamError) -> HTTPException:
+    """
+    503 for an upstream that is down or out of retries, with Retry-After
+    when known; 502 when the upstream rejected the request (a 4xx)
+    """
+    status = error.status_code
+    if status is not None and 400 <= status < 500 and status not in (408, 425, 429):
+        return HTTPException(status_code=502, detail=f"Upstream rejected the request: {str(error)}")
+    headers = {"Retry-After": str(max(1, round(error.retry_after)))} if error.retry_after else None
+    return HTTPException(status_code=503, detail=f"Upstream unavailable: {str(error)}", headers=headers)
+
+def no_workspace(error: WorkspaceFullError) -> HTTPException:
+    """503 when the disk cap leaves no room for another video run"""
+    return HTTPException(status_code=503, detail=f"Server busy: {str(error)}", headers={"Retry-After": "60"})
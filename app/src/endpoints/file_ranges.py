@@ -0,0 +1,135 @@
+"""
+File responses with HTTP Range support, including files that are still
+being written (the fragmented MP4 of a video job that is still merging)
+"""
+
+import asyncio
+import inspect
+import os
+import re
+import time
+from typing import Awaitable, Callable, Optional, Tuple, Union
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+CHUNK_SIZE = 256 * 1024
+# How often a growing file is checked for new bytes, and how long a range
+# request past its current end waits for them
+POLL_INTERVAL = 0.25
+RANGE_WAIT = 30.0
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+# Tells whether a file is still being written; may be a coroutine function
+Growing = Callable[[], Union[bool, Awaitable[bool]]]
+
+
+def parse_range(header: Optional[str], size: Optional[int]) -> Optional[Tuple[int, Optional[int]]]:
+    """
+    (start, end) of a single "bytes=" range, end inclusive or None for
+    "to the end". Unsupported forms (several ranges, a suffix range on a
+    file of unknown size) give None so the whole file is sent.
+    """
+    match = _RANGE.match((header or "").strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        # "bytes=-N": the last N bytes
+        if size is None:
+            return None
+        return max(0, size - int(match.group(2))), None
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else None
+    if end is not None and end < start:
+        return None
+    return start, end
+
+
+async def file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    growing: Optional[Growing] = None,
+    filename: Optional[str] = None
+) -> Response:
+    """
+    Serve path with Range support. While growing() is true the file is
+    treated as still being written: a plain GET follows it until it's
+    done, and ranges are answered from the bytes already there with an
+    unknown total ("bytes 0-99/*").
+    """
+    headers = {"Accept-Ranges": "bytes"}
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    is_growing = growing is not None and await _is_growing(growing)
+    if is_growing:
+        headers["Cache-Control"] = "no-store"
+    size = os.path.getsize(path)
+    requested = parse_range(request.headers.get("range"), None if is_growing else size)
+
+    if requested is None:
+        if is_growing:
+            return StreamingResponse(_follow(path, growing), media_type=media_type, headers=headers)
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_read(path, 0, size), media_type=media_type, headers=headers)
+
+    start, end = requested
+    if is_growing and start >= size:
+        size, is_growing = await _wait_for(path, start, growing)
+    if start >= size:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size if not is_growing else '*'}"})
+    end = size - 1 if end is None else min(end, size - 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{'*' if is_growing else size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_read(path, start, end + 1), status_code=206, media_type=media_type, headers=headers)
+
+
+async def _read(path: str, start: int, stop: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = await run_in_threadpool(f.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def _is_growing(growing: Growing) -> bool:
+    value = growing()
+    if inspect.isawaitable(value):
+        value = await value
+    return bool(value)
+
+
+async def _follow(path: str, growing: Growing):
+    """The whole file, waiting for new bytes until the writer is done"""
+    try:
+        with open(path, "rb") as f:
+            while True:
+                # Checked before reading, so an empty read after it means the end
+                done = not await _is_growing(growing)
+                chunk = await run_in_threadpool(f.read, CHUNK_SIZE)
+                if chunk:
+                    yield chunk
+                elif done:
+                    break
+                else:
+                    await asyncio.sleep(POLL_INTERVAL)
+    except OSError as e:
+        # The writer gave up and removed the file
+        print(f"Stopped streaming {path}: {e}")
+
+
+async def _wait_for(path: str, offset: int, growing: Growing) -> Tuple[int, bool]:
+    """Wait until the file has bytes past offset or stops growing; returns (size, still growing)"""
+    deadline = time.monotonic() + RANGE_WAIT
+    while True:
+        is_growing = await _is_growing(growing)
+        size = os.path.getsize(path)
+        if size > offset or not is_growing or time.monotonic() >= deadline:
+            return size, is_growing
+        await asyncio.sleep(POLL_INTERVAL)
@@ -1,18 +1,24 @@
 from fastapi import APIRouter
 from app.src.models.model import TextForGenerationPrompt, GenerateImageResponse, TextAndAvatarGeneration, Slide
-import requests
-import json
-import time
-import os
+from app.src.services.single_flight import get_single_flight
+from app.src.services.resilience import UpstreamError
+from app.src.services.higgsfield_client import (
+    get_higgsfield_client, job_set_result_url, TEXT2IMAGE_PATH, SEEDREAM_PATH
+)
+from app.src.services.job_poller import get_job_poller, JobError
+from app.src.services.job_store import Job
+from app.src.services.generation_cache import get_generation_cache, generation_key
+from app.src.services.job_ledger import get_job_ledger, ledger_request
+from app.src.endpoints.errors import upstream_unavailable
+import asyncio
+import uuid
 from dotenv import load_dotenv
-from typing import List, Optional
+from typing import Dict, List, Optional
 import re
 
 router = APIRouter()
 
 load_dotenv()
-HF_API_KEY = os.getenv("HF_API_KEY")
-HF_SECRET = os.getenv("HF_SECRET")
 
 def divide_prompt(text):
     #here i will divide it 
@@ -22,40 +28,16 @@ def split_slides(text: str) -> list[str]:
     parts = re.split(r'(?=^##\s)', text, flags=re.MULTILINE)
     return [p for p in parts if p.strip()]
 
-def generate_image(text):
-    url = "https://platform.higgsfield.ai/v1/text2image/"
-    headers = {
-        "Content-Type": "application/json",
-        "hf-api-key": HF_API_KEY,
-        "hf-secret": HF_SECRET
+def text2image_params(text):
+    return {
+        "prompt": text,
+        "aspect_ratio": "4:3",
+        "input_images": []
     }
 
-    data = {
-        "params": {
-            "prompt": text,
-            "aspect_ratio": "4:3",
-            "input_images": []
-        }
-    }
-
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-
-    if response.status_code == 200:
-        data = response.json()
-        return data.get("id")
-    return ""
-
-def generate_image_with_avatar(text, avatar_url):
-    url = "https://platform.higgsfield.ai/v1/text2image/seedream"
-    headers = {
-        "Content-Type": "application/json",
-        "hf-api-key": HF_API_KEY,
-        "hf-secret": HF_SECRET
-    }
-
-    data = {
-        "params": {
-            "prompt": ''' You are generating a presentation-style layout by rendering a slide from text and compositing it with a provided speaker image.
+def seedream_params(text, avatar_url):
+    return {
+        "prompt": ''' You are generating a presentation-style layout by rendering a slide from text and compositing it with a provided speaker image.
 
 Strict layout rules:
 
@@ -93,115 +75,152 @@ No border, no shadow, and no overlap with the slide content.
 
 Input text for slide:''' + text + ''' Final output:
 A single still frame in 16:9 aspect ratio with a clean professional lecture layout. Slide on the left, speaker on the right at 70 percent size, both integrated on the same continuous background color.''',
-            "quality": "basic",
-            "aspect_ratio": "4:3",
-            "input_images": [
-            {
-                "type": "image_url",
-                "image_url": avatar_url
-            }
-            ]
+        "quality": "basic",
+        "aspect_ratio": "4:3",
+        "input_images": [
+        {
+            "type": "image_url",
+            "image_url": avatar_url
         }
+        ]
     }
 
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-
-    if response.status_code == 200:
-        data = response.json()
-        return data.get("id")
-    return ""
-
-def check_for_generated(job_set_id):
-    url = "https://platform.higgsfield.ai/v1/job-sets/" + job_set_id
-
-    headers = {
-        "hf-api-key": HF_API_KEY,
-        "hf-secret": HF_SECRET
-    }
-
-    response = requests.get(url, headers=headers)
-    print(response)
-    if (response.status_code == 200) :
-        data = response.json()
-        jobs = data.get("jobs", [])
-        if jobs:
-            first = jobs[0]
-            status = first.get("status")
-            results = first.get("results") or {}
-            min_info = results.get("min")
-
-            if (status == 'completed'):
-                if min_info and "url" in min_info:
-                    return min_info["url"]
-    return False
-
-def get_images(text):
+def new_request_id(job: Optional[Job] = None) -> str:
+    """Id that ties a pipeline's job sets together in the job ledger"""
+    return job.id if job is not None else uuid.uuid4().hex
+
+async def submit_job(path: str, params: dict, key: Optional[str] = None) -> str:
+    """Submit a Higgsfield job; identical submissions in flight at the same time share one job set"""
+    return await get_single_flight("higgsfield_submit").do(
+        key or generation_key(path, params),
+        lambda: get_higgsfield_client().submit(path, params)
+    )
+
+class SlideJobs:
+    """
+    The Higgsfield jobs of one type for one deck. generate() runs a job for
+    one slide's params and resolves to {"id", "url"} (plus "error" when the
+    job failed); "id" is "" when the submission was rejected. Finished
+    results come from the generation cache without submitting, identical
+    params within the deck share one job, and submissions are recorded in
+    the job ledger under request_id.
+    """
+
+    def __init__(self, job_type: str, path: str, result: str = "min", stage: str = "images", request_id: Optional[str] = None):
+        self.job_type = job_type
+        self.path = path
+        self.result = result
+        self.stage = stage
+        self.request_id = request_id or new_request_id()
+        self._tasks: Dict[str, asyncio.Future] = {}
+
+    def generate(self, params: dict, slide_index: int = 0) -> "asyncio.Future[dict]":
+        key = generation_key(self.path, params)
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate(key, params, slide_index))
+            self._tasks[key] = task
+        return task
+
+    async def _generate(self, key: str, params: dict, slide_index: int) -> dict:
+        cache = get_generation_cache()
+        cached = await asyncio.to_thread(cache.get, key) if cache is not None else None
+        if cached is not None:
+            return {"id": cached["id"], "url": cached["url"]}
+
+        job_set_id = await submit_job(self.path, params, key)
+        if not job_set_id:
+            return {"id": "", "url": None}
+        ledger = get_job_ledger()
+        if ledger is not None:
+            await asyncio.to_thread(
+                ledger.record_submitted, job_set_id, self.request_id, self.stage, slide_index, self.job_type, self.result, key
+            )
+
+        try:
+            job_set = await get_job_poller().wait(job_set_id, self.job_type)
+        except JobError as e:
+            print(e)
+            return {"id": job_set_id, "url": None, "error": str(e)}
+        url = job_set_result_url(job_set, self.result)
+        if url and cache is not None:
+            await asyncio.to_thread(cache.set, key, job_set_id, url)
+        return {"id": job_set_id, "url": url}
+
+async def generate_results(
+    job_type: str,
+    path: str,
+    params_list: List[dict],
+    result: str = "min",
+    job: Optional[Job] = None,
+    stage: str = "images",
+    request_id: Optional[str] = None
+) -> List[dict]:
+    """Run SlideJobs for every params at once; results are in input order"""
+    slide_jobs = SlideJobs(job_type, path, result, stage, request_id or new_request_id(job))
+    if job is not None:
+        job.set_stage(stage, total=len(params_list))
+
+    async def generate_one(index: int, params: dict) -> dict:
+        outcome = dict(await slide_jobs.generate(params, index))
+        if job is not None:
+            job.item_done(stage, outcome)
+        return outcome
+
+    async with ledger_request(slide_jobs.request_id):
+        return list(await asyncio.gather(*(generate_one(i, params) for i, params in enumerate(params_list))))
+
+async def get_images(text, job: Optional[Job] = None):
     prompts = split_slides(text)
-    imagesIdsAndUrls: List[dict] = []
     print(prompts)
-    for prompt_text in prompts:
-        job_set_id = generate_image(prompt_text)
-        if (job_set_id != ''):
-            imagesIdsAndUrls.append({"id": job_set_id, "url": None})
-    time.sleep(30)  
-    print(imagesIdsAndUrls)
-
-    while True:
-        all_done = True
-        for img in imagesIdsAndUrls:
-            if img["url"] is None:
-                result = check_for_generated(img["id"])  
-                if result:
-                    img["url"] = result 
-                else:
-                    all_done = False
-        if all_done:
-            break
-        time.sleep(5)
+    if job is not None:
+        job.set_progress("slides_parsed", len(prompts))
+    results = await generate_results(
+        "text2image", TEXT2IMAGE_PATH, [text2image_params(prompt_text) for prompt_text in prompts], job=job
+    )
+    imagesIdsAndUrls: List[dict] = [result for result in results if result["id"]]
     print(imagesIdsAndUrls)
     
     return imagesIdsAndUrls
 
 
-def get_images_with_avatar(slides: List[Slide], avatar: str):
-    # prompts = split_slides(text)
-    imagesIdsAndUrls: List[dict] = []
-    # print(prompts)
-    for slide in slides:
-        if (slide):
-            title = slide.get("title", "")
-            content = slide.get("content", "")
-            job_set_id = generate_image_with_avatar(title + content, avatar)
-            if (job_set_id != ''):
-                imagesIdsAndUrls.append({"id": job_set_id, "url": None, "script": slide["script"], "title": title, "content": content})
-    time.sleep(30)  
-    print(imagesIdsAndUrls)
-
-    while True:
-        all_done = True
-        for img in imagesIdsAndUrls:
-            if img["url"] is None:
-                result = check_for_generated(img["id"])  
-                if result:
-                    img["url"] = result 
-                else:
-                    all_done = False
-        if all_done:
-            break
-        time.sleep(5)
+async def get_images_with_avatar(
+    slides: List[Slide], avatar: str, job: Optional[Job] = None, request_id: Optional[str] = None
+):
+    slides = [slide for slide in slides if slide]
+    if job is not None:
+        job.set_progress("slides_parsed", len(slides))
+    results = await generate_results(
+        "seedream",
+        SEEDREAM_PATH,
+        [seedream_params(slide.get("title", "") + slide.get("content", ""), avatar) for slide in slides],
+        job=job,
+        request_id=request_id
+    )
+    imagesIdsAndUrls: List[dict] = [
+        {**result, "script": slide["script"], "title": slide.get("title", ""), "content": slide.get("content", "")}
+        for slide, result in zip(slides, results)
+        if result["id"]
+    ]
     print(imagesIdsAndUrls)
     
     return imagesIdsAndUrls
 
 @router.post("/generate-image", response_model=GenerateImageResponse)
-def generate_images(prompt: TextForGenerationPrompt):
-    imagesIdsAndUrls = get_images(prompt.text)
+async def generate_images(prompt: TextForGenerationPrompt):
+    try:
+        imagesIdsAndUrls = await get_images(prompt.text)
+    except UpstreamError as e:
+        raise upstream_unavailable(e)
     return {"status": 1, "result": imagesIdsAndUrls}
 
 
 @router.post("/generate-image-with-avatar", response_model=GenerateImageResponse)
-def generate_images(prompt: TextAndAvatarGeneration):
-    imagesIdsAndUrls = get_images_with_avatar(prompt.text, prompt.avatar)
+async def generate_images(prompt: TextAndAvatarGeneration):
+    try:
+        imagesIdsAndUrls = await get_images_with_avatar(prompt.text, prompt.avatar)
+    except UpstreamError as e:
+        raise upstream_unavailable(e)
     return {"status": 1, "result": imagesIdsAndUrls}
 
 
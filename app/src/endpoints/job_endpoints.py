@@ -0,0 +1,126 @@
+from fastapi import APIRouter, HTTPException, Request
+from app.src.models.model import (
+    TextForGenerationPrompt,
+    TextAndAvatarGeneration,
+    PromptAndImageRequest,
+    JobSubmittedResponse,
+    JobStatusResponse
+)
+from app.src.endpoints.image_endpoints import get_images, get_images_with_avatar
+from app.src.endpoints.video_endpoints import build_video
+from app.src.services.markdown_formatter import LectureMarkdownFormatter
+from app.src.services.job_store import get_job_store, Job, COMPLETED, FAILED
+from app.src.services.workspaces import WorkspaceFullError
+from app.src.endpoints.errors import no_workspace
+from app.src.endpoints.file_ranges import file_response
+import os
+
+router = APIRouter()
+
+def submitted(job: Job) -> JobSubmittedResponse:
+    return JobSubmittedResponse(
+        job_id=job.id,
+        status=job.status,
+        status_url=f"/jobs/{job.id}",
+        result_url=f"/jobs/{job.id}/result"
+    )
+
+async def submit(kind: str, run) -> JobSubmittedResponse:
+    try:
+        return submitted(await get_job_store().submit(kind, run))
+    except WorkspaceFullError as e:
+        raise no_workspace(e)
+
+def video_file(job: Job) -> str:
+    return os.path.join(job.workdir, f"lecture_{job.id}.mp4")
+
+async def get_job_or_404(job_id: str) -> Job:
+    job = await get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@router.post("/generate-image", response_model=JobSubmittedResponse, status_code=202)
+async def submit_images(prompt: TextForGenerationPrompt):
+    """Same as POST /generate-image, but returns a job id right away"""
+    async def run(job: Job):
+        return {"status": 1, "result": await get_images(prompt.text, job)}
+
+    return await submit("image", run)
+
+@router.post("/generate-image-with-avatar", response_model=JobSubmittedResponse, status_code=202)
+async def submit_images_with_avatar(prompt: TextAndAvatarGeneration):
+    """Slide images composited with the avatar, for lecture markdown in "text" """
+    async def run(job: Job):
+        slides = LectureMarkdownFormatter.parse_markdown_to_slides(prompt.text)
+        return {"status": 1, "result": await get_images_with_avatar(slides, prompt.avatar, job)}
+
+    return await submit("image-with-avatar", run)
+
+@router.post("/generate-video", response_model=JobSubmittedResponse, status_code=202)
+async def submit_video(prompt: PromptAndImageRequest):
+    """Same as POST /generate-video; the merged MP4 is fetched from the result URL"""
+    async def run(job: Job):
+        slides = LectureMarkdownFormatter.parse_markdown_to_slides(prompt.text)
+        job.set_progress("slides_parsed", len(slides))
+        output_file = video_file(job)
+        result = await build_video(slides, output_file=output_file, job=job)
+        if isinstance(result, dict):
+            # build_video reports "nothing to merge" as {"status": 0, "error": ...}
+            raise RuntimeError(result.get("error") or "Video generation failed")
+        return {"status": 1, "file": output_file}
+
+    return await submit("video", run)
+
+@router.get("/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """
+    Status and per-stage progress of a job: slides_parsed, images, videos
+    and downloads ({"done", "failed", "total"}), merged_clips, streaming
+    (GET /jobs/{job_id}/stream is available) and merged
+    """
+    return (await get_job_or_404(job_id)).to_dict()
+
+@router.get("/{job_id}/result")
+async def get_job_result(job_id: str, request: Request):
+    """
+    The job's output: the same JSON as the synchronous endpoint, or the
+    MP4 file (with Range support) for video jobs. 409 while the job is
+    still queued or running.
+    """
+    job = await get_job_or_404(job_id)
+    if job.status == FAILED:
+        return {"status": 0, "error": job.error}
+    if job.status != COMPLETED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    if job.kind == "video":
+        try:
+            return await file_response(request, job.result["file"], "video/mp4", filename="lecture_video.mp4")
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Video not found")
+    return job.result
+
+@router.get("/{job_id}/stream")
+async def stream_job_video(job_id: str, request: Request):
+    """
+    The lecture video of a video job while it is still being merged, as a
+    fragmented MP4 that grows slide by slide; supports Range requests.
+    409 until the first slide has been merged (or when the merge can't be
+    streamed), the finished file once the job completes.
+    """
+    job = await get_job_or_404(job_id)
+    if job.kind != "video":
+        raise HTTPException(status_code=400, detail="Only video jobs can be streamed")
+    if job.status == FAILED:
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+    if job.status != COMPLETED and not job.progress.get("streaming"):
+        raise HTTPException(status_code=409, detail="The video isn't available yet")
+    async def growing() -> bool:
+        # Re-read every time: the job may be running in another worker
+        current = await get_job_store().refresh(job)
+        return current is not None and not current.finished and bool(current.progress.get("streaming"))
+
+    try:
+        return await file_response(request, video_file(job), "video/mp4", growing=growing)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Video not found")
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Response, Request, Query
+from fastapi.responses import StreamingResponse
 from app.src.models.model import (
     LectureTopicRequest, 
     LectureResponse, 
@@ -7,96 +8,321 @@ from app.src.models.model import (
 )
 from app.src.services.qwen_service import QwenService
 from app.src.services.markdown_formatter import LectureMarkdownFormatter  # ← NEW IMPORT
-from typing import List
+from app.src.services.lecture_cache import LectureCache, get_lecture_cache
+from app.src.services.similarity_index import get_similarity_index
+from app.src.services.single_flight import get_single_flight
+from app.src.services.batch_runner import iter_lines, run_jsonl_batch
+from app.src.services.token_usage import empty_usage
+from app.src.services.resilience import UpstreamError
+from app.src.endpoints.errors import upstream_unavailable
+from typing import List, Dict, Any, Optional, Tuple
+import json
 import os
 
 router = APIRouter()
 
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv("LECTURE_BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = 64
+
 def get_qwen_service():
-    """Get Qwen service instance with proper error handling"""
+    """Get Qwen service instance bound to the shared async client"""
     try:
         return QwenService()
     except ValueError as e:
         raise HTTPException(status_code=500, detail=f"Qwen service initialization failed: {str(e)}")
 
+def lecture_cache_key(request: LectureTopicRequest, topic: Optional[str] = None) -> str:
+    return LectureCache.make_key(
+        topic=request.topic if topic is None else topic,
+        duration_minutes=request.duration_minutes,
+        difficulty_level=request.difficulty_level,
+        target_audience=request.target_audience,
+        tone=request.tone,
+        add_ons=request.add_ons.dict() if request.add_ons else {},
+        generation_mode=request.generation_mode or "single"
+    )
+
+def lecture_generation_kwargs(request: LectureTopicRequest) -> Dict[str, Any]:
+    return {
+        "topic": request.topic,
+        "duration_minutes": request.duration_minutes,
+        "difficulty_level": request.difficulty_level,
+        "target_audience": request.target_audience,
+        "tone": request.tone,
+        "add_ons": request.add_ons.dict() if request.add_ons else {}
+    }
+
+def lecture_params_key(request: LectureTopicRequest) -> str:
+    """Cache key of everything but the topic - near matches must agree on it exactly"""
+    return lecture_cache_key(request, topic="")
+
+def is_cache_bypass(header_value: Optional[str]) -> bool:
+    return (header_value or "").strip().lower() in ("1", "true", "yes")
+
+async def find_near_match(request: LectureTopicRequest) -> Optional[Dict[str, Any]]:
+    """
+    A cached lecture on a near-identical topic with the same parameters,
+    re-labelled with the requested topic, or None
+    """
+    index = get_similarity_index()
+    if index is None:
+        return None
+    cache = get_lecture_cache()
+    params_key = lecture_params_key(request)
+    stale = ()
+    while True:
+        match = index.lookup(params_key, request.topic, exclude=stale)
+        if match is None:
+            return None
+        cache_key, topic, similarity = match
+        cached, _ = await cache.get(cache_key)
+        if cached is not None:
+            return {**cached, "near_match": {"topic": topic, "similarity": round(similarity, 3)}}
+        # The lecture expired from the cache; stop matching it
+        index.remove(cache_key)
+        stale += (cache_key,)
+
+async def store_lecture(request: LectureTopicRequest, key: str, lecture_data: Dict[str, Any]) -> None:
+    cache = get_lecture_cache()
+    await cache.set(key, {name: value for name, value in lecture_data.items() if name not in ("usage", "near_match")})
+    index = get_similarity_index()
+    if index is not None:
+        index.add(key, lecture_params_key(request), request.topic)
+
+async def generate_lecture_data(request: LectureTopicRequest, bypass_cache: bool = False) -> Tuple[Dict[str, Any], str]:
+    """
+    Cached wrapper around QwenService.generate_lecture_content_async.
+    Returns (lecture_data, cache_status) where cache_status is one of
+    HIT-MEMORY, HIT-DISK, HIT-SIMILAR, MISS or BYPASS.
+    """
+    cache = get_lecture_cache()
+    key = lecture_cache_key(request)
+    
+    if bypass_cache:
+        cache.record_bypass()
+        cache_status = "BYPASS"
+    else:
+        cached, tier = await cache.get(key)
+        if cached is not None:
+            return cached, f"HIT-{tier.upper()}"
+        near_match = await find_near_match(request)
+        if near_match is not None:
+            return near_match, "HIT-SIMILAR"
+        cache_status = "MISS"
+    
+    qwen_service = get_qwen_service()
+    
+    async def generate():
+        if request.generation_mode == "fanout":
+            lecture_data = await qwen_service.generate_lecture_content_fanout_async(**lecture_generation_kwargs(request))
+        else:
+            lecture_data = await qwen_service.generate_lecture_content_async(**lecture_generation_kwargs(request))
+        
+        # Never cache the canned fallback or a partial deck - the next request should retry the LLM
+        if not lecture_data.get("fallback") and not lecture_data.get("lost_slides"):
+            await store_lecture(request, key, lecture_data)
+        return lecture_data
+    
+    # Identical requests arriving together share one LLM call
+    lecture_data = await get_single_flight("lecture").do(key, generate)
+    return lecture_data, cache_status
+
+def to_slide_instruction(slide_data: Dict[str, Any]) -> SlideInstruction:
+    """Convert a raw slide dict from QwenService into our slide format"""
+    # Handle content field - convert list to string if needed
+    content = slide_data.get("content", "")
+    
+    if isinstance(content, list):
+        content = "\n".join(str(item) for item in content)
+    elif not isinstance(content, str):
+        content = str(content)
+    
+    return SlideInstruction(
+        slide_number=slide_data.get("slide_number", 1),
+        title=slide_data.get("title", ""),
+        content=content,
+        image_prompt=slide_data.get("image_prompt", ""),
+        slide_type=slide_data.get("slide_type", "content"),
+        script=slide_data.get("script", ""),
+        code_example=slide_data.get("code_example"),
+        exercise=slide_data.get("exercise")
+    )
+
+def format_markdown(request: LectureTopicRequest, slides: List[SlideInstruction]) -> str:
+    """Generate human-readable markdown format"""
+    markdown_formatter = LectureMarkdownFormatter()
+    return markdown_formatter.format_lecture_to_markdown(
+        topic=request.topic,
+        slides=slides,
+        tone=request.tone,
+        difficulty_level=request.difficulty_level
+    )
+
+def sse_event(event: str, data: Any) -> str:
+    """Encode a single server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def build_lecture_response(request: LectureTopicRequest, bypass_cache: bool = False) -> Tuple[LectureResponse, str]:
+    """Generate (or fetch) a lecture and assemble the full response with markdown"""
+    lecture_data, cache_status = await generate_lecture_data(request, bypass_cache)
+    
+    # Convert the response to our slide format
+    slides = [to_slide_instruction(slide_data) for slide_data in lecture_data.get("slides", [])]
+    
+    lecture = LectureResponse(
+        status=1,
+        topic=request.topic,
+        duration_minutes=request.duration_minutes,
+        tone=request.tone,
+        slides=slides,
+        total_slides=len(slides),
+        markdown_content=format_markdown(request, slides),
+        lost_slides=lecture_data.get("lost_slides"),
+        near_match=lecture_data.get("near_match"),
+        usage=lecture_data.get("usage") if cache_status in ("MISS", "BYPASS") else None
+    )
+    return lecture, cache_status
+
+def lecture_batch_handler(bypass_cache: bool = False):
+    """Handler for run_jsonl_batch: one LectureTopicRequest record -> one result line"""
+    async def handle(record: Dict[str, Any]) -> Dict[str, Any]:
+        lecture, cache_status = await build_lecture_response(LectureTopicRequest(**record), bypass_cache)
+        return {"status": 1, "cache": cache_status, "response": lecture.dict()}
+    return handle
+
 @router.post("/generate-lecture", response_model=LectureResponse)
-def generate_lecture(request: LectureTopicRequest):
+async def generate_lecture(
+    request: LectureTopicRequest,
+    response: Response,
+    x_cache_bypass: Optional[str] = Header(None)
+):
     """
-    Generate a complete lecture presentation based on the topic
+    Generate a complete lecture presentation based on the topic.
+    Send "X-Cache-Bypass: 1" to skip the lecture cache.
     """
     try:
-        # Get Qwen service instance
-        qwen_service = get_qwen_service()
-        
-        # Generate lecture content using Qwen API
-        lecture_data = qwen_service.generate_lecture_content(
-            topic=request.topic,
-            duration_minutes=request.duration_minutes,
-            difficulty_level=request.difficulty_level,
-            target_audience=request.target_audience,
-            tone=request.tone,
-            add_ons=request.add_ons.dict() if request.add_ons else {}
-        )
-        
-        # Convert the response to our slide format
-        slides = []
-        for slide_data in lecture_data.get("slides", []):
-            # Handle content field - convert list to string if needed
-            content = slide_data.get("content", "")
-            
-            if isinstance(content, list):
-                content = "\n".join(str(item) for item in content)
-            elif not isinstance(content, str):
-                content = str(content)
-            
-            slide = SlideInstruction(
-                slide_number=slide_data.get("slide_number", 1),
-                title=slide_data.get("title", ""),
-                content=content,
-                image_prompt=slide_data.get("image_prompt", ""),
-                slide_type=slide_data.get("slide_type", "content"),
-                script=slide_data.get("script", ""),
-                code_example=slide_data.get("code_example"),
-                exercise=slide_data.get("exercise")
-            )
-            slides.append(slide)
-        
-        # Generate human-readable markdown format
-        markdown_formatter = LectureMarkdownFormatter()
-        markdown_content = markdown_formatter.format_lecture_to_markdown(
-            topic=request.topic,
-            slides=slides,
-            tone=request.tone,
-            difficulty_level=request.difficulty_level
-        )
-        
-        return LectureResponse(
-            status=1,
-            topic=request.topic,
-            duration_minutes=request.duration_minutes,
-            tone=request.tone,
-            slides=slides,
-            total_slides=len(slides),
-            markdown_content=markdown_content  # NEW FIELD
-        )
+        # Generate lecture content using Qwen API (or the cache)
+        lecture, cache_status = await build_lecture_response(request, is_cache_bypass(x_cache_bypass))
+        response.headers["X-Cache"] = cache_status
+        return lecture
         
+    except UpstreamError as e:
+        raise upstream_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating lecture: {str(e)}")
 
-@router.post("/generate-text", response_model=GeneratedTextResponse)
-def generate_text(prompt: str):
+@router.post("/generate-lecture/stream")
+async def generate_lecture_stream(request: LectureTopicRequest, x_cache_bypass: Optional[str] = Header(None)):
+    """
+    Stream the lecture as server-sent events: one "slide" event per slide as
+    soon as it is generated, then a "markdown" event and a final "done" event.
+    Cached lectures are replayed immediately; streamed output is not cached.
+    """
+    qwen_service = get_qwen_service()
+    cache = get_lecture_cache()
+    cached = None
+    if is_cache_bypass(x_cache_bypass):
+        cache.record_bypass()
+    else:
+        cached, _ = await cache.get(lecture_cache_key(request))
+        if cached is None:
+            cached = await find_near_match(request)
+    
+    async def cached_slides():
+        for slide_data in cached["slides"]:
+            yield slide_data
+    
+    async def event_stream():
+        slides: List[SlideInstruction] = []
+        lost_slides: List[Dict[str, Any]] = []
+        usage = empty_usage()
+        if cached is not None:
+            source = cached_slides()
+        elif request.generation_mode == "fanout":
+            source = qwen_service.stream_lecture_content_fanout_async(
+                **lecture_generation_kwargs(request), usage=usage
+            )
+        else:
+            source = qwen_service.stream_lecture_content_async(
+                **lecture_generation_kwargs(request), lost_slides=lost_slides, usage=usage
+            )
+        try:
+            async for slide_data in source:
+                slide = to_slide_instruction(slide_data)
+                slides.append(slide)
+                yield sse_event("slide", slide.dict())
+            
+            yield sse_event("markdown", {
+                "topic": request.topic,
+                "total_slides": len(slides),
+                "markdown_content": format_markdown(request, slides),
+                "lost_slides": lost_slides or None,
+                "near_match": cached.get("near_match") if cached is not None else None,
+                "usage": usage if cached is None else None
+            })
+            yield sse_event("done", {"status": 1})
+        except Exception as e:
+            yield sse_event("error", {"status": 0, "detail": f"Error generating lecture: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Cache": ("HIT-SIMILAR" if "near_match" in cached else "HIT") if cached is not None else "MISS"
+        }
+    )
+
+@router.post("/generate-batch")
+async def generate_batch(
+    http_request: Request,
+    concurrency: int = Query(BATCH_DEFAULT_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY),
+    x_cache_bypass: Optional[str] = Header(None)
+):
+    """
+    Bulk lecture generation. The body is JSONL, one LectureTopicRequest per
+    line; the response streams JSONL in completion order, each line tagged
+    with the input index: {"index", "status", "cache", "response"} or
+    {"index", "status": 0, "error"}.
+    """
+    # The body has to be read up front: once the StreamingResponse starts,
+    # Starlette's disconnect listener owns the receive channel
+    body = await http_request.body()
+    
+    async def result_lines():
+        async for result in run_jsonl_batch(
+            iter_lines(body.decode("utf-8").splitlines()),
+            lecture_batch_handler(is_cache_bypass(x_cache_bypass)),
+            concurrency
+        ):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+@router.post("/generate-text", response_model=GeneratedTextResponse, deprecated=True)
+async def generate_text(prompt: str):
     """
-    Simple text generation endpoint using Qwen API
+    Deprecated: use POST /generate-text, which also supports streaming and
+    batched prompts. Kept for existing clients.
     """
     try:
         qwen_service = get_qwen_service()
-        text = qwen_service.generate_text(prompt)
+        text = await qwen_service.generate_text_async(prompt)
         return GeneratedTextResponse(status=1, text=text)
+    except UpstreamError as e:
+        raise upstream_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating text: {str(e)}")
 
 @router.get("/lecture/{topic}")
-def get_lecture_by_topic(topic: str, duration: int = 10, difficulty: str = "beginner"):
+async def get_lecture_by_topic(
+    topic: str,
+    response: Response,
+    duration: int = 10,
+    difficulty: str = "beginner",
+    x_cache_bypass: Optional[str] = Header(None)
+):
     """
     Get lecture by topic with query parameters
     """
@@ -105,4 +331,4 @@ def get_lecture_by_topic(topic: str, duration: int = 10, difficulty: str = "begi
         duration_minutes=duration,
         difficulty_level=difficulty
     )
-    return generate_lecture(request)
\ No newline at end of file
+    return await generate_lecture(request, response, x_cache_bypass)
\ No newline at end of file
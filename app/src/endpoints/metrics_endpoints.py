@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from app.src.services import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+def get_metrics():
+    """
+    Counters published by the caches, clients and pipelines of this worker
+    """
+    return {"status": 1, "metrics": metrics.collect()}
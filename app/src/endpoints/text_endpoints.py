@@ -1,10 +1,118 @@
-from fastapi import APIRouter
-from app.src.models.model import GeneratedTextResponse, TextForGenerationPrompt
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from app.src.models.model import (
+    TextGenerationRequest,
+    GeneratedTextResponse,
+    GeneratedTextBatchResponse,
+    GeneratedTextItem
+)
+from app.src.endpoints.lecture_endpoints import get_qwen_service, sse_event
+from app.src.endpoints.errors import upstream_unavailable
+from app.src.services.qwen_service import QwenService
+from app.src.services.resilience import UpstreamError
+from app.src.services.token_usage import empty_usage, merge_usage
+from typing import List, Union
+import asyncio
+import os
 
 router = APIRouter()
 
+TEXT_BATCH_CONCURRENCY = int(os.getenv("TEXT_BATCH_CONCURRENCY", "8"))
+TEXT_BATCH_MAX_PROMPTS = 64
 
-@router.post("/generate-text", response_model=GeneratedTextResponse)
-def generate_text_prompt(prompt: TextForGenerationPrompt):
-    # Здесь — твоя логика генерации
-    return GeneratedTextResponse(status=1, text="idk")
+def request_prompts(request: TextGenerationRequest) -> List[str]:
+    """The prompts of a single or batched request, validated"""
+    if (request.text is None) == (request.prompts is None):
+        raise HTTPException(status_code=422, detail="Send either 'text' or 'prompts'")
+    prompts = [request.text] if request.text is not None else request.prompts
+    if not prompts or len(prompts) > TEXT_BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=422, detail=f"'prompts' must have 1-{TEXT_BATCH_MAX_PROMPTS} entries")
+    return prompts
+
+async def generate_batch(qwen_service: QwenService, prompts: List[str], max_tokens) -> GeneratedTextBatchResponse:
+    """Generate every prompt concurrently; one failed prompt doesn't fail the batch"""
+    semaphore = asyncio.Semaphore(TEXT_BATCH_CONCURRENCY)
+    usage = empty_usage()
+
+    async def generate_one(index: int, prompt: str) -> GeneratedTextItem:
+        async with semaphore:
+            try:
+                text, item_usage = await qwen_service.complete_text_async(prompt, max_tokens)
+            except Exception as e:
+                return GeneratedTextItem(index=index, status=0, error=str(e))
+        merge_usage(usage, item_usage)
+        return GeneratedTextItem(index=index, status=1, text=text, usage=item_usage)
+
+    results = await asyncio.gather(*(generate_one(i, prompt) for i, prompt in enumerate(prompts)))
+    status = 1 if any(result.status == 1 for result in results) else 0
+    return GeneratedTextBatchResponse(status=status, results=list(results), usage=usage)
+
+def stream_batch(qwen_service: QwenService, prompts: List[str], max_tokens) -> StreamingResponse:
+    """
+    Server-sent events: "token" {"index", "text"} for each delta of each
+    prompt (interleaved across prompts), "result" {"index", "status", "text"
+    | "error", "usage"} as each prompt finishes, then "done" with the total usage.
+    """
+    async def event_stream():
+        queue: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(TEXT_BATCH_CONCURRENCY)
+        usage = empty_usage()
+
+        async def stream_one(index: int, prompt: str):
+            item_usage = empty_usage()
+            text = ""
+            try:
+                async with semaphore:
+                    async for delta in qwen_service.stream_text_async(prompt, max_tokens, item_usage):
+                        text += delta
+                        await queue.put(("token", {"index": index, "text": delta}))
+                await queue.put(("result", {"index": index, "status": 1, "text": text, "usage": item_usage}))
+            except Exception as e:
+                await queue.put(("result", {"index": index, "status": 0, "error": str(e), "usage": item_usage}))
+            finally:
+                merge_usage(usage, item_usage)
+
+        tasks = [asyncio.create_task(stream_one(i, prompt)) for i, prompt in enumerate(prompts)]
+        try:
+            for _ in range(len(prompts)):
+                while True:
+                    event, data = await queue.get()
+                    yield sse_event(event, data)
+                    if event == "result":
+                        break
+            yield sse_event("done", {"status": 1, "usage": usage})
+        finally:
+            # Client went away - stop generating
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/generate-text", response_model=Union[GeneratedTextResponse, GeneratedTextBatchResponse])
+async def generate_text_prompt(request: TextGenerationRequest):
+    """
+    Text generation with Qwen. Send {"text": ...} for one prompt or
+    {"prompts": [...]} to generate several concurrently (batch results are
+    returned in input order). With "stream": true the answer arrives token
+    by token as server-sent events.
+    """
+    prompts = request_prompts(request)
+    qwen_service = get_qwen_service()
+
+    if request.stream:
+        return stream_batch(qwen_service, prompts, request.max_tokens)
+
+    if request.prompts is not None:
+        return await generate_batch(qwen_service, prompts, request.max_tokens)
+
+    try:
+        text, usage = await qwen_service.complete_text_async(request.text, request.max_tokens)
+        return GeneratedTextResponse(status=1, text=text, usage=usage)
+    except UpstreamError as e:
+        raise upstream_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating text: {str(e)}")
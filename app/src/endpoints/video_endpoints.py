@@ -2,13 +2,24 @@ from fastapi import APIRouter
 from app.src.models.model import GeneratedTextResponse, TextForGenerationPrompt, Slide, PromptAndImageRequest
 from fastapi.responses import FileResponse
 from app.src.endpoints.lecture_endpoints import LectureMarkdownFormatter
-from app.src.endpoints.image_endpoints import get_images_with_avatar
+from app.src.endpoints.image_endpoints import new_request_id, seedream_params, SlideJobs
+from app.src.endpoints.errors import upstream_unavailable, no_workspace
+from app.src.services.resilience import UpstreamError
+from app.src.services.higgsfield_client import SEEDREAM_PATH, VEO3_PATH
+from app.src.services.generation_cache import get_generation_cache
+from app.src.services.job_store import Job
+from app.src.services.job_ledger import ledger_request
+from app.src.services.downloader import get_downloader, DownloadError
+from app.src.services.video_merge import get_video_merger
+from app.src.services.workspaces import get_workspaces, WorkspaceFullError
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 import os
 import json
-import requests, time
-import cv2
-import numpy as np
+import asyncio
+import shutil
+import uuid
 
 from typing import List, Optional
 router = APIRouter()
@@ -16,150 +27,155 @@ router = APIRouter()
 
 load_dotenv()
 
-HF_API_KEY = os.getenv("HF_API_KEY")
-HF_SECRET = os.getenv("HF_SECRET")
-
-def check_for_generation_video(job_set_id):
-    url = "https://platform.higgsfield.ai/v1/job-sets/" + job_set_id
-    headers = {
-        "hf-api-key": HF_API_KEY,
-        "hf-secret": HF_SECRET
-    }
-
-    response = requests.get(url, headers=headers)
-    print(response)
-    if (response.status_code == 200) :
-        data = response.json()
-        jobs = data.get("jobs", [])
-        if jobs:
-            first = jobs[0]
-            status = first.get("status")
-            results = first.get("results") or {}
-            min_info = results.get("raw")
-
-            if (status == 'completed'):
-                if min_info and "url" in min_info:
-                    return min_info["url"]
-    return False
-
-def generate_single_video(slide: List[dict], avatar: str):
-    url = "https://platform.higgsfield.ai/v1/speak/veo3"
-
-    headers = {
-        "Content-Type": "application/json",
-        "hf-api-key": HF_API_KEY,
-        "hf-secret": HF_SECRET
-    }
-
-    data = {
-        "params": {
-            "model": "veo-3-fast",
-            "prompt": '''
+def veo3_params(slide: dict):
+    return {
+        "model": "veo-3-fast",
+        "prompt": '''
             You are generating a professional presentation-style explainer video.  Inputs: - Image A: presenter’s face or half-body portrait - Image B: presentation slide - Optional: audio narration (voice-over) or TTS will be provided separately  Layout requirements: - 16:9 horizontal video - Image B (slide) must fill 75–80% of the left side — full clarity, no cropping of text - Image A (human) should appear on the right side as a fixed webcam avatar - Avatar must remain fixed in size (approx 20–25% width), vertically centered - No overlapping or clutter — clean separation between presenter and slide  Motion & Behavior: - Human should appear naturally alive (subtle head motion, eye blinks, light expression) - Do NOT overly animate or distort the presenter - No camera zoom, no transitions — stable, professional composition - If audio or TTS is provided, sync mouth motion and pacing to narration  Style and atmosphere: - Modern educational / startup keynote style (TED, OpenAI DevDay, Loom, Google Meet) - Neutral lighting, realistic color retention - No effects, particles, borders, or distracting visual elements - Absolutely NO watermarks or fake UI elements  Output: - 1080p 16:9 MP4 video - Ready to serve directly as a lecture / lection preview''',
-            "quality": "basic",
-            "input_image": {
-                "type": "image_url",
-                "image_url": slide["url"]
-                },
-            "aspect_ratio": "16:9",
-            "audio_prompt": slide["script"],
-            "enhance_prompt": True
-        }
+        "quality": "basic",
+        "input_image": {
+            "type": "image_url",
+            "image_url": slide["url"]
+            },
+        "aspect_ratio": "16:9",
+        "audio_prompt": slide["script"],
+        "enhance_prompt": True
     }
 
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-
-    if response.status_code == 200:
-        data = response.json()
-        return data.get("id")
-    return False
-
-
-def get_videos_with_avatar(slides: List[dict], avatar: str):
-    # prompts = split_slides(text)
-    videosIdsAndUrls: List[dict] = []
-    # print(prompts)
-    for slide in slides:
-        job_set_id = generate_single_video(slide, avatar)
-        if (job_set_id != ''):
-            videosIdsAndUrls.append({"id": job_set_id, "url": None, "script": slide["script"], "title": slide['title'], "content": slide["content"]})
-    time.sleep(30)  
-    print(videosIdsAndUrls)
 
-    while True:
-        all_done = True
-        for img in videosIdsAndUrls:
-            if img["url"] is None:
-                result = check_for_generation_video(img["id"])  
-                if result:
-                    img["url"] = result 
-                else:
-                    all_done = False
-        if all_done:
-            break
-        time.sleep(5)
-    print(videosIdsAndUrls)
-    
-    return videosIdsAndUrls
-
-def download_video(url, filename):
-    r = requests.get(url, stream=True)
-    r.raise_for_status()
-    with open(filename, "wb") as f:
-        for chunk in r.iter_content(chunk_size=8192):
-            f.write(chunk)
+async def fetch_video(url, filename):
+    """Download a slide video, or copy it from the generation cache when it's been downloaded before"""
+    cache = get_generation_cache()
+    cached = await run_in_threadpool(cache.asset_for, url) if cache is not None else None
+    if cached is not None:
+        try:
+            await run_in_threadpool(shutil.copyfile, cached, filename)
+            return filename
+        except OSError as e:
+            # Evicted by another worker since asset_for() found it
+            print(f"Cached asset {cached} unavailable, downloading {url}: {e}")
+    await get_downloader().download(url, filename)
+    if cache is not None:
+        await run_in_threadpool(cache.store_asset, url, filename)
     return filename
 
-def merge_videos_from_urls(urls, output_file="merged.mp4"):
-    os.makedirs("videos", exist_ok=True)
-    video_files = []
-
-    for i, url in enumerate(urls):
-        filename = f"videos/video_{i}.mp4"
-        download_video(url, filename)
-        video_files.append(filename)
-
-    # Read first video for frame size and FPS
-    first = cv2.VideoCapture(video_files[0])
-    fps = first.get(cv2.CAP_PROP_FPS)
-    width = int(first.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(first.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    first.release()
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_file, fourcc, fps, (width, height))
-
-    for vf in video_files:
-        cap = cv2.VideoCapture(vf)
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            out.write(frame)
-        cap.release()
-
-    out.release()
-
 @router.post("/generate-video", response_model=GeneratedTextResponse)
-def generate_video(prompt: PromptAndImageRequest):
+async def generate_video(prompt: PromptAndImageRequest):
     markdown_formatter = LectureMarkdownFormatter()
     print(prompt.text)
     slides = LectureMarkdownFormatter.parse_markdown_to_slides(prompt.text)
     print(prompt.avatar)
     print(json.dumps(slides, indent=2, ensure_ascii=False))
-    # print(json.dumps(get_images_with_avatar(slides, "https://d3snorpfx4xhv8.cloudfront.net/c2906af4-60bf-416c-95e0-639aa06d11cd/37657c2a-3962-4575-bb80-89c2864f0be9.jpeg"), indent=2, ensure_ascii=False))
-    images = get_images_with_avatar(slides, "https://d3snorpfx4xhv8.cloudfront.net/c2906af4-60bf-416c-95e0-639aa06d11cd/37657c2a-3962-4575-bb80-89c2864f0be9.jpeg")
-    print(json.dumps(images, indent=2, ensure_ascii=False))
-    videos = get_videos_with_avatar(images, "https://d3snorpfx4xhv8.cloudfront.net/c2906af4-60bf-416c-95e0-639aa06d11cd/37657c2a-3962-4575-bb80-89c2864f0be9.jpeg")
-    print(json.dumps(videos, indent=2, ensure_ascii=False))
-    urls = []
-    for video in videos:
-        urls.append(video["url"])
-
-    output_file = "merged.mp4"
-    merge_videos_from_urls(urls, output_file=output_file)
-
-    if not os.path.exists(output_file):
-        return {"status": 0, "error": "Failed to create merged video."}
-
-    return FileResponse(output_file, media_type="video/mp4", filename="lecture_video.mp4")
+    # Each request downloads and merges in its own directory
+    request_id = uuid.uuid4().hex
+    workspaces = get_workspaces()
+    try:
+        workspace = await workspaces.create(f"request-{request_id}")
+    except WorkspaceFullError as e:
+        raise no_workspace(e)
+    try:
+        result = await build_video(slides, os.path.join(workspace.path, f"lecture_{request_id}.mp4"))
+    except UpstreamError as e:
+        workspaces.remove(workspace)
+        raise upstream_unavailable(e)
+    except BaseException:
+        workspaces.remove(workspace)
+        raise
+    if isinstance(result, FileResponse):
+        # Removed once the file has been sent
+        result.background = BackgroundTask(workspaces.remove, workspace)
+    else:
+        workspaces.remove(workspace)
+    return result
+
+async def build_video(slides: List[dict], output_file: str, job: Optional[Job] = None):
+    """
+    Every slide runs its own chain - avatar image, then veo3 video, then
+    download - as soon as the previous step of that slide is done, so the
+    deck takes about as long as its slowest slide. A slide's video is
+    merged once it and every slide before it are done. Slides whose chain
+    fails are left out of the merged video. A slide's download waits until
+    the slide MERGE_WINDOW places before it (default 4) has been merged, so
+    few clips sit on disk ahead of the merge.
+    """
+    avatar = "https://d3snorpfx4xhv8.cloudfront.net/c2906af4-60bf-416c-95e0-639aa06d11cd/37657c2a-3962-4575-bb80-89c2864f0be9.jpeg"
+    slides = [slide for slide in slides if slide]
+    request_id = new_request_id(job)
+    images = SlideJobs("seedream", SEEDREAM_PATH, stage="images", request_id=request_id)
+    videos = SlideJobs("veo3", VEO3_PATH, result="raw", stage="videos", request_id=request_id)
+    # Slide videos are downloaded next to the output file
+    download_dir = os.path.join(os.path.dirname(output_file) or ".", "videos")
+    os.makedirs(download_dir, exist_ok=True)
+    window = max(1, int(os.getenv("MERGE_WINDOW", "4")))
+    merged = [asyncio.Event() for _ in slides]
+    if job is not None:
+        job.set_progress("slides_parsed", len(slides))
+        for stage in ("images", "videos", "downloads"):
+            job.set_stage(stage, total=len(slides))
+        job.set_stage("slides")
+
+    async def run_slide(index: int, slide: dict) -> Optional[str]:
+        image = dict(await images.generate(seedream_params(slide.get("title", "") + slide.get("content", ""), avatar), index))
+        if job is not None:
+            job.item_done("images", image)
+        if not image["url"]:
+            return None
+
+        video = dict(await videos.generate(veo3_params({**slide, "url": image["url"]}), index))
+        if job is not None:
+            job.item_done("videos", video)
+        if not video["url"]:
+            return None
+
+        if index >= window:
+            await merged[index - window].wait()
+        filename = os.path.join(download_dir, f"video_{index}.mp4")
+        try:
+            await fetch_video(video["url"], filename)
+        except (DownloadError, OSError) as e:
+            print(f"Failed to download the video of slide {index}: {e}")
+            filename = None
+        if job is not None:
+            job.item_done("downloads", {"url": filename})
+        return filename
+
+    # Interrupted requests are marked resumable or expired at the next startup
+    async with ledger_request(request_id):
+        # Each slide is merged as soon as it and the slides before it are done
+        tasks = [asyncio.create_task(run_slide(i, slide)) for i, slide in enumerate(slides)]
+        # A job's video can be watched while it is merged (GET /jobs/{id}/stream)
+        session = get_video_merger().open(
+            output_file, progressive=job is not None,
+            # Stops /jobs/{id}/stream from following the file before the merge falls back
+            on_stream_end=(lambda: job.set_progress("streaming", False)) if job is not None else None
+        )
+        try:
+            for index, task in enumerate(tasks):
+                filename = await task
+                if filename:
+                    # Merging is blocking
+                    await run_in_threadpool(session.append, filename)
+                    if job is not None:
+                        job.set_progress("merged_clips", len(session.files))
+                        job.set_progress("streaming", session.streaming)
+                merged[index].set()
+            print(json.dumps(session.files, indent=2, ensure_ascii=False))
+            if not session.files:
+                session.abort()
+                return {"status": 0, "error": "No slide videos were generated."}
+
+            if job is not None:
+                job.set_stage("merge")
+            await run_in_threadpool(session.close)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            session.abort()
+            raise
+
+        if not os.path.exists(output_file):
+            return {"status": 0, "error": "Failed to create merged video."}
+        if job is not None:
+            job.set_progress("merged", True)
+
+        return FileResponse(output_file, media_type="video/mp4", filename="lecture_video.mp4")
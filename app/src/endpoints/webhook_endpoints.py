@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Header, HTTPException, Request
+from app.src.services.higgsfield_client import get_higgsfield_client
+from app.src.services.job_poller import get_job_poller
+from typing import Optional
+import hmac
+
+router = APIRouter()
+
+@router.post("/higgsfield/webhook", include_in_schema=False)
+async def higgsfield_webhook(request: Request, x_webhook_secret: Optional[str] = Header(None)):
+    """
+    Completion callback registered with every Higgsfield submission when
+    HF_WEBHOOK_URL is set. The body is the job set, as GET /v1/job-sets/{id}
+    returns it; a matching waiter is resolved immediately.
+    """
+    secret = get_higgsfield_client().webhook_secret
+    if not secret:
+        raise HTTPException(status_code=404, detail="Webhooks are not enabled")
+    if not x_webhook_secret or not hmac.compare_digest(x_webhook_secret, secret):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+    try:
+        job_set = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON job set")
+    if not isinstance(job_set, dict):
+        raise HTTPException(status_code=400, detail="Body must be a JSON job set")
+    return {"status": 1, "matched": get_job_poller().resolve(job_set)}
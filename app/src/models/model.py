@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Any
 
 # Request Models
 class AddOnsConfig(BaseModel):
@@ -15,6 +15,7 @@ class LectureTopicRequest(BaseModel):
     target_audience: Optional[str] = "general"
     tone: Optional[str] = "friendly"  # friendly, formal, exam, story
     add_ons: Optional[AddOnsConfig] = AddOnsConfig()
+    generation_mode: Optional[str] = "single"  # single, fanout (outline first, slides in parallel)
 
 # Response Models
 class SlideInstruction(BaseModel):
@@ -35,6 +36,9 @@ class LectureResponse(BaseModel):
     slides: List[SlideInstruction]
     total_slides: int
     markdown_content: Optional[str] = None  # ← NEW FIELD ADDED
+    lost_slides: Optional[List[Dict[str, Any]]] = None  # slides dropped from a malformed/truncated completion
+    usage: Optional[Dict[str, int]] = None  # LLM tokens spent on this response (absent for cache hits)
+    near_match: Optional[Dict[str, Any]] = None  # {"topic", "similarity"} when served from a lecture on a near-identical topic
 
 # Existing models
 class TextForGenerationPrompt(BaseModel):
@@ -45,13 +49,33 @@ class PromptAndImageRequest(BaseModel):
     avatar: str
 
 
+class TextGenerationRequest(BaseModel):
+    text: Optional[str] = None  # a single prompt...
+    prompts: Optional[List[str]] = None  # ...or a batch, generated concurrently
+    stream: bool = False  # server-sent "token" events instead of one JSON response
+    max_tokens: Optional[int] = None
+
 class GeneratedTextResponse(BaseModel):
     status: int
     text: str
+    usage: Optional[Dict[str, int]] = None
+
+class GeneratedTextItem(BaseModel):
+    index: int
+    status: int
+    text: Optional[str] = None
+    error: Optional[str] = None
+    usage: Optional[Dict[str, int]] = None
+
+class GeneratedTextBatchResponse(BaseModel):
+    status: int
+    results: List[GeneratedTextItem]
+    usage: Optional[Dict[str, int]] = None
 
 class ItemResult(BaseModel):
     id: str
     url: Optional[str] = None
+    error: Optional[str] = None  # set when the job failed or missed its deadline
 
 class GenerateImageResponse(BaseModel):
     status: int
@@ -67,4 +91,19 @@ class Slide(BaseModel):
     content: str
     image_prompt: Optional[str] = None
     slide_type: str
-    script: Optional[str] = None
\ No newline at end of file
+    script: Optional[str] = None
+class JobSubmittedResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+    result_url: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str  # queued, running, completed, failed
+    stage: Optional[str] = None
+    progress: Dict[str, Any] = {}
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
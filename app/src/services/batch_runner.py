@@ -0,0 +1,72 @@
+"""
+JSONL batch runner
+Runs one handler per input record under a concurrency limit and yields
+results in completion order, tagged with the record's input index
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable
+
+_DONE = object()
+
+
+async def iter_lines(lines: Iterable[str]) -> AsyncIterator[str]:
+    """Adapt a plain iterable of lines (file, stdin, request body) for run_jsonl_batch"""
+    for line in lines:
+        yield line
+
+
+async def run_jsonl_batch(
+    lines: AsyncIterator[str],
+    handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+    concurrency: int
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Parse each non-blank line as JSON and run handler(record) with at most
+    `concurrency` handlers in flight. Input is only read as fast as slots
+    free up. Yields {"index": i, ...handler result} or {"index": i,
+    "status": 0, "error": ...} as each record finishes.
+    """
+    queue: "asyncio.Queue[Any]" = asyncio.Queue()
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def run_one(index: int, line: str):
+        try:
+            result = await handler(json.loads(line))
+            await queue.put({"index": index, **result})
+        except Exception as e:
+            await queue.put({"index": index, "status": 0, "error": str(e)})
+        finally:
+            slots.release()
+
+    async def produce():
+        index = 0
+        try:
+            async for line in lines:
+                if not line.strip():
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(run_one(index, line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                index += 1
+            if tasks:
+                await asyncio.gather(*tasks)
+        except Exception as e:
+            await queue.put({"index": None, "status": 0, "error": f"Error reading batch input: {str(e)}"})
+        finally:
+            await queue.put(_DONE)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
@@ -0,0 +1,211 @@
+"""
+Concurrent, resumable downloads of generated assets (slide videos)
+One pooled httpx client, large buffered chunks, HTTP Range resume after a
+dropped connection, and size/checksum verification of every file
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import httpx
+
+from app.src.services import metrics
+from app.src.services.resilience import RetryPolicy
+
+CHUNK_SIZE = 1024 * 1024
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+_MD5_ETAG = re.compile(r'^"?([0-9a-fA-F]{32})"?$')
+
+
+class DownloadError(Exception):
+    """A download failed after retries or didn't verify"""
+
+
+class Downloader:
+    """
+    download() streams a URL into a file. The body goes to "<file>.part"
+    first and is renamed once complete; after a failure the next attempt
+    asks for the missing bytes with a Range header (and starts over if the
+    server ignores it). The result is checked against Content-Length /
+    Content-Range and, when the ETag is a plain MD5, against that digest.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_attempts: int = 4,
+        timeout: float = 60.0,
+        max_connections: int = 20
+    ):
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects=True,
+        )
+        self.retry = RetryPolicy(max_attempts=max_attempts, base_delay=0.5)
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._throughput = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self.counters = {
+            "downloads": 0, "failures": 0, "retries": 0, "resumes": 0,
+            "verify_failures": 0, "bytes": 0, "seconds": 0.0,
+        }
+
+    async def download(self, url: str, filename: str) -> str:
+        async with self._slots:
+            started = time.monotonic()
+            part = filename + ".part"
+            total: Optional[int] = None
+            etag: Optional[str] = None
+            attempt = 0
+            while True:
+                # Whatever an earlier attempt (or an earlier process) left in the part file is kept
+                received = os.path.getsize(part) if os.path.exists(part) else 0
+                digest = await asyncio.to_thread(_hash_file, part) if received else hashlib.md5()
+                try:
+                    received, digest, total, etag = await self._fetch(url, part, received, digest)
+                    break
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+                    if (status is not None and status < 500 and status not in (408, 429)) or attempt + 1 >= self.retry.max_attempts:
+                        self._count("failures")
+                        raise DownloadError(f"Download of {url} failed: {e}") from e
+                    self._count("retries")
+                    delay = self.retry.delay(attempt)
+                    attempt += 1
+                    print(f"Download of {url} interrupted ({e}), resuming in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+
+            self._verify(url, part, received, total, etag, digest)
+            os.replace(part, filename)
+            self._record(received, time.monotonic() - started)
+            return filename
+
+    async def _fetch(self, url: str, part: str, received: int, digest):
+        headers = {"Range": f"bytes={received}-"} if received else {}
+        async with self.http.stream("GET", url, headers=headers) as response:
+            if response.status_code == 416 and received:
+                # Nothing left to fetch: the part file is already complete
+                return received, digest, received, response.headers.get("etag")
+            response.raise_for_status()
+
+            total = None
+            if response.status_code == 206:
+                match = _CONTENT_RANGE.match(response.headers.get("content-range", ""))
+                if not match or int(match.group(1)) != received:
+                    os.remove(part)
+                    raise DownloadError(f"Unexpected Content-Range for {url}: {response.headers.get('content-range')}")
+                total = int(match.group(3)) if match.group(3) != "*" else None
+                self._count("resumes")
+                mode = "ab"
+            else:
+                # Full body (first attempt, or the server ignored Range)
+                received, digest, mode = 0, hashlib.md5(), "wb"
+                if response.headers.get("content-length"):
+                    total = int(response.headers["content-length"])
+
+            # Buffered here rather than by httpx, so bytes that arrived before a
+            # dropped connection still reach the part file. Writing and hashing
+            # a full buffer happen in a thread, off the event loop.
+            with open(part, mode) as f:
+                buffer = bytearray()
+                try:
+                    async for chunk in response.aiter_bytes():
+                        buffer += chunk
+                        received += len(chunk)
+                        if len(buffer) >= CHUNK_SIZE:
+                            await asyncio.to_thread(_write, f, digest, bytes(buffer))
+                            buffer.clear()
+                finally:
+                    if buffer:
+                        await asyncio.to_thread(_write, f, digest, bytes(buffer))
+            return received, digest, total, response.headers.get("etag")
+
+    def _verify(self, url: str, part: str, received: int, total: Optional[int], etag: Optional[str], digest) -> None:
+        problem = None
+        if total is not None and received != total:
+            problem = f"got {received} of {total} bytes"
+        elif received == 0:
+            problem = "empty body"
+        else:
+            match = _MD5_ETAG.match(etag or "")
+            if match and match.group(1).lower() != digest.hexdigest():
+                problem = "MD5 doesn't match the ETag"
+        if problem is not None:
+            self._count("verify_failures")
+            self._count("failures")
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+            raise DownloadError(f"Download of {url} is corrupt: {problem}")
+
+    def _record(self, size: int, seconds: float) -> None:
+        with self._lock:
+            self.counters["downloads"] += 1
+            self.counters["bytes"] += size
+            self.counters["seconds"] += seconds
+            self._throughput.append(size / max(seconds, 1e-6))
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rates = sorted(self._throughput)
+            seconds = self.counters["seconds"]
+            return {
+                **self.counters,
+                "seconds": round(seconds, 3),
+                "mbytes_per_second": round(self.counters["bytes"] / seconds / 1e6, 3) if seconds else None,
+                "p50_mbytes_per_second": round(rates[len(rates) // 2] / 1e6, 3) if rates else None,
+            }
+
+    async def close(self) -> None:
+        await self.http.aclose()
+
+
+def _write(f, digest, data: bytes) -> None:
+    f.write(data)
+    digest.update(data)
+
+
+def _hash_file(path: str):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest
+
+
+_downloader: Optional[Downloader] = None
+
+
+def get_downloader() -> Downloader:
+    """
+    Process-wide downloader configured from DOWNLOAD_CONCURRENCY,
+    DOWNLOAD_RETRY_ATTEMPTS and DOWNLOAD_TIMEOUT
+    """
+    global _downloader
+    if _downloader is None:
+        _downloader = Downloader(
+            max_concurrency=int(os.getenv("DOWNLOAD_CONCURRENCY", "4")),
+            max_attempts=int(os.getenv("DOWNLOAD_RETRY_ATTEMPTS", "4")),
+            timeout=float(os.getenv("DOWNLOAD_TIMEOUT", "60")),
+        )
+        metrics.register("downloads", _downloader.stats)
+    return _downloader
+
+
+async def close_downloader() -> None:
+    global _downloader
+    if _downloader is not None:
+        await _downloader.close()
+        _downloader = None
@@ -0,0 +1,266 @@
+"""
+Content-addressed cache of Higgsfield generation results
+Maps a hash of what was asked for (endpoint, prompt, input image, quality,
+aspect ratio, audio prompt) to the finished job set's result URL and, once
+downloaded, a local copy of the asset
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from app.src.services import metrics
+
+# Bump when prompts or the stored shape change so old entries stop matching
+GENERATION_KEY_VERSION = "v1"
+
+
+def generation_key(path: str, params: Dict[str, Any]) -> str:
+    """Canonical hash of a Higgsfield submission"""
+    input_images = params.get("input_images") or []
+    if params.get("input_image"):
+        input_images = [params["input_image"]]
+    fields = {
+        "version": GENERATION_KEY_VERSION,
+        "endpoint": path,
+        "model": params.get("model"),
+        "prompt": params.get("prompt"),
+        "input_images": [image.get("image_url") for image in input_images],
+        "quality": params.get("quality"),
+        "aspect_ratio": params.get("aspect_ratio"),
+        "audio_prompt": params.get("audio_prompt"),
+    }
+    canonical = json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    key        TEXT PRIMARY KEY,
+    job_set_id TEXT NOT NULL,
+    url        TEXT NOT NULL,
+    file       TEXT,
+    size       INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    used_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS generations_url ON generations (url);
+CREATE INDEX IF NOT EXISTS generations_used ON generations (used_at);
+CREATE INDEX IF NOT EXISTS generations_created ON generations (created_at);
+"""
+
+
+class GenerationCache:
+    """
+    LRU of finished generations, bounded by entry count and by the bytes of
+    locally stored assets, with a TTL. The index is a SQLite table (WAL
+    mode) in cache_dir shared by every worker, so the bounds hold for the
+    whole cache and an asset is only deleted along with its entry; assets
+    live next to it under assets/. Without a cache_dir the index is kept in
+    memory and no assets are stored.
+
+    Every method does blocking I/O: call them from a thread.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = ".cache/generations",
+        max_entries: int = 10000,
+        max_bytes: int = 2 * 1024 ** 3,
+        ttl_seconds: float = 86400
+    ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        path = ":memory:"
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, "index.sqlite3")
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "asset_hits": 0, "asset_stores": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """{"id", "url", "file"} of a finished generation, or None"""
+        now = time.time()
+        with self._transaction():
+            row = self._conn.execute("SELECT * FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row["created_at"] >= self.ttl_seconds:
+                self._drop([row])
+                self.counters["expirations"] += 1
+                row = None
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            self._conn.execute("UPDATE generations SET used_at = ? WHERE key = ?", (now, key))
+            self.counters["hits"] += 1
+        return {"id": row["job_set_id"], "url": row["url"], "file": row["file"]}
+
+    def set(self, key: str, job_set_id: str, url: str) -> None:
+        now = time.time()
+        with self._transaction():
+            row = self._conn.execute("SELECT * FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is not None and row["url"] == url:
+                return
+            if row is not None:
+                self._drop([row])
+            self._conn.execute(
+                "INSERT INTO generations (key, job_set_id, url, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, job_set_id, url, now, now),
+            )
+            self.counters["stores"] += 1
+            self._evict(now)
+
+    def asset_for(self, url: str) -> Optional[str]:
+        """
+        Local copy of a cached result URL, if one has been stored. Another
+        worker may evict it before it is read: copy it, and download the URL
+        when that fails.
+        """
+        with self._transaction():
+            row = self._conn.execute(
+                "SELECT key, file FROM generations WHERE url = ? AND file IS NOT NULL ORDER BY used_at DESC LIMIT 1", (url,)
+            ).fetchone()
+            if row is None or not os.path.exists(row["file"]):
+                return None
+            self._conn.execute("UPDATE generations SET used_at = ? WHERE key = ?", (time.time(), row["key"]))
+            self.counters["asset_hits"] += 1
+        return row["file"]
+
+    def store_asset(self, url: str, source: str) -> None:
+        """Keep a copy of a downloaded result next to its cache entry"""
+        if not self.cache_dir:
+            return
+        with self._lock:
+            row = self._conn.execute("SELECT key FROM generations WHERE url = ? LIMIT 1", (url,)).fetchone()
+        if row is None:
+            return
+        key = row["key"]
+        extension = os.path.splitext(url.split("?", 1)[0])[1][:8] or ".bin"
+        path = os.path.join(self.cache_dir, "assets", key + extension)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            os.close(fd)
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"Generation cache: failed to store asset {path}: {e}")
+            return
+
+        with self._transaction():
+            cursor = self._conn.execute("UPDATE generations SET file = ?, size = ? WHERE key = ?", (path, size, key))
+            if not cursor.rowcount:
+                # Evicted while the copy was being made
+                self._remove_file(path)
+                return
+            self.counters["asset_stores"] += 1
+            self._evict(time.time())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS bytes FROM generations").fetchone()
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "entries": row["n"],
+                "asset_bytes": row["bytes"],
+                "hit_ratio": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """The lock plus a write transaction, so workers evict against the same totals"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            finally:
+                self._conn.execute("COMMIT")
+
+    def _evict(self, now: float) -> None:
+        """
+        Drop expired entries, then least recently used ones until within both
+        bounds; runs inside _transaction()
+        """
+        expired = self._conn.execute(
+            "SELECT * FROM generations WHERE created_at <= ?", (now - self.ttl_seconds,)
+        ).fetchall()
+        self._drop(expired)
+        self.counters["expirations"] += len(expired)
+        row = self._conn.execute("SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS bytes FROM generations").fetchone()
+        entries, total = row["n"], row["bytes"]
+        if entries <= self.max_entries and total <= self.max_bytes:
+            return
+        victims = []
+        for row in self._conn.execute("SELECT * FROM generations ORDER BY used_at"):
+            if entries <= self.max_entries and total <= self.max_bytes:
+                break
+            victims.append(row)
+            entries -= 1
+            total -= row["size"]
+        self._drop(victims)
+        self.counters["evictions"] += len(victims)
+
+    def _drop(self, rows: List[sqlite3.Row]) -> None:
+        """Delete entries and their assets; runs inside _transaction()"""
+        for row in rows:
+            self._conn.execute("DELETE FROM generations WHERE key = ?", (row["key"],))
+            if row["file"]:
+                self._remove_file(row["file"])
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_generation_cache: Optional[GenerationCache] = None
+
+
+def get_generation_cache() -> Optional[GenerationCache]:
+    """
+    Process-wide cache configured from GENERATION_CACHE_DIR,
+    GENERATION_CACHE_MAX_ENTRIES (0 disables the cache),
+    GENERATION_CACHE_MAX_BYTES and GENERATION_CACHE_TTL seconds
+    """
+    global _generation_cache
+    max_entries = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "10000"))
+    if max_entries <= 0:
+        return None
+    if _generation_cache is None:
+        _generation_cache = GenerationCache(
+            cache_dir=os.getenv("GENERATION_CACHE_DIR", ".cache/generations") or None,
+            max_entries=max_entries,
+            max_bytes=int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(2 * 1024 ** 3))),
+            ttl_seconds=float(os.getenv("GENERATION_CACHE_TTL", "86400")),
+        )
+        metrics.register("generation_cache", _generation_cache.stats)
+    return _generation_cache
+
+
+def close_generation_cache() -> None:
+    global _generation_cache
+    if _generation_cache is not None:
+        _generation_cache.close()
+        _generation_cache = None
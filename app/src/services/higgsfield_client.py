@@ -0,0 +1,158 @@
+"""
+Async client for the Higgsfield platform API
+One pooled, keep-alive httpx client shared by every request, with
+timeouts, optional HTTP/2 and a cap on concurrent upstream calls.
+When HF_WEBHOOK_URL is set, submissions ask Higgsfield to POST the finished
+job set there (see app/src/endpoints/webhook_endpoints.py)
+"""
+
+import asyncio
+import os
+import secrets
+from typing import Any, Dict, Optional
+
+import httpx
+
+from app.src.services.resilience import get_upstream, raise_for_upstream_status
+
+try:
+    import h2  # noqa: F401  (enables httpx's HTTP/2 support)
+except ImportError:
+    h2 = None
+
+HF_DEFAULT_BASE_URL = "https://platform.higgsfield.ai"
+
+TEXT2IMAGE_PATH = "/v1/text2image/"
+SEEDREAM_PATH = "/v1/text2image/seedream"
+VEO3_PATH = "/v1/speak/veo3"
+JOB_SETS_PATH = "/v1/job-sets/"
+
+
+class HiggsfieldClient:
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        secret: Optional[str] = None,
+        base_url: Optional[str] = None,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        timeout: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        http2: Optional[bool] = None,
+        webhook_url: Optional[str] = None,
+        webhook_secret: Optional[str] = None
+    ):
+        """Settings default to the HF_* environment variables"""
+        if max_connections is None:
+            max_connections = int(os.getenv("HF_MAX_CONNECTIONS", "50"))
+        if max_keepalive_connections is None:
+            max_keepalive_connections = int(os.getenv("HF_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        if keepalive_expiry is None:
+            keepalive_expiry = float(os.getenv("HF_KEEPALIVE_EXPIRY", "30"))
+        if timeout is None:
+            timeout = float(os.getenv("HF_TIMEOUT", "30"))
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("HF_MAX_CONCURRENCY", "16"))
+        if http2 is None:
+            http2 = os.getenv("HF_HTTP2", "0").lower() in ("1", "true", "yes")
+        if http2 and h2 is None:
+            print("WARNING: HF_HTTP2 is set but the h2 package is not installed; using HTTP/1.1")
+            http2 = False
+
+        self.base_url = base_url or os.getenv("HF_BASE_URL") or HF_DEFAULT_BASE_URL
+        self.webhook_url = webhook_url or os.getenv("HF_WEBHOOK_URL") or None
+        self.webhook_secret = webhook_secret or os.getenv("HF_WEBHOOK_SECRET") or None
+        if self.webhook_url and not self.webhook_secret:
+            # Fine for one worker; several workers need a shared HF_WEBHOOK_SECRET
+            self.webhook_secret = secrets.token_urlsafe(32)
+            print("WARNING: HF_WEBHOOK_URL is set without HF_WEBHOOK_SECRET; using a per-process secret")
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={
+                "hf-api-key": api_key if api_key is not None else os.getenv("HF_API_KEY", ""),
+                "hf-secret": secret if secret is not None else os.getenv("HF_SECRET", ""),
+            },
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            http2=http2,
+        )
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def submit(self, path: str, params: Dict[str, Any]) -> str:
+        """
+        Create a job set and return its id, or "" when Higgsfield rejects
+        the request (4xx). Submissions create billable jobs, so they're only
+        retried when Higgsfield surely didn't accept them.
+        """
+        body: Dict[str, Any] = {"params": params}
+        if self.webhook_url:
+            body["webhook"] = {"url": self.webhook_url, "secret": self.webhook_secret}
+
+        async def post():
+            async with self._slots:
+                return raise_for_upstream_status(await self.http.post(path, json=body))
+
+        response = await get_upstream("higgsfield").call(post, idempotent=False, bucket="higgsfield_submit")
+        if response.status_code == 200:
+            return response.json().get("id") or ""
+        print(f"Higgsfield rejected the job: {response.status_code} {response.text}")
+        return ""
+
+    async def get_job_set(self, job_set_id: str) -> Optional[Dict[str, Any]]:
+        """Current state of a job set, or None if it can't be read"""
+        async def get():
+            async with self._slots:
+                return raise_for_upstream_status(await self.http.get(JOB_SETS_PATH + job_set_id))
+
+        response = await get_upstream("higgsfield").call(get, hedge=True, bucket="higgsfield_poll")
+        if response.status_code == 200:
+            return response.json()
+        print(f"Higgsfield job set {job_set_id}: {response.status_code} {response.text}")
+        return None
+
+    async def close(self) -> None:
+        await self.http.aclose()
+
+
+def job_set_status(job_set: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Status of the first job in a job set (queued, in_progress, completed, failed...)"""
+    jobs = (job_set or {}).get("jobs") or []
+    return jobs[0].get("status") if jobs else None
+
+
+def job_set_result_url(job_set: Optional[Dict[str, Any]], result: str = "min") -> Optional[str]:
+    """URL of a completed job set's result ("min" preview or "raw" original)"""
+    jobs = (job_set or {}).get("jobs") or []
+    if not jobs or jobs[0].get("status") != "completed":
+        return None
+    info = (jobs[0].get("results") or {}).get(result)
+    return info.get("url") if info else None
+
+
+_higgsfield_client: Optional[HiggsfieldClient] = None
+
+
+def init_higgsfield_client(**options) -> HiggsfieldClient:
+    """Create the shared client (called once at app startup)"""
+    global _higgsfield_client
+    if _higgsfield_client is None:
+        _higgsfield_client = HiggsfieldClient(**options)
+    return _higgsfield_client
+
+
+def get_higgsfield_client() -> HiggsfieldClient:
+    """Return the shared client, creating it on first use"""
+    return init_higgsfield_client()
+
+
+async def close_higgsfield_client() -> None:
+    """Close the shared client and its connection pool"""
+    global _higgsfield_client
+    if _higgsfield_client is not None:
+        await _higgsfield_client.close()
+        _higgsfield_client = None
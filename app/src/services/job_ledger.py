@@ -0,0 +1,326 @@
+"""
+Durable ledger of submitted Higgsfield job sets
+Every submission is recorded in a local SQLite database (WAL mode) with its
+request, stage and slide index, so job sets that were still running when
+the process stopped are picked up again at the next startup instead of
+being paid for twice
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from app.src.services import metrics
+from app.src.services.generation_cache import get_generation_cache
+from app.src.services.higgsfield_client import job_set_result_url
+from app.src.services.job_poller import JobDeadlineError, get_job_poller
+
+PENDING = "pending"
+COMPLETED = "completed"
+FAILED = "failed"
+EXPIRED = "expired"
+# Request (pipeline) states
+RUNNING = "running"
+RESUMABLE = "resumable"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_sets (
+    job_set_id   TEXT PRIMARY KEY,
+    request_id   TEXT NOT NULL,
+    stage        TEXT NOT NULL,
+    slide_index  INTEGER NOT NULL,
+    job_type     TEXT NOT NULL,
+    result       TEXT NOT NULL,
+    cache_key    TEXT,
+    status       TEXT NOT NULL,
+    url          TEXT,
+    error        TEXT,
+    owner        TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_sets_status ON job_sets (status, updated_at);
+CREATE INDEX IF NOT EXISTS job_sets_request ON job_sets (request_id);
+CREATE TABLE IF NOT EXISTS requests (
+    request_id TEXT PRIMARY KEY,
+    status     TEXT NOT NULL,
+    owner      TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_status ON requests (status, updated_at);
+"""
+
+
+# "<pid>:<token>" - the token tells a restarted process that got the same pid
+# (pid 1 in a container) apart from its previous incarnation
+OWNER = f"{os.getpid()}:{uuid.uuid4().hex}"
+
+
+def owner_alive(owner: str) -> bool:
+    if owner == OWNER:
+        return True
+    pid = int(owner.split(":", 1)[0])
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobLedger:
+    """
+    One row per job set. Rows are written when a job set is submitted and
+    updated when the poller sees it finish; a row left "pending" by a
+    process that no longer exists is resumed by claim_orphans().
+
+    Requests (the pipelines the job sets belong to) have a row of their own
+    while they run. One left "running" by a process that no longer exists
+    can't be continued - its inputs and its client are gone - so
+    claim_orphans() marks it "resumable" when some of its job sets completed
+    or are being resumed (re-running the request gets them from the
+    generation cache), and "expired" otherwise.
+
+    Every method blocks on SQLite: call them from a thread.
+    """
+
+    def __init__(self, path: str, retention_seconds: float = 7 * 86400):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        self.counters = {
+            "recorded": 0, "finished": 0, "resumed": 0, "expired": 0, "pruned": 0,
+            "requests_resumable": 0, "requests_expired": 0,
+        }
+        self._writes = set()
+
+    def record_submitted(
+        self,
+        job_set_id: str,
+        request_id: str,
+        stage: str,
+        slide_index: int,
+        job_type: str,
+        result: str,
+        cache_key: Optional[str] = None
+    ) -> None:
+        now = time.time()
+        with self._lock:
+            # A job set shared by several requests (single-flight) keeps its first row
+            self._conn.execute(
+                "INSERT OR IGNORE INTO job_sets (job_set_id, request_id, stage, slide_index, job_type, result,"
+                " cache_key, status, owner, submitted_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_set_id, request_id, stage, slide_index, job_type, result, cache_key, PENDING, OWNER, now, now),
+            )
+            self.counters["recorded"] += 1
+
+    def start_request(self, request_id: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO requests (request_id, status, owner, started_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (request_id, RUNNING, OWNER, now, now),
+            )
+
+    def finish_request(self, request_id: str, status: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE requests SET status = ?, updated_at = ? WHERE request_id = ?", (status, time.time(), request_id)
+            )
+
+    def on_finished(self, job_set_id: str, job_set: Optional[Dict[str, Any]], error: Optional[Exception]) -> None:
+        """Poller listener, called on the event loop: record_finished() in a thread"""
+        task = asyncio.ensure_future(asyncio.to_thread(self.record_finished, job_set_id, job_set, error))
+        self._writes.add(task)
+        task.add_done_callback(self._written)
+
+    def _written(self, task: asyncio.Future) -> None:
+        self._writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Job ledger: failed to record a finished job set: {task.exception()}")
+
+    def record_finished(self, job_set_id: str, job_set: Optional[Dict[str, Any]], error: Optional[Exception]) -> None:
+        """
+        Store the outcome of a job set and, for completed ones, put the
+        result URL into the generation cache
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, cache_key, status FROM job_sets WHERE job_set_id = ?", (job_set_id,)
+            ).fetchone()
+            if row is None or row["status"] != PENDING:
+                return
+            url = job_set_result_url(job_set, row["result"]) if error is None else None
+            if url:
+                status = COMPLETED
+            elif isinstance(error, JobDeadlineError):
+                status = EXPIRED
+            else:
+                status = FAILED
+            self._conn.execute(
+                "UPDATE job_sets SET status = ?, url = ?, error = ?, updated_at = ? WHERE job_set_id = ?",
+                (status, url, str(error) if error is not None else None, time.time(), job_set_id),
+            )
+            self.counters["finished"] += 1
+
+        cache = get_generation_cache()
+        if url and row["cache_key"] and cache is not None:
+            cache.set(row["cache_key"], job_set_id, url)
+
+    def claim_orphans(self, deadline: float) -> List[Dict[str, Any]]:
+        """
+        Take over pending job sets whose owning process is gone. Those past
+        `deadline` seconds since submission are marked expired; the rest are
+        returned with the time they have left.
+        """
+        now = time.time()
+        claimed = []
+        with self._lock:
+            # Workers starting together must not claim the same rows
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                "SELECT job_set_id, request_id, job_type, owner, submitted_at FROM job_sets WHERE status = ?",
+                (PENDING,),
+            ).fetchall()
+            for row in rows:
+                if owner_alive(row["owner"]):
+                    continue
+                remaining = deadline - (now - row["submitted_at"])
+                if remaining <= 0:
+                    self._conn.execute(
+                        "UPDATE job_sets SET status = ?, error = ?, updated_at = ? WHERE job_set_id = ?",
+                        (EXPIRED, "Deadline passed before the job set could be resumed", now, row["job_set_id"]),
+                    )
+                    self.counters["expired"] += 1
+                    continue
+                self._conn.execute(
+                    "UPDATE job_sets SET owner = ?, updated_at = ? WHERE job_set_id = ?",
+                    (OWNER, now, row["job_set_id"]),
+                )
+                claimed.append({**dict(row), "remaining": remaining})
+                self.counters["resumed"] += 1
+            self._settle_orphaned_requests(now)
+            self._conn.execute("COMMIT")
+        return claimed
+
+    def _settle_orphaned_requests(self, now: float) -> None:
+        """Mark requests left running by gone processes resumable or expired; runs in claim_orphans()"""
+        rows = self._conn.execute("SELECT request_id, owner FROM requests WHERE status = ?", (RUNNING,)).fetchall()
+        for row in rows:
+            if owner_alive(row["owner"]):
+                continue
+            usable = self._conn.execute(
+                "SELECT COUNT(*) FROM job_sets WHERE request_id = ? AND status IN (?, ?)",
+                (row["request_id"], COMPLETED, PENDING),
+            ).fetchone()[0]
+            status = RESUMABLE if usable else EXPIRED
+            self._conn.execute(
+                "UPDATE requests SET status = ?, updated_at = ? WHERE request_id = ?", (status, now, row["request_id"])
+            )
+            self.counters[f"requests_{status}"] += 1
+
+    def prune(self) -> None:
+        """Forget finished job sets and requests older than the retention period"""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM job_sets WHERE status != ? AND updated_at < ?", (PENDING, cutoff)
+            )
+            self.counters["pruned"] += cursor.rowcount
+            self._conn.execute("DELETE FROM requests WHERE status != ? AND updated_at < ?", (RUNNING, cutoff))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM job_sets GROUP BY status").fetchall()
+            requests = self._conn.execute("SELECT status, COUNT(*) AS n FROM requests GROUP BY status").fetchall()
+        return {
+            **self.counters,
+            "by_status": {row["status"]: row["n"] for row in rows},
+            "requests": {row["status"]: row["n"] for row in requests},
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_job_ledger: Optional[JobLedger] = None
+
+
+def get_job_ledger() -> Optional[JobLedger]:
+    """
+    Process-wide ledger at HF_JOB_LEDGER_PATH (empty disables it); finished
+    rows are kept for HF_JOB_LEDGER_RETENTION seconds
+    """
+    global _job_ledger
+    path = os.getenv("HF_JOB_LEDGER_PATH", ".cache/job_ledger.sqlite3")
+    if not path:
+        return None
+    if _job_ledger is None:
+        _job_ledger = JobLedger(path, retention_seconds=float(os.getenv("HF_JOB_LEDGER_RETENTION", str(7 * 86400))))
+        metrics.register("job_ledger", _job_ledger.stats)
+    return _job_ledger
+
+
+def start_job_ledger() -> int:
+    """
+    Hook the ledger up to the job poller, resume polling the job sets left
+    pending by processes that are gone and settle their requests; returns
+    how many job sets were resumed. Called once at app startup.
+    """
+    ledger = get_job_ledger()
+    if ledger is None:
+        return 0
+    poller = get_job_poller()
+    poller.add_listener(ledger.on_finished)
+    ledger.prune()
+    orphans = ledger.claim_orphans(poller.default_deadline)
+    for row in orphans:
+        future = poller.register(row["job_set_id"], row["job_type"], deadline=row["remaining"])
+        # Nobody awaits it - the outcome reaches the ledger through the listener
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    if orphans:
+        print(f"Job ledger: resumed {len(orphans)} unfinished job sets")
+    return len(orphans)
+
+
+@asynccontextmanager
+async def ledger_request(request_id: str):
+    """
+    Record a request as running in the ledger while the block runs, and as
+    completed or failed after it
+    """
+    ledger = get_job_ledger()
+    if ledger is None:
+        yield
+        return
+    await asyncio.to_thread(ledger.start_request, request_id)
+    status = FAILED
+    try:
+        yield
+        status = COMPLETED
+    finally:
+        await asyncio.to_thread(ledger.finish_request, request_id, status)
+
+
+def close_job_ledger() -> None:
+    global _job_ledger
+    if _job_ledger is not None:
+        _job_ledger.close()
+        _job_ledger = None
@@ -0,0 +1,283 @@
+"""
+Process-wide poller for Higgsfield job sets
+Requests register job set ids and await a future; one background task polls
+every pending job on a schedule learned from observed completion times.
+Webhook callbacks resolve jobs through resolve(); polling is then only the
+fallback for callbacks that are late or never arrive
+"""
+
+import asyncio
+import heapq
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.src.services import metrics
+from app.src.services.higgsfield_client import get_higgsfield_client, job_set_status
+
+TERMINAL_FAILURES = {"failed", "nsfw", "canceled", "cancelled"}
+
+# Expected completion time per job type before anything has been observed
+DEFAULT_EXPECTED_SECONDS = {
+    "text2image": 20.0,
+    "seedream": 25.0,
+    "veo3": 90.0,
+}
+EWMA_ALPHA = 0.3
+MIN_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 15.0
+# With callbacks, the first poll waits this many times the expected duration
+CALLBACK_GRACE_FACTOR = 2.0
+# Callbacks for job sets not registered yet (submit response still in flight)
+MAX_EARLY_RESULTS = 1000
+
+
+class JobError(Exception):
+    def __init__(self, job_set_id: str, status: str, message: str):
+        super().__init__(f"Job set {job_set_id} {message}")
+        self.job_set_id = job_set_id
+        self.status = status
+
+
+class JobFailedError(JobError):
+    """The job set reached a terminal failure state (failed, nsfw, canceled)"""
+
+
+class JobDeadlineError(JobError):
+    """The job set didn't finish before its deadline"""
+
+
+class _PendingJob:
+    __slots__ = ("job_set_id", "job_type", "registered_at", "deadline", "future", "polls")
+
+    def __init__(self, job_set_id: str, job_type: str, deadline: float, future: asyncio.Future):
+        self.job_set_id = job_set_id
+        self.job_type = job_type
+        self.registered_at = time.monotonic()
+        self.deadline = deadline
+        self.future = future
+        self.polls = 0
+
+
+class JobSetPoller:
+    """
+    The first poll of a job happens around the expected completion time of
+    its type (an EWMA of observed durations); after that the interval grows
+    with the job's age, between MIN_POLL_INTERVAL and MAX_POLL_INTERVAL.
+    With callbacks enabled the first poll is pushed back to
+    CALLBACK_GRACE_FACTOR times the expected time.
+    """
+
+    def __init__(self, default_deadline: float = 900.0, max_batch: int = 64, callbacks: bool = False):
+        self.default_deadline = default_deadline
+        self.max_batch = max_batch
+        self.callbacks = callbacks
+        self._jobs: Dict[str, _PendingJob] = {}
+        self._early: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._listeners: List[Callable[[str, Optional[Dict[str, Any]], Optional[Exception]], None]] = []
+        self._schedule: List[Tuple[float, str]] = []
+        self._expected: Dict[str, float] = dict(DEFAULT_EXPECTED_SECONDS)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {
+            "registered": 0, "polls": 0, "callbacks": 0, "unmatched_callbacks": 0,
+            "completed": 0, "failed": 0, "timed_out": 0, "poll_errors": 0,
+        }
+
+    async def wait(self, job_set_id: str, job_type: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Wait for a job set to complete and return its final state. Raises
+        JobFailedError or JobDeadlineError. Several callers may wait on the
+        same id; cancelling one of them doesn't affect the others.
+        """
+        return await asyncio.shield(self.register(job_set_id, job_type, deadline))
+
+    def register(self, job_set_id: str, job_type: str, deadline: Optional[float] = None) -> asyncio.Future:
+        """Start tracking a job set; the returned future resolves with its final state"""
+        job = self._jobs.get(job_set_id)
+        if job is not None:
+            return job.future
+
+        self._ensure_running()
+        now = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        job = _PendingJob(job_set_id, job_type, now + (deadline or self.default_deadline), future)
+        self._jobs[job_set_id] = job
+        self.counters["registered"] += 1
+
+        early = self._early.pop(job_set_id, None)
+        if early is not None and self._handle(job, early, time.monotonic(), polled=False):
+            return future
+
+        factor = CALLBACK_GRACE_FACTOR if self.callbacks else 0.8
+        first_poll = now + max(MIN_POLL_INTERVAL, self.expected_seconds(job_type) * factor)
+        self._schedule_poll(job, min(first_poll, job.deadline))
+        return future
+
+    def resolve(self, job_set: Dict[str, Any]) -> bool:
+        """
+        Apply a job set delivered by a webhook callback. Returns whether a
+        job waited on by this process was resolved.
+        """
+        job_set_id = (job_set or {}).get("id")
+        if not job_set_id:
+            return False
+        self.counters["callbacks"] += 1
+        job = self._jobs.get(job_set_id)
+        if job is None:
+            # The callback may beat the submit response; keep it for register()
+            self.counters["unmatched_callbacks"] += 1
+            self._early[job_set_id] = job_set
+            while len(self._early) > MAX_EARLY_RESULTS:
+                self._early.popitem(last=False)
+            return False
+        return self._handle(job, job_set, time.monotonic(), polled=False)
+
+    def add_listener(self, listener: Callable[[str, Optional[Dict[str, Any]], Optional[Exception]], None]) -> None:
+        """Call listener(job_set_id, job_set, error) whenever a job set finishes, awaited or not"""
+        self._listeners.append(listener)
+
+    def expected_seconds(self, job_type: str) -> float:
+        return self._expected.get(job_type, max(DEFAULT_EXPECTED_SECONDS.values()))
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.counters["completed"] + self.counters["failed"] + self.counters["timed_out"]
+        return {
+            **self.counters,
+            "pending": len(self._jobs),
+            "polls_per_job": round(self.counters["polls"] / finished, 2) if finished else None,
+            "expected_seconds": {name: round(value, 1) for name, value in self._expected.items()},
+        }
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for job in self._jobs.values():
+            if not job.future.done():
+                job.future.cancel()
+        self._jobs.clear()
+        self._schedule.clear()
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _schedule_poll(self, job: _PendingJob, at: float) -> None:
+        heapq.heappush(self._schedule, (at, job.job_set_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _next_interval(self, job: _PendingJob, now: float) -> float:
+        age = now - job.registered_at
+        return min(MAX_POLL_INTERVAL, max(MIN_POLL_INTERVAL, age * 0.15, self.expected_seconds(job.job_type) * 0.1))
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            due: List[_PendingJob] = []
+            while self._schedule and self._schedule[0][0] <= now and len(due) < self.max_batch:
+                _, job_set_id = heapq.heappop(self._schedule)
+                job = self._jobs.get(job_set_id)
+                if job is not None:
+                    due.append(job)
+
+            if due:
+                await asyncio.gather(*(self._poll(job) for job in due))
+                continue
+
+            timeout = self._schedule[0][0] - now if self._schedule else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, job: _PendingJob) -> None:
+        job.polls += 1
+        self.counters["polls"] += 1
+        try:
+            job_set = await get_higgsfield_client().get_job_set(job.job_set_id)
+        except Exception as e:
+            # Higgsfield is struggling (UpstreamError) - keep the job and try again later
+            self.counters["poll_errors"] += 1
+            print(f"Job poller: {e}")
+            job_set = None
+
+        if job.job_set_id not in self._jobs:
+            # A callback resolved it while the poll was in flight
+            return
+        now = time.monotonic()
+        if not self._handle(job, job_set, now):
+            self._schedule_poll(job, min(now + self._next_interval(job, now), job.deadline))
+
+    def _handle(self, job: _PendingJob, job_set: Optional[Dict[str, Any]], now: float, polled: bool = True) -> bool:
+        """Finish the job if job_set is terminal or its deadline passed; returns whether it finished"""
+        status = job_set_status(job_set)
+        if status == "completed":
+            duration = now - job.registered_at
+            if polled and job.polls == 1:
+                # It finished at some point before this first poll; assume
+                # earlier so an over-estimate shrinks instead of sticking
+                duration *= 0.75
+            self._learn(job.job_type, duration)
+            self.counters["completed"] += 1
+            self._finish(job, result=job_set)
+        elif status in TERMINAL_FAILURES:
+            self.counters["failed"] += 1
+            self._finish(job, error=JobFailedError(job.job_set_id, status, f"ended as {status}"))
+        elif polled and now >= job.deadline:
+            self.counters["timed_out"] += 1
+            self._finish(job, error=JobDeadlineError(
+                job.job_set_id, status or "unknown", f"still {status or 'unknown'} at its deadline"
+            ))
+        else:
+            return False
+        return True
+
+    def _learn(self, job_type: str, duration: float) -> None:
+        expected = self.expected_seconds(job_type)
+        self._expected[job_type] = (1 - EWMA_ALPHA) * expected + EWMA_ALPHA * duration
+
+    def _finish(self, job: _PendingJob, result: Optional[Dict[str, Any]] = None, error: Optional[Exception] = None) -> None:
+        self._jobs.pop(job.job_set_id, None)
+        for listener in self._listeners:
+            try:
+                listener(job.job_set_id, result, error)
+            except Exception as e:
+                print(f"Job poller: listener failed for {job.job_set_id}: {e}")
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+
+_job_poller: Optional[JobSetPoller] = None
+
+
+def get_job_poller() -> JobSetPoller:
+    """
+    Process-wide poller; HF_JOB_DEADLINE sets the default per-job deadline in
+    seconds, and polling backs off for callbacks when HF_WEBHOOK_URL is set
+    """
+    global _job_poller
+    if _job_poller is None:
+        _job_poller = JobSetPoller(
+            default_deadline=float(os.getenv("HF_JOB_DEADLINE", "900")),
+            callbacks=bool(os.getenv("HF_WEBHOOK_URL")),
+        )
+        metrics.register("job_poller", _job_poller.stats)
+    return _job_poller
+
+
+async def close_job_poller() -> None:
+    if _job_poller is not None:
+        await _job_poller.close()
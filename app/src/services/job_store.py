@@ -0,0 +1,355 @@
+"""
+Store for asynchronous generation jobs
+A submitted job runs as a background task in the worker that accepted it;
+its status, per-stage progress and result are written through to a SQLite
+table shared by all workers, so any worker can answer for it until it
+expires
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.src.services import metrics
+from app.src.services.job_ledger import OWNER, owner_alive
+from app.src.services.workspaces import Workspace, WorkspaceManager, get_workspaces
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id      TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    owner       TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    stage       TEXT,
+    progress    TEXT NOT NULL,
+    result      TEXT,
+    error       TEXT,
+    workdir     TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+"""
+
+
+class Job:
+    """
+    One submitted job. The image/video pipelines take an optional job and
+    report their progress on it through set_progress(), set_stage() and
+    item_done(). A job read back from the shared table (owned by another
+    worker) has no workspace or task.
+    """
+
+    def __init__(self, job_id: str, kind: str, workspace: Optional[Workspace], workdir: Optional[str] = None):
+        self.id = job_id
+        self.kind = kind
+        self.workspace = workspace
+        self.workdir = workspace.path if workspace is not None else workdir
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Changed since it was last written to the shared table
+        self.dirty = True
+
+    def set_stage(self, stage: str, total: Optional[int] = None) -> None:
+        """Enter a stage; with total, track done/failed counts for it"""
+        self.stage = stage
+        if total is not None:
+            self.progress[stage] = {"done": 0, "failed": 0, "total": total}
+        self.touch()
+
+    def set_progress(self, key: str, value: Any) -> None:
+        self.progress[key] = value
+        self.touch()
+
+    def item_done(self, stage: str, item: Dict[str, Any]) -> None:
+        """Count one finished item of a stage; items with an "error" count as failed"""
+        counts = self.progress.setdefault(stage, {"done": 0, "failed": 0, "total": None})
+        counts["failed" if item.get("error") or not item.get("url") else "done"] += 1
+        self.touch()
+
+    def touch(self) -> None:
+        self.updated_at = time.time()
+        self.dirty = True
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (COMPLETED, FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    def to_row(self) -> tuple:
+        return (
+            self.id, self.kind, OWNER, self.status, self.stage,
+            json.dumps(self.progress, default=str), json.dumps(self.result, default=str), self.error,
+            self.workdir, self.created_at, self.updated_at, self.finished_at,
+        )
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        job = cls(row["job_id"], row["kind"], None, workdir=row["workdir"])
+        job.status = row["status"]
+        job.stage = row["stage"]
+        job.progress = json.loads(row["progress"])
+        job.result = json.loads(row["result"]) if row["result"] else None
+        job.error = row["error"]
+        job.created_at = row["created_at"]
+        job.updated_at = row["updated_at"]
+        job.finished_at = row["finished_at"]
+        job.dirty = False
+        if not job.finished and not owner_alive(row["owner"]):
+            # The worker running it is gone, and so is the task
+            job.status = FAILED
+            job.error = "The worker running this job exited"
+        return job
+
+
+class JobStore:
+    """
+    Finished jobs are kept for `ttl` seconds (and at most `max_jobs` are
+    kept at all); when a job is dropped its workspace goes with it, and a
+    job whose workspace is evicted to stay under the disk cap is dropped.
+    At most `max_running` jobs run at once, the rest wait as "queued".
+
+    With a path, every job is also written to a SQLite table that all
+    workers share: the owner inserts it on submit and then writes changed
+    jobs every flush_interval seconds from a background task, off the
+    event loop. get() falls back to that table for jobs of other workers.
+    """
+
+    def __init__(
+        self,
+        workspaces: WorkspaceManager,
+        ttl: float = 3600.0,
+        max_jobs: int = 1000,
+        max_running: int = 4,
+        path: Optional[str] = None,
+        flush_interval: float = 0.5
+    ):
+        self.workspaces = workspaces
+        self.workspaces.on_evict = self._evicted
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.path = path
+        self.flush_interval = flush_interval
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._slots = asyncio.Semaphore(max_running)
+        # Rows to delete at the next flush (expired, dropped or evicted jobs)
+        self._deleted: List[str] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self.counters = {
+            "submitted": 0, "completed": 0, "failed": 0, "expired": 0, "dropped": 0, "evicted": 0, "remote_reads": 0,
+        }
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            with self._db_lock:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.executescript(SCHEMA)
+
+    async def submit(self, kind: str, run: Callable[[Job], Awaitable[Any]]) -> Job:
+        """
+        Create a job and start run(job) in the background; its return value
+        becomes the result. Raises WorkspaceFullError when there's no disk
+        room for it.
+        """
+        self._expire()
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, kind, await self.workspaces.create(f"job-{job_id}"))
+        self._jobs[job_id] = job
+        self.counters["submitted"] += 1
+        if self._conn is not None:
+            # Written right away, so the id resolves on every worker as soon as it's returned
+            job.dirty = False
+            await asyncio.to_thread(self._write, [job], [])
+            if self._flusher is None:
+                self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        job.task = asyncio.get_running_loop().create_task(self._run(job, run))
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        """The job, from this worker's memory or, if another worker owns it, from the shared table"""
+        self._expire()
+        job = self._jobs.get(job_id)
+        if job is not None or self._conn is None:
+            return job
+        self.counters["remote_reads"] += 1
+        return await asyncio.to_thread(self._read, job_id)
+
+    async def refresh(self, job: Job) -> Optional[Job]:
+        """Current state of a job returned by get(); None once it's gone"""
+        if job.task is not None:
+            return job if job.id in self._jobs else None
+        return await self.get(job.id)
+
+    def stats(self) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for job in self._jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {**self.counters, "jobs": len(self._jobs), "by_status": statuses}
+
+    async def close(self) -> None:
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        if self._conn is not None:
+            await self._flush()
+            with self._db_lock:
+                self._conn.close()
+            self._conn = None
+
+    async def _run(self, job: Job, run: Callable[[Job], Awaitable[Any]]) -> None:
+        async with self._slots:
+            job.status = RUNNING
+            job.touch()
+            try:
+                job.result = await run(job)
+                job.status = COMPLETED
+                self.counters["completed"] += 1
+            except asyncio.CancelledError:
+                job.status = FAILED
+                job.error = "Job was cancelled"
+                raise
+            except Exception as e:
+                print(f"Job {job.id} ({job.kind}) failed: {e}")
+                job.status = FAILED
+                job.error = str(e)
+                self.counters["failed"] += 1
+            finally:
+                job.finished_at = time.time()
+                job.touch()
+                await self.workspaces.release(job.workspace)
+
+    def _expire(self) -> None:
+        now = time.time()
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if not job.finished:
+                continue
+            if now - job.finished_at > self.ttl:
+                self._drop(job_id, "expired")
+            elif len(self._jobs) > self.max_jobs:
+                self._drop(job_id, "dropped")
+
+    def _drop(self, job_id: str, reason: str) -> None:
+        job = self._jobs.pop(job_id)
+        self.counters[reason] += 1
+        self._deleted.append(job_id)
+        self.workspaces.remove(job.workspace)
+
+    def _evicted(self, workspace: Workspace) -> None:
+        for job_id, job in list(self._jobs.items()):
+            if job.workspace is workspace:
+                del self._jobs[job_id]
+                self._deleted.append(job_id)
+                self.counters["evicted"] += 1
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self._flush()
+            except sqlite3.Error as e:
+                print(f"Job store: failed to write jobs to {self.path}: {e}")
+
+    async def _flush(self) -> None:
+        changed = [job for job in self._jobs.values() if job.dirty]
+        deleted, self._deleted = self._deleted, []
+        if not changed and not deleted:
+            return
+        for job in changed:
+            job.dirty = False
+        await asyncio.to_thread(self._write, changed, deleted)
+
+    def _write(self, jobs: List[Job], deleted: List[str]) -> None:
+        rows = [job.to_row() for job in jobs]
+        cutoff = time.time() - self.ttl
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO jobs (job_id, kind, owner, status, stage, progress, result, error,"
+                    " workdir, created_at, updated_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in deleted])
+                # Rows of workers that are gone would otherwise stay forever
+                self._conn.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+            finally:
+                self._conn.execute("COMMIT")
+
+    def _read(self, job_id: str) -> Optional[Job]:
+        with self._db_lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row["finished_at"] is not None and time.time() - row["finished_at"] > self.ttl:
+            return None
+        return Job.from_row(row)
+
+
+_job_store: Optional[JobStore] = None
+
+
+def get_job_store() -> JobStore:
+    """
+    Process-wide job store configured from JOB_TTL seconds, JOB_MAX_JOBS
+    and JOB_MAX_RUNNING; job files are written to per-job workspaces and
+    job state is shared with the other workers through JOB_STORE_PATH
+    (empty keeps it in this worker only)
+    """
+    global _job_store
+    if _job_store is None:
+        _job_store = JobStore(
+            workspaces=get_workspaces(),
+            ttl=float(os.getenv("JOB_TTL", "3600")),
+            max_jobs=int(os.getenv("JOB_MAX_JOBS", "1000")),
+            max_running=int(os.getenv("JOB_MAX_RUNNING", "4")),
+            path=os.getenv("JOB_STORE_PATH", ".cache/jobs.sqlite3") or None,
+        )
+        metrics.register("jobs", _job_store.stats)
+    return _job_store
+
+
+async def close_job_store() -> None:
+    global _job_store
+    if _job_store is not None:
+        await _job_store.close()
+        _job_store = None
@@ -0,0 +1,233 @@
+"""
+Two-tier cache for generated lectures
+In-memory LRU with TTL in front of an on-disk store shared by all workers
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.src.services import metrics
+
+# Bump when prompts or the stored shape change so old entries stop matching
+CACHE_KEY_VERSION = "v1"
+
+
+class LectureCache:
+    """
+    Bounded LRU of lecture payloads backed by one JSON file per key.
+
+    Files are written atomically (temp file + rename), so several uvicorn
+    workers can share the same cache_dir without locking. Disk reads and
+    writes run in a thread. At most every sweep_interval seconds a store
+    also sweeps the disk tier: expired files are deleted, then the oldest
+    ones until at most max_disk_entries are left.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: float = 86400,
+        cache_dir: Optional[str] = ".cache/lectures",
+        max_disk_entries: int = 10000,
+        sweep_interval: float = 600.0
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "bypasses": 0,
+            "disk_removed": 0,
+        }
+
+    @staticmethod
+    def make_key(
+        topic: str,
+        duration_minutes: Optional[int] = 10,
+        difficulty_level: Optional[str] = "beginner",
+        target_audience: Optional[str] = "general",
+        tone: Optional[str] = "friendly",
+        add_ons: Optional[Dict[str, bool]] = None,
+        **extra: Any
+    ) -> str:
+        """Canonical hash of the normalized request parameters"""
+        params = {
+            "version": CACHE_KEY_VERSION,
+            "topic": " ".join((topic or "").lower().split()),
+            "duration_minutes": int(duration_minutes or 10),
+            "difficulty_level": (difficulty_level or "beginner").strip().lower(),
+            "target_audience": (target_audience or "general").strip().lower(),
+            "tone": (tone or "friendly").strip().lower(),
+            "add_ons": {name: bool(enabled) for name, enabled in (add_ons or {}).items()},
+        }
+        params.update(extra)
+        canonical = json.dumps(params, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """
+        Look the key up in memory, then on disk.
+        Returns (value, tier) where tier is "memory", "disk" or "miss".
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value, "memory"
+                del self._memory[key]
+                self.counters["expirations"] += 1
+
+        entry = await asyncio.to_thread(self._read_disk, key, now)
+        with self._lock:
+            if entry is None:
+                self.counters["misses"] += 1
+                return None, "miss"
+            self.counters["disk_hits"] += 1
+            self._remember(key, *entry)
+        return entry[1], "disk"
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, value)
+            self.counters["stores"] += 1
+            sweep = bool(self.cache_dir) and created_at - self._last_sweep >= self.sweep_interval
+            if sweep:
+                self._last_sweep = created_at
+        await asyncio.to_thread(self._write_disk, key, created_at, value)
+        if sweep:
+            await asyncio.to_thread(self.sweep)
+
+    def sweep(self) -> int:
+        """Delete expired disk entries, then the oldest beyond max_disk_entries; returns how many"""
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        kept = []
+        doomed = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if mtime < cutoff:
+                    doomed.append(path)
+                elif filename.endswith(".json"):
+                    kept.append((mtime, path))
+        if len(kept) > self.max_disk_entries:
+            kept.sort()
+            doomed.extend(path for _, path in kept[:len(kept) - self.max_disk_entries])
+        removed = 0
+        for path in doomed:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self.counters["disk_removed"] += removed
+        return removed
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.counters["bypasses"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _remember(self, key: str, created_at: float, value: Dict[str, Any]) -> None:
+        """Insert into the LRU; caller holds the lock"""
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str, now: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Lecture cache: unreadable entry {path}: {e}")
+            return None
+
+        created_at = stored.get("created_at", 0)
+        if now - created_at >= self.ttl_seconds:
+            with self._lock:
+                self.counters["expirations"] += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return created_at, stored.get("data")
+
+    def _write_disk(self, key: str, created_at: float, value: Dict[str, Any]) -> None:
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"created_at": created_at, "data": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Lecture cache: failed to write {path}: {e}")
+
+
+_lecture_cache: Optional[LectureCache] = None
+
+
+def get_lecture_cache() -> LectureCache:
+    """Process-wide cache configured from LECTURE_CACHE_* environment variables"""
+    global _lecture_cache
+    if _lecture_cache is None:
+        _lecture_cache = LectureCache(
+            max_entries=int(os.getenv("LECTURE_CACHE_MAX_ENTRIES", "256")),
+            ttl_seconds=float(os.getenv("LECTURE_CACHE_TTL", "86400")),
+            cache_dir=os.getenv("LECTURE_CACHE_DIR", ".cache/lectures") or None,
+            max_disk_entries=int(os.getenv("LECTURE_CACHE_DISK_MAX_ENTRIES", "10000")),
+            sweep_interval=float(os.getenv("LECTURE_CACHE_SWEEP_INTERVAL", "600")),
+        )
+        metrics.register("lecture_cache", _lecture_cache.stats)
+    return _lecture_cache
@@ -0,0 +1,18 @@
+"""
+Process-local metrics registry
+Services register a stats provider; GET /metrics collects them all
+"""
+
+from typing import Any, Callable, Dict
+
+_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register(name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+    """Register (or replace) the stats provider published under name"""
+    _providers[name] = provider
+
+
+def collect() -> Dict[str, Any]:
+    """Snapshot every registered provider"""
+    return {name: provider() for name, provider in _providers.items()}
@@ -1,19 +1,303 @@
 import os
-from openai import OpenAI
-from typing import List, Dict, Any, Optional
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 import json
+import asyncio
+from app.src.services.slide_stream_parser import SlideStreamParser, recover_slides
+from app.src.services.token_usage import get_token_usage, empty_usage, add_usage, merge_usage
+from app.src.services.resilience import get_upstream, UpstreamError, CircuitOpenError
+
+DASHSCOPE_BASE_URL = "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"
+QWEN_MODEL = "qwen3-max-preview"
+
+# Fan-out mode: one outline call, then one call per slide
+FANOUT_MAX_SLIDES = 40
+FANOUT_DEFAULT_CONCURRENCY = 4
+
+# Completion budget: estimated output tokens per slide and per add-on
+BUDGET_OVERHEAD_TOKENS = 200
+BUDGET_TOKENS_PER_SLIDE = 320
+BUDGET_ADD_ON_TOKENS_PER_SLIDE = {
+    "code_examples": 380,
+    "exercises": 120,
+    "visuals": 60,
+}
+BUDGET_QA_SECTION_TOKENS = 350
+BUDGET_MIN_TOKENS = 800
+
+# Follow-up requests allowed when a completion stops for length
+MAX_CONTINUATIONS = 2
+CONTINUE_PROMPT = "Your previous response was cut off. Continue EXACTLY where it stopped - no repetition, no commentary, no code fences."
+
+# Tone-specific instructions
+TONE_INSTRUCTIONS = {
+    "friendly": "Use conversational language, analogies, and relatable examples. Be encouraging and supportive.",
+    "formal": "Use precise academic language, formal structure, and authoritative tone. Cite concepts properly.",
+    "exam": "Focus on testable knowledge, key definitions, common pitfalls, and exam strategies. Be direct and comprehensive.",
+    "story": "Use narrative structure, real-world scenarios, and character-driven examples. Make it engaging and memorable."
+}
+
+# Difficulty-specific instructions
+DIFFICULTY_INSTRUCTIONS = {
+    "beginner": "Start with fundamentals. Use simple language. Provide step-by-step explanations. Include many examples.",
+    "intermediate": "Assume basic knowledge. Focus on practical application. Include best practices and common patterns.",
+    "advanced": "Deep technical details. Discuss trade-offs, optimizations, and edge cases. Reference advanced concepts."
+}
+
+# Process-wide async client, shared by every request (see main.py lifespan)
+_async_client: Optional[AsyncOpenAI] = None
+
+
+def _get_api_key() -> str:
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        raise ValueError("DASHSCOPE_API_KEY environment variable is required")
+    return api_key
+
+
+def _base_url() -> str:
+    """DASHSCOPE_BASE_URL overrides the endpoint, e.g. to point at stubs/qwen_stub.py"""
+    return os.getenv("DASHSCOPE_BASE_URL") or DASHSCOPE_BASE_URL
+
+
+def create_async_client(
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+    keepalive_expiry: Optional[float] = None,
+    timeout: Optional[float] = None
+) -> AsyncOpenAI:
+    """
+    Build an AsyncOpenAI client on top of a keep-alive httpx connection pool.
+    Limits default to the QWEN_* environment variables.
+    """
+    if max_connections is None:
+        max_connections = int(os.getenv("QWEN_MAX_CONNECTIONS", "100"))
+    if max_keepalive_connections is None:
+        max_keepalive_connections = int(os.getenv("QWEN_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    if keepalive_expiry is None:
+        keepalive_expiry = float(os.getenv("QWEN_KEEPALIVE_EXPIRY", "30"))
+    if timeout is None:
+        timeout = float(os.getenv("QWEN_TIMEOUT", "120"))
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(timeout, connect=10.0),
+    )
+    return AsyncOpenAI(
+        api_key=_get_api_key(),
+        base_url=_base_url(),
+        http_client=http_client,
+        # Retries are handled by the resilience layer (see _complete*)
+        max_retries=0,
+    )
+
+
+def init_async_client(**pool_options) -> AsyncOpenAI:
+    """Create the shared async client (called once at app startup)"""
+    global _async_client
+    if _async_client is None:
+        _async_client = create_async_client(**pool_options)
+    return _async_client
+
+
+def get_async_client() -> AsyncOpenAI:
+    """Return the shared async client, creating it on first use"""
+    return init_async_client()
+
+
+async def close_async_client() -> None:
+    """Close the shared async client and its connection pool"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
 
 class QwenService:
-    def __init__(self):
-        api_key = os.getenv("DASHSCOPE_API_KEY")
-        if not api_key:
-            raise ValueError("DASHSCOPE_API_KEY environment variable is required")
-        
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url="https://dashscope-intl.aliyuncs.com/compatible-mode/v1",
+    def __init__(self, async_client: Optional[AsyncOpenAI] = None):
+        self._api_key = _get_api_key()
+        self._client: Optional[OpenAI] = None
+        self.async_client = async_client or get_async_client()
+
+    @property
+    def client(self) -> OpenAI:
+        """Blocking client, only built when a sync method is used"""
+        if self._client is None:
+            self._client = OpenAI(
+                api_key=self._api_key,
+                base_url=_base_url(),
+                max_retries=0,
+            )
+        return self._client
+
+    @staticmethod
+    def _lecture_slide_count(duration_minutes: int) -> int:
+        # Calculate optimal slide count based on duration
+        return max(3, min(8, duration_minutes // 2))
+
+    @staticmethod
+    def _completion_budget(slides_count: int, add_ons: Dict[str, bool]) -> int:
+        """max_tokens sized to the deck instead of a flat 4000"""
+        per_slide = BUDGET_TOKENS_PER_SLIDE + sum(
+            tokens for name, tokens in BUDGET_ADD_ON_TOKENS_PER_SLIDE.items() if add_ons.get(name, False)
         )
-    
+        budget = BUDGET_OVERHEAD_TOKENS + slides_count * per_slide
+        if add_ons.get("qa_section", False):
+            budget += BUDGET_QA_SECTION_TOKENS
+        max_budget = int(os.getenv("QWEN_MAX_COMPLETION_TOKENS", "8192"))
+        return max(BUDGET_MIN_TOKENS, min(max_budget, budget))
+
+    @staticmethod
+    def _continuation_messages(messages: List[Dict[str, str]], content: str) -> List[Dict[str, str]]:
+        return messages + [
+            {"role": "assistant", "content": content},
+            {"role": "user", "content": CONTINUE_PROMPT}
+        ]
+
+    @staticmethod
+    def _request(conversation: List[Dict[str, str]], max_tokens: Optional[int], stream: bool = False) -> Dict[str, Any]:
+        """Keyword arguments of a chat completion request"""
+        request = {
+            "model": QWEN_MODEL,
+            "messages": conversation,
+            "stream": stream,
+            "temperature": 0.7,
+        }
+        if max_tokens:
+            request["max_tokens"] = max_tokens
+        if stream:
+            request["extra_body"] = {"stream_options": {"include_usage": True}}
+        return request
+
+    @staticmethod
+    def _absorb(response, usage: Dict[str, int]):
+        """Count a non-streamed response's usage; returns its choice"""
+        usage["calls"] += 1
+        add_usage(usage, response.usage)
+        return response.choices[0]
+
+    def _follow_up(
+        self, messages: List[Dict[str, str]], content: str, finish_reason: Optional[str], usage: Dict[str, int]
+    ) -> Optional[List[Dict[str, str]]]:
+        """The conversation that continues a completion cut off by max_tokens, or None when it's done"""
+        if finish_reason != "length":
+            return None
+        if usage["continuations"] >= MAX_CONTINUATIONS:
+            usage["truncated"] = 1
+            return None
+        usage["continuations"] += 1
+        return self._continuation_messages(messages, content)
+
+    def _complete(
+        self, messages: List[Dict[str, str]], max_tokens: Optional[int], operation: str,
+        add_ons: Optional[Dict[str, bool]] = None
+    ) -> Tuple[str, Dict[str, int]]:
+        """Blocking completion; continues automatically when cut off by max_tokens"""
+        content = ""
+        usage = empty_usage()
+        conversation = messages
+        try:
+            while conversation is not None:
+                request = self._request(conversation, max_tokens)
+                response = get_upstream("qwen").call_sync(
+                    lambda: self.client.chat.completions.create(**request),
+                    bucket="qwen"
+                )
+                choice = self._absorb(response, usage)
+                content += choice.message.content or ""
+                conversation = self._follow_up(messages, content, choice.finish_reason, usage)
+        finally:
+            get_token_usage().record(operation, add_ons, usage, max_tokens)
+        return content, usage
+
+    async def _complete_async(
+        self, messages: List[Dict[str, str]], max_tokens: Optional[int], operation: str,
+        add_ons: Optional[Dict[str, bool]] = None
+    ) -> Tuple[str, Dict[str, int]]:
+        """Async completion on the shared client; continues when cut off by max_tokens"""
+        content = ""
+        usage = empty_usage()
+        conversation = messages
+        try:
+            while conversation is not None:
+                request = self._request(conversation, max_tokens)
+                response = await get_upstream("qwen").call(
+                    lambda: self.async_client.chat.completions.create(**request),
+                    hedge=True,
+                    bucket="qwen"
+                )
+                choice = self._absorb(response, usage)
+                content += choice.message.content or ""
+                conversation = self._follow_up(messages, content, choice.finish_reason, usage)
+        finally:
+            get_token_usage().record(operation, add_ons, usage, max_tokens)
+        return content, usage
+
+    async def _stream_completion_async(
+        self, messages: List[Dict[str, str]], max_tokens: Optional[int], operation: str,
+        add_ons: Optional[Dict[str, bool]], usage: Dict[str, int]
+    ) -> AsyncIterator[str]:
+        """
+        Stream content deltas; a completion stopped for length is continued
+        in a follow-up stream. Token usage is accumulated into usage.
+        """
+        content = ""
+        conversation = messages
+        try:
+            while conversation is not None:
+                request = self._request(conversation, max_tokens, stream=True)
+                # Only opening the stream is retried; deltas already yielded can't be taken back
+                stream = await get_upstream("qwen").call(
+                    lambda: self.async_client.chat.completions.create(**request),
+                    bucket="qwen"
+                )
+                usage["calls"] += 1
+                finish_reason = None
+                async for chunk in stream:
+                    add_usage(usage, getattr(chunk, "usage", None))
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+                    delta = choice.delta.content
+                    if delta:
+                        content += delta
+                        yield delta
+                conversation = self._follow_up(messages, content, finish_reason, usage)
+        finally:
+            get_token_usage().record(operation, add_ons, usage, max_tokens)
+
+    def _build_lecture_messages(
+        self,
+        topic: str,
+        duration_minutes: int,
+        difficulty_level: str,
+        target_audience: str,
+        tone: str,
+        add_ons: Dict[str, bool]
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages for a lecture generation request"""
+        slides_count = self._lecture_slide_count(duration_minutes)
+        
+        # Build comprehensive system message
+        system_message = self._build_system_message(difficulty_level, target_audience, tone)
+        
+        # Build structured user prompt
+        user_prompt = self._build_user_prompt(
+            topic, duration_minutes, slides_count, difficulty_level, 
+            target_audience, tone, add_ons
+        )
+        return [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_prompt}
+        ]
+
     def generate_lecture_content(
         self, 
         topic: str, 
@@ -29,40 +313,318 @@ class QwenService:
         if add_ons is None:
             add_ons = {}
         
-        # Calculate optimal slide count based on duration
-        slides_count = max(3, min(8, duration_minutes // 2))
-        
-        # Build comprehensive system message
-        system_message = self._build_system_message(difficulty_level, target_audience, tone)
-        
-        # Build structured user prompt
-        user_prompt = self._build_user_prompt(
-            topic, duration_minutes, slides_count, difficulty_level, 
-            target_audience, tone, add_ons
+        messages = self._build_lecture_messages(
+            topic, duration_minutes, difficulty_level, target_audience, tone, add_ons
         )
         
+        max_tokens = self._completion_budget(self._lecture_slide_count(duration_minutes), add_ons)
+        
         try:
-            response = self.client.chat.completions.create(
-                model="qwen3-max-preview",
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_prompt}
-                ],
-                stream=False,
-                temperature=0.7,
-                max_tokens=4000,
-            )
-            
-            content = response.choices[0].message.content
+            content, usage = self._complete(messages, max_tokens, "lecture", add_ons)
             
             # Parse and validate JSON
             parsed_data = self._extract_and_validate_json(content, topic, add_ons)
+            parsed_data["usage"] = usage
+            return parsed_data
+                
+        except UpstreamError:
+            # Retries are exhausted or the circuit is open - let the caller report it
+            raise
+        except Exception as e:
+            print(f"Error calling Qwen API: {e}")
+            return self._create_fallback_response(topic, str(e), add_ons)
+
+    async def generate_lecture_content_async(
+        self, 
+        topic: str, 
+        duration_minutes: int = 10,
+        difficulty_level: str = "beginner",
+        target_audience: str = "general",
+        tone: str = "friendly",
+        add_ons: Optional[Dict[str, bool]] = None
+    ) -> Dict[str, Any]:
+        """
+        Async variant of generate_lecture_content using the shared client
+        """
+        if add_ons is None:
+            add_ons = {}
+        
+        messages = self._build_lecture_messages(
+            topic, duration_minutes, difficulty_level, target_audience, tone, add_ons
+        )
+        
+        max_tokens = self._completion_budget(self._lecture_slide_count(duration_minutes), add_ons)
+        
+        try:
+            content, usage = await self._complete_async(messages, max_tokens, "lecture", add_ons)
+            parsed_data = self._extract_and_validate_json(content, topic, add_ons)
+            parsed_data["usage"] = usage
             return parsed_data
                 
+        except UpstreamError:
+            # Retries are exhausted or the circuit is open - let the caller report it
+            raise
         except Exception as e:
             print(f"Error calling Qwen API: {e}")
             return self._create_fallback_response(topic, str(e), add_ons)
     
+    async def stream_lecture_content_async(
+        self, 
+        topic: str, 
+        duration_minutes: int = 10,
+        difficulty_level: str = "beginner",
+        target_audience: str = "general",
+        tone: str = "friendly",
+        add_ons: Optional[Dict[str, bool]] = None,
+        lost_slides: Optional[List[Dict[str, Any]]] = None,
+        usage: Optional[Dict[str, int]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the completion and yield each normalized slide as soon as
+        its JSON object closes. Slides that can't be recovered are appended
+        to lost_slides, and token usage is added to usage, when passed in.
+        """
+        if add_ons is None:
+            add_ons = {}
+        
+        messages = self._build_lecture_messages(
+            topic, duration_minutes, difficulty_level, target_audience, tone, add_ons
+        )
+        max_tokens = self._completion_budget(self._lecture_slide_count(duration_minutes), add_ons)
+        if usage is None:
+            usage = empty_usage()
+        parser = SlideStreamParser()
+        emitted = 0
+        
+        try:
+            async for delta in self._stream_completion_async(messages, max_tokens, "lecture_stream", add_ons, usage):
+                for slide in parser.feed(delta):
+                    yield self._normalize_slide(slide, emitted, add_ons)
+                    emitted += 1
+        except UpstreamError:
+            raise
+        except Exception as e:
+            print(f"Error streaming from Qwen API: {e}")
+            if emitted == 0:
+                for slide in self._create_fallback_response(topic, str(e), add_ons)["slides"]:
+                    yield slide
+                return
+        
+        # Whatever the stream ended with (truncation, dropped connection)
+        for slide in parser.close():
+            yield self._normalize_slide(slide, emitted, add_ons)
+            emitted += 1
+        if lost_slides is not None:
+            lost_slides.extend(parser.lost_slides)
+        
+        # Nothing could be picked out incrementally - parse the whole document
+        if emitted == 0:
+            parsed_data = self._extract_and_validate_json(parser.buffer, topic, add_ons)
+            for slide in parsed_data.get("slides", []):
+                yield slide
+    
+    async def generate_lecture_content_fanout_async(
+        self, 
+        topic: str, 
+        duration_minutes: int = 10,
+        difficulty_level: str = "beginner",
+        target_audience: str = "general",
+        tone: str = "friendly",
+        add_ons: Optional[Dict[str, bool]] = None,
+        max_concurrency: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Outline-then-fan-out generation: one short outline call, then every
+        slide is expanded by its own concurrent call. Returns the same
+        {"slides": [...]} structure as generate_lecture_content.
+        """
+        if add_ons is None:
+            add_ons = {}
+        usage = empty_usage()
+        
+        outline = await self._generate_outline_async(
+            topic, duration_minutes, difficulty_level, target_audience, tone, usage
+        )
+        if not outline:
+            fallback = self._create_fallback_response(topic, "Outline generation failed", add_ons)
+            fallback["usage"] = usage
+            return fallback
+        
+        semaphore = asyncio.Semaphore(max_concurrency or self._fanout_concurrency())
+        slides = await asyncio.gather(*(
+            self._expand_slide_async(
+                topic, entry, outline, difficulty_level, target_audience, tone, add_ons, semaphore, usage
+            )
+            for entry in outline
+        ))
+        parsed_data = self._normalize_slides({"slides": list(slides)}, add_ons)
+        parsed_data["usage"] = usage
+        return parsed_data
+
+    async def stream_lecture_content_fanout_async(
+        self, 
+        topic: str, 
+        duration_minutes: int = 10,
+        difficulty_level: str = "beginner",
+        target_audience: str = "general",
+        tone: str = "friendly",
+        add_ons: Optional[Dict[str, bool]] = None,
+        max_concurrency: Optional[int] = None,
+        usage: Optional[Dict[str, int]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Fan-out generation that yields slides in order as soon as each one
+        (and every slide before it) has been expanded
+        """
+        if add_ons is None:
+            add_ons = {}
+        if usage is None:
+            usage = empty_usage()
+        
+        outline = await self._generate_outline_async(
+            topic, duration_minutes, difficulty_level, target_audience, tone, usage
+        )
+        if not outline:
+            for slide in self._create_fallback_response(topic, "Outline generation failed", add_ons)["slides"]:
+                yield slide
+            return
+        
+        semaphore = asyncio.Semaphore(max_concurrency or self._fanout_concurrency())
+        tasks = [
+            asyncio.create_task(self._expand_slide_async(
+                topic, entry, outline, difficulty_level, target_audience, tone, add_ons, semaphore, usage
+            ))
+            for entry in outline
+        ]
+        try:
+            for i, task in enumerate(tasks):
+                yield self._normalize_slide(await task, i, add_ons)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _fanout_concurrency() -> int:
+        return int(os.getenv("LECTURE_FANOUT_CONCURRENCY", str(FANOUT_DEFAULT_CONCURRENCY)))
+
+    async def _generate_outline_async(
+        self, topic: str, duration: int, difficulty: str, audience: str, tone: str,
+        usage: Dict[str, int]
+    ) -> List[Dict[str, Any]]:
+        """Ask for a compact outline; returns [] when it can't be produced"""
+        slides_count = max(3, min(FANOUT_MAX_SLIDES, duration // 2))
+        prompt = f"""Create the outline of a {duration}-minute lecture on: "{topic}"
+
+- Exactly {slides_count} slides
+- Difficulty: {difficulty}
+- Target Audience: {audience}
+- Tone: {tone}
+- Slide 1 is the title slide, slide {slides_count} is the conclusion
+- One main concept per content slide, in a logical teaching order
+
+Return ONLY valid JSON (no markdown code blocks) with this structure:
+
+{{
+  "outline": [
+    {{"slide_number": 1, "title": "Clear, Descriptive Title", "slide_type": "title", "summary": "One sentence describing what this slide teaches"}}
+  ]
+}}
+
+slide_type is one of: title, content, conclusion, qa"""
+        
+        messages = [
+            {"role": "system", "content": self._build_system_message(difficulty, audience, tone)},
+            {"role": "user", "content": prompt}
+        ]
+        try:
+            content, outline_usage = await self._complete_async(messages, 200 + 80 * slides_count, "outline")
+            merge_usage(usage, outline_usage)
+            outline = self._extract_json_object(content).get("outline", [])
+        except UpstreamError:
+            raise
+        except Exception as e:
+            print(f"Error generating lecture outline: {e}")
+            return []
+        
+        outline = [entry for entry in outline if isinstance(entry, dict)]
+        for i, entry in enumerate(outline):
+            entry["slide_number"] = i + 1
+            entry.setdefault("title", f"Slide {i + 1}")
+            entry.setdefault("slide_type", "content")
+            entry.setdefault("summary", "")
+        return outline
+
+    async def _expand_slide_async(
+        self,
+        topic: str,
+        entry: Dict[str, Any],
+        outline: List[Dict[str, Any]],
+        difficulty: str,
+        audience: str,
+        tone: str,
+        add_ons: Dict[str, bool],
+        semaphore: asyncio.Semaphore,
+        usage: Dict[str, int]
+    ) -> Dict[str, Any]:
+        """Expand one outline entry into a full slide; degrades to the outline entry on failure"""
+        outline_text = "\n".join(
+            f"{item['slide_number']}. {item['title']} ({item['slide_type']})" for item in outline
+        )
+        extra_fields = ""
+        if add_ons.get("code_examples", False):
+            extra_fields += ',\n  "code_example": "Complete, runnable, commented code for this slide, or null if it does not fit"'
+        if add_ons.get("exercises", False):
+            extra_fields += ',\n  "exercise": "Clear task with expected outcome, or null if it does not fit"'
+        
+        prompt = f"""You are writing slide {entry['slide_number']} of {len(outline)} of a lecture on: "{topic}"
+
+## FULL OUTLINE
+{outline_text}
+
+## THIS SLIDE
+Title: {entry['title']}
+Type: {entry['slide_type']}
+Focus: {entry['summary']}
+
+## GUIDELINES
+{TONE_INSTRUCTIONS.get(tone, TONE_INSTRUCTIONS["friendly"])}
+{DIFFICULTY_INSTRUCTIONS.get(difficulty, DIFFICULTY_INSTRUCTIONS["beginner"])}
+- 3-5 substantial bullet points, separated by \\n
+- Script is 2-4 sentences of natural SPOKEN narration that connects to the neighbouring slides
+
+Return ONLY a valid JSON object (no markdown code blocks):
+
+{{
+  "title": "{entry['title']}",
+  "content": "• Bullet point 1\\n• Bullet point 2\\n• Key takeaway",
+  "image_prompt": "Detailed description for visual: professional, clean design showing [specific elements], [color scheme], [style]",
+  "script": "Natural, conversational narration"{extra_fields}
+}}"""
+        
+        messages = [
+            {"role": "system", "content": self._build_system_message(difficulty, audience, tone)},
+            {"role": "user", "content": prompt}
+        ]
+        
+        async with semaphore:
+            try:
+                content, slide_usage = await self._complete_async(
+                    messages, self._completion_budget(1, add_ons), "slide", add_ons
+                )
+                merge_usage(usage, slide_usage)
+                slide = self._extract_json_object(content)
+            except CircuitOpenError:
+                # Qwen is down - fail the deck rather than degrade every remaining slide
+                raise
+            except Exception as e:
+                print(f"Error expanding slide {entry['slide_number']}: {e}")
+                slide = {"content": entry["summary"]}
+        
+        slide["slide_number"] = entry["slide_number"]
+        slide["slide_type"] = entry["slide_type"]
+        slide.setdefault("title", entry["title"])
+        return slide
+    
     def _build_system_message(self, difficulty: str, audience: str, tone: str) -> str:
         """Build detailed system message to set context"""
         return f"""You are an expert educational content creator and instructional designer specializing in creating engaging, effective lectures.
@@ -83,21 +645,6 @@ Your task is to create a comprehensive lecture presentation that balances theory
     ) -> str:
         """Build comprehensive user prompt with clear structure"""
         
-        # Tone-specific instructions
-        tone_instructions = {
-            "friendly": "Use conversational language, analogies, and relatable examples. Be encouraging and supportive.",
-            "formal": "Use precise academic language, formal structure, and authoritative tone. Cite concepts properly.",
-            "exam": "Focus on testable knowledge, key definitions, common pitfalls, and exam strategies. Be direct and comprehensive.",
-            "story": "Use narrative structure, real-world scenarios, and character-driven examples. Make it engaging and memorable."
-        }
-        
-        # Difficulty-specific instructions
-        difficulty_instructions = {
-            "beginner": "Start with fundamentals. Use simple language. Provide step-by-step explanations. Include many examples.",
-            "intermediate": "Assume basic knowledge. Focus on practical application. Include best practices and common patterns.",
-            "advanced": "Deep technical details. Discuss trade-offs, optimizations, and edge cases. Reference advanced concepts."
-        }
-        
         prompt = f"""Create a {duration}-minute lecture presentation on: "{topic}"
 
 ## LECTURE PARAMETERS
@@ -107,10 +654,10 @@ Your task is to create a comprehensive lecture presentation that balances theory
 - Tone: {tone}
 
 ## TONE GUIDELINES
-{tone_instructions.get(tone, tone_instructions["friendly"])}
+{TONE_INSTRUCTIONS.get(tone, TONE_INSTRUCTIONS["friendly"])}
 
 ## DIFFICULTY GUIDELINES
-{difficulty_instructions.get(difficulty, difficulty_instructions["beginner"])}
+{DIFFICULTY_INSTRUCTIONS.get(difficulty, DIFFICULTY_INSTRUCTIONS["beginner"])}
 
 ## CONTENT REQUIREMENTS"""
 
@@ -243,73 +790,95 @@ Begin creating the lecture now."""
 
         return prompt
 
+    @staticmethod
+    def _extract_json_object(content: str) -> Dict[str, Any]:
+        """Strip code fences and parse the outermost JSON object"""
+        # Remove markdown code blocks if present
+        content = content.strip()
+        if content.startswith("```"):
+            content = content.split("```")[1]
+            if content.startswith("json"):
+                content = content[4:]
+        
+        # Find JSON bounds
+        start_idx = content.find('{')
+        end_idx = content.rfind('}') + 1
+        
+        if start_idx == -1 or end_idx == 0:
+            raise ValueError("No JSON found in response")
+        
+        return json.loads(content[start_idx:end_idx])
+
     def _extract_and_validate_json(
         self, content: str, topic: str, add_ons: Dict[str, bool]
     ) -> Dict[str, Any]:
-        """Extract and validate JSON from response"""
+        """
+        Extract and validate JSON from response. Well-formed output takes the
+        fast json.loads path; otherwise every complete slide is recovered and
+        the ones that couldn't be are listed under "lost_slides".
+        """
         try:
-            # Remove markdown code blocks if present
-            content = content.strip()
-            if content.startswith("```"):
-                content = content.split("```")[1]
-                if content.startswith("json"):
-                    content = content[4:]
-            
-            # Find JSON bounds
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
-            
-            if start_idx == -1 or end_idx == 0:
-                raise ValueError("No JSON found in response")
-            
-            json_content = content[start_idx:end_idx]
-            parsed_data = json.loads(json_content)
+            parsed_data = self._extract_json_object(content)
             
             # Validate and normalize
             return self._normalize_slides(parsed_data, add_ons)
             
         except (json.JSONDecodeError, ValueError) as e:
             print(f"JSON parsing error: {e}")
-            print(f"Content preview: {content[:500]}")
-            return self._create_fallback_response(topic, str(e), add_ons)
+            slides, lost_slides = recover_slides(content)
+            if not slides:
+                print(f"Content preview: {content[:500]}")
+                return self._create_fallback_response(topic, str(e), add_ons)
+            
+            print(f"Recovered {len(slides)} slides from malformed response, lost {len(lost_slides)}")
+            parsed_data = self._normalize_slides({"slides": slides}, add_ons)
+            if lost_slides:
+                parsed_data["lost_slides"] = lost_slides
+            return parsed_data
     
     def _normalize_slides(self, data: Dict[str, Any], add_ons: Dict[str, bool]) -> Dict[str, Any]:
         """Ensure all slides have required fields and proper formatting"""
         slides = data.get("slides", [])
         
         for i, slide in enumerate(slides):
-            # Ensure slide number
-            slide["slide_number"] = slide.get("slide_number", i + 1)
-            
-            # Required fields with defaults
-            slide.setdefault("title", f"Slide {i + 1}")
-            slide.setdefault("slide_type", "content")
-            slide.setdefault("image_prompt", "Professional educational slide design, clean and modern")
-            slide.setdefault("script", f"This slide covers {slide.get('title', 'important content')}.")
-            
-            # Handle content field - ensure it's a well-formatted string
-            content = slide.get("content", "")
-            if isinstance(content, list):
-                slide["content"] = "\n".join(f"• {str(item)}" for item in content)
-            elif not isinstance(content, str):
-                slide["content"] = str(content)
-            else:
-                slide["content"] = content or "Content to be added"
-            
-            # Conditional fields based on add-ons
-            if add_ons.get("code_examples", False):
-                if "code_example" not in slide or not slide["code_example"]:
-                    slide["code_example"] = None
-            else:
+            self._normalize_slide(slide, i, add_ons)
+        
+        return data
+    
+    def _normalize_slide(self, slide: Dict[str, Any], i: int, add_ons: Dict[str, bool]) -> Dict[str, Any]:
+        """Fill in required fields of a single slide (i is its 0-based position)"""
+        # Ensure slide number
+        slide["slide_number"] = slide.get("slide_number", i + 1)
+        
+        # Required fields with defaults
+        slide.setdefault("title", f"Slide {i + 1}")
+        slide.setdefault("slide_type", "content")
+        slide.setdefault("image_prompt", "Professional educational slide design, clean and modern")
+        slide.setdefault("script", f"This slide covers {slide.get('title', 'important content')}.")
+        
+        # Handle content field - ensure it's a well-formatted string
+        content = slide.get("content", "")
+        if isinstance(content, list):
+            slide["content"] = "\n".join(f"• {str(item)}" for item in content)
+        elif not isinstance(content, str):
+            slide["content"] = str(content)
+        else:
+            slide["content"] = content or "Content to be added"
+        
+        # Conditional fields based on add-ons
+        if add_ons.get("code_examples", False):
+            if "code_example" not in slide or not slide["code_example"]:
                 slide["code_example"] = None
-            
-            if add_ons.get("exercises", False):
-                if "exercise" not in slide or not slide["exercise"]:
-                    slide["exercise"] = None
-            else:
+        else:
+            slide["code_example"] = None
+        
+        if add_ons.get("exercises", False):
+            if "exercise" not in slide or not slide["exercise"]:
                 slide["exercise"] = None
+        else:
+            slide["exercise"] = None
         
-        return data
+        return slide
     
     def _create_fallback_response(
         self, topic: str, error_msg: str, add_ons: Dict[str, bool]
@@ -348,22 +917,47 @@ Begin creating the lecture now."""
             }
         ]
         
-        return {"slides": slides}
+        # Flagged so callers (e.g. the lecture cache) never persist it
+        return {"slides": slides, "fallback": True}
     
+    def _build_text_messages(self, prompt: str) -> List[Dict[str, str]]:
+        system_msg = "You are a helpful, knowledgeable assistant. Provide clear, accurate, and well-structured responses."
+        return [
+            {"role": "system", "content": system_msg},
+            {"role": "user", "content": prompt}
+        ]
+
     def generate_text(self, prompt: str) -> str:
         """Simple text generation with improved prompting"""
         try:
-            system_msg = "You are a helpful, knowledgeable assistant. Provide clear, accurate, and well-structured responses."
-            
-            response = self.client.chat.completions.create(
-                model="qwen3-max-preview",
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False,
-                temperature=0.7,
-            )
-            return response.choices[0].message.content
+            content, _ = self._complete(self._build_text_messages(prompt), None, "text")
+            return content
+        except UpstreamError:
+            raise
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    async def generate_text_async(self, prompt: str) -> str:
+        """Async variant of generate_text using the shared client"""
+        try:
+            content, _ = await self.complete_text_async(prompt)
+            return content
+        except UpstreamError:
+            raise
         except Exception as e:
-            return f"Error: {str(e)}"
\ No newline at end of file
+            return f"Error: {str(e)}"
+
+    async def complete_text_async(self, prompt: str, max_tokens: Optional[int] = None) -> Tuple[str, Dict[str, int]]:
+        """Text generation returning (text, usage); errors propagate to the caller"""
+        return await self._complete_async(self._build_text_messages(prompt), max_tokens, "text")
+
+    async def stream_text_async(
+        self, prompt: str, max_tokens: Optional[int] = None, usage: Optional[Dict[str, int]] = None
+    ) -> AsyncIterator[str]:
+        """Yield the answer to prompt token by token; token usage is added to usage"""
+        if usage is None:
+            usage = empty_usage()
+        async for delta in self._stream_completion_async(
+            self._build_text_messages(prompt), max_tokens, "text_stream", None, usage
+        ):
+            yield delta
@@ -0,0 +1,220 @@
+"""
+Token-bucket rate limiter shared by every worker process
+Bucket state lives in a small SQLite database, so all uvicorn workers on
+the host draw from the same buckets (Higgsfield submissions, Higgsfield
+polls and Qwen completions are limited separately)
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from app.src.services import metrics
+
+# name -> (default requests per second, default burst)
+DEFAULT_BUCKETS = {
+    "higgsfield_submit": (2.0, 10.0),
+    "higgsfield_poll": (10.0, 20.0),
+    "qwen": (10.0, 20.0),
+}
+
+
+class QueueFullError(Exception):
+    """The wait for a token would exceed the limiter's max_wait"""
+
+    def __init__(self, bucket: str, wait: float):
+        super().__init__(f"rate limit queue for {bucket} is full (next slot in {wait:.1f}s)")
+        self.bucket = bucket
+        self.wait = wait
+
+
+class RateLimiter:
+    """
+    Each acquire() reserves the next token of its bucket in one SQLite
+    transaction and then sleeps until that token is due. Reservations are
+    handed out in the order they reach the database, so callers queue
+    first-come first-served across all workers instead of failing.
+    """
+
+    def __init__(self, path: str, buckets: Dict[str, Tuple[float, float]], max_wait: float = 300.0):
+        self.path = path
+        self.buckets = buckets
+        self.max_wait = max_wait
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+        self._waits: Dict[str, deque] = {name: deque(maxlen=1000) for name in buckets}
+        self.counters: Dict[str, Dict[str, float]] = {
+            name: {"acquired": 0, "queued": 0, "wait_seconds": 0.0, "max_wait": 0.0, "penalties": 0, "rejected": 0, "cancelled": 0}
+            for name in buckets
+        }
+
+    def reserve(self, bucket: str) -> float:
+        """Take the bucket's next token; returns how long to wait before using it"""
+        rate, burst = self.buckets[bucket]
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    tokens, now = self._refill(bucket, rate, burst)
+                    wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+                    if wait > self.max_wait:
+                        self._store(bucket, tokens, now)
+                        self.counters[bucket]["rejected"] += 1
+                        raise QueueFullError(bucket, wait)
+                    self._store(bucket, tokens - 1, now)
+                finally:
+                    self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                # Better to run unthrottled than to stop calling the upstream
+                print(f"Rate limiter: {bucket} unavailable ({e}), not limiting")
+                return 0.0
+            self._record_wait(bucket, wait)
+        return wait
+
+    async def acquire(self, bucket: str) -> float:
+        """Wait for a token of bucket; returns the time spent queued"""
+        if bucket not in self.buckets:
+            return 0.0
+        # reserve() can block on other workers' SQLite transactions, so it runs off the event loop
+        reservation = asyncio.ensure_future(asyncio.to_thread(self.reserve, bucket))
+        try:
+            wait = await asyncio.shield(reservation)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            # The reservation goes through in its thread regardless; hand the token back
+            try:
+                await reservation
+                await asyncio.to_thread(self._refund, bucket)
+            except QueueFullError:
+                pass
+            raise
+        return wait
+
+    def acquire_sync(self, bucket: str) -> float:
+        """Blocking acquire() for threadpool code"""
+        if bucket not in self.buckets:
+            return 0.0
+        wait = self.reserve(bucket)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, bucket: str, seconds: float) -> None:
+        """The upstream answered 429: hand out no new tokens for `seconds`, in every worker"""
+        if bucket not in self.buckets or seconds <= 0:
+            return
+        rate, burst = self.buckets[bucket]
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    tokens, now = self._refill(bucket, rate, burst)
+                    self._store(bucket, min(tokens, 1 - seconds * rate), now)
+                finally:
+                    self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                print(f"Rate limiter: failed to penalize {bucket}: {e}")
+                return
+            self.counters[bucket]["penalties"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for name, (rate, burst) in self.buckets.items():
+                waits = sorted(self._waits[name])
+                counters = self.counters[name]
+                result[name] = {
+                    **counters,
+                    "wait_seconds": round(counters["wait_seconds"], 3),
+                    "max_wait": round(counters["max_wait"], 3),
+                    "wait_p50": round(waits[len(waits) // 2], 3) if waits else 0.0,
+                    "wait_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                    "rate": rate,
+                    "burst": burst,
+                }
+            return result
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _refill(self, bucket: str, rate: float, burst: float) -> Tuple[float, float]:
+        """Current tokens of a bucket; caller holds the lock inside a transaction"""
+        now = time.time()
+        row = self._conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (bucket,)).fetchone()
+        if row is None:
+            return burst, now
+        tokens, updated_at = row
+        return min(burst, tokens + max(0.0, now - updated_at) * rate), now
+
+    def _store(self, bucket: str, tokens: float, now: float) -> None:
+        self._conn.execute(
+            "INSERT INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)"
+            " ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+            (bucket, tokens, now),
+        )
+
+    def _refund(self, bucket: str) -> None:
+        """Give back the token of a caller that stopped waiting for it"""
+        rate, burst = self.buckets[bucket]
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    tokens, now = self._refill(bucket, rate, burst)
+                    self._store(bucket, min(burst, tokens + 1), now)
+                finally:
+                    self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                return
+            self.counters[bucket]["cancelled"] += 1
+
+    def _record_wait(self, bucket: str, wait: float) -> None:
+        """Caller holds the lock"""
+        counters = self.counters[bucket]
+        counters["acquired"] += 1
+        if wait > 0:
+            counters["queued"] += 1
+            counters["wait_seconds"] += wait
+            counters["max_wait"] = max(counters["max_wait"], wait)
+        self._waits[bucket].append(wait)
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """
+    Process-wide limiter backed by RATE_LIMIT_PATH (empty disables rate
+    limiting). Buckets are sized with RATE_LIMIT_<BUCKET> requests per
+    second (0 leaves that bucket unlimited) and RATE_LIMIT_<BUCKET>_BURST;
+    callers wait at most RATE_LIMIT_MAX_WAIT seconds for a token.
+    """
+    global _rate_limiter
+    path = os.getenv("RATE_LIMIT_PATH", ".cache/rate_limits.sqlite3")
+    if not path:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            buckets = {}
+            for name, (rate, burst) in DEFAULT_BUCKETS.items():
+                prefix = f"RATE_LIMIT_{name.upper()}"
+                rate = float(os.getenv(prefix, str(rate)))
+                if rate > 0:
+                    buckets[name] = (rate, max(1.0, float(os.getenv(f"{prefix}_BURST", str(burst)))))
+            _rate_limiter = RateLimiter(path, buckets, max_wait=float(os.getenv("RATE_LIMIT_MAX_WAIT", "300")))
+            metrics.register("rate_limit", _rate_limiter.stats)
+    return _rate_limiter
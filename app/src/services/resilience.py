@@ -0,0 +1,418 @@
+"""
+Resilience layer for upstream calls (DashScope/Qwen and Higgsfield)
+Classified retries with jittered exponential backoff, a per-upstream
+circuit breaker, optional hedged requests for tail latency and, per call,
+a shared rate-limit bucket
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import httpx
+import openai
+import requests
+
+from app.src.services import metrics
+from app.src.services.rate_limiter import QueueFullError, get_rate_limiter
+
+T = TypeVar("T")
+
+# Status codes worth retrying; for non-idempotent calls (job submissions)
+# only the ones that guarantee the request was not processed
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+SAFE_TO_RESUBMIT_STATUS = {429, 503}
+
+
+class UpstreamError(Exception):
+    """An upstream call failed after retries (or was rejected by the breaker)"""
+
+    def __init__(self, upstream: str, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamError):
+    """Raised without calling the upstream while its circuit is open"""
+
+
+class UpstreamHTTPError(Exception):
+    """Non-success HTTP status from a requests/httpx based call"""
+
+    def __init__(self, status_code: int, body: str = "", retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status_code}: {body[:200]}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def raise_for_upstream_status(response: Any) -> Any:
+    """
+    Turn retryable HTTP statuses (429, 5xx) of a requests/httpx response into
+    UpstreamHTTPError; any other response is returned unchanged
+    """
+    if response.status_code in RETRYABLE_STATUS:
+        raise UpstreamHTTPError(
+            response.status_code,
+            response.text,
+            _parse_retry_after(response.headers.get("retry-after")),
+        )
+    return response
+
+
+# Errors that come from talking to the upstream; anything else raised by a
+# call (bad input, a bug on our side, a nested UpstreamError) says nothing
+# about the upstream's health
+UPSTREAM_CAUSED = (UpstreamHTTPError, openai.APIError, httpx.HTTPError, requests.exceptions.RequestException)
+
+
+def classify_error(error: BaseException, idempotent: bool = True) -> Tuple[bool, Optional[float], Optional[int]]:
+    """
+    Returns (retryable, retry_after_seconds, status_code). Connection
+    failures are always retryable; timeouts and ambiguous 5xx only when
+    repeating the call can't duplicate side effects.
+    """
+    if isinstance(error, UpstreamHTTPError):
+        allowed = RETRYABLE_STATUS if idempotent else SAFE_TO_RESUBMIT_STATUS
+        return error.status_code in allowed, error.retry_after, error.status_code
+
+    if isinstance(error, openai.APIStatusError):
+        retry_after = _parse_retry_after(error.response.headers.get("retry-after")) if error.response is not None else None
+        allowed = RETRYABLE_STATUS if idempotent else SAFE_TO_RESUBMIT_STATUS
+        return error.status_code in allowed, retry_after, error.status_code
+    if isinstance(error, openai.APITimeoutError):
+        return idempotent, None, None
+    if isinstance(error, openai.APIConnectionError):
+        return True, None, None
+
+    if isinstance(error, (httpx.ConnectError, requests.exceptions.ConnectionError)):
+        return True, None, None
+    if isinstance(error, (httpx.TimeoutException, requests.exceptions.Timeout)):
+        return idempotent, None, None
+    if isinstance(error, httpx.TransportError):
+        return idempotent, None, None
+    return False, None, None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff; a server Retry-After wins if longer"""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            return max(backoff, min(retry_after, self.max_delay * 4))
+        return backoff
+
+
+class CircuitBreaker:
+    """
+    closed -> open after failure_threshold consecutive upstream failures;
+    open -> half-open after recovery_timeout, letting one probe through;
+    half-open -> closed on success, back to open on failure.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        return self.admit() is not None
+
+    def admit(self) -> Optional[bool]:
+        """None when the call must fail fast, otherwise whether it is the half-open probe"""
+        with self._lock:
+            if self.state == "closed":
+                return False
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return None
+
+    def release_probe(self) -> None:
+        """The probe ended without an answer from the upstream (cancelled, local error); let another one through"""
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Circuit opened after {self._failures} consecutive failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class Upstream:
+    """Retry policy + circuit breaker + latency-based hedging for one upstream service"""
+
+    def __init__(
+        self,
+        name: str,
+        retry: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        hedging: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay: float = 0.5,
+        hedge_min_samples: int = 20
+    ):
+        self.name = name
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = deque(maxlen=500)
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "short_circuited": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+        }
+
+    async def call(
+        self, fn: Callable[[], Awaitable[T]], idempotent: bool = True, hedge: bool = False, bucket: Optional[str] = None
+    ) -> T:
+        """
+        Run an async call with retries; hedge only applies to idempotent
+        calls. With a bucket, every attempt (and hedge) first waits for a
+        token of that rate-limit bucket.
+        """
+        self._count("calls")
+        limiter = get_rate_limiter() if bucket else None
+        attempt = 0
+        while True:
+            probe = self._check_breaker()
+            if limiter is not None:
+                try:
+                    await self._acquire(limiter, bucket)
+                except BaseException:
+                    # Queue full or cancelled while waiting: the probe never reached the upstream
+                    if probe:
+                        self.breaker.release_probe()
+                    raise
+            started = time.monotonic()
+            try:
+                if hedge and idempotent and self.hedging:
+                    result = await self._hedged(fn, limiter, bucket)
+                else:
+                    result = await fn()
+            except Exception as e:
+                self._penalize(limiter, bucket, e)
+                delay = self._on_failure(e, attempt, idempotent, probe)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled: the upstream never answered
+                if probe:
+                    self.breaker.release_probe()
+                raise
+            self._on_success(time.monotonic() - started)
+            return result
+
+    def call_sync(self, fn: Callable[[], T], idempotent: bool = True, bucket: Optional[str] = None) -> T:
+        """Blocking variant for threadpool code (no hedging)"""
+        self._count("calls")
+        limiter = get_rate_limiter() if bucket else None
+        attempt = 0
+        while True:
+            probe = self._check_breaker()
+            if limiter is not None:
+                try:
+                    limiter.acquire_sync(bucket)
+                except QueueFullError as e:
+                    if probe:
+                        self.breaker.release_probe()
+                    raise UpstreamError(self.name, str(e), 429, e.wait) from e
+            started = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                self._penalize(limiter, bucket, e)
+                delay = self._on_failure(e, attempt, idempotent, probe)
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._on_success(time.monotonic() - started)
+            return result
+
+    def hedge_delay(self) -> Optional[float]:
+        """Latency quantile after which a duplicate request is sent, once enough samples exist"""
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_quantile))
+        return max(self.hedge_min_delay, ordered[index])
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                **self.counters,
+                "circuit": self.breaker.state,
+                "hedging": self.hedging,
+                "hedge_delay": round(delay, 3) if delay is not None else None,
+            }
+
+    async def _acquire(self, limiter, bucket: str) -> None:
+        try:
+            await limiter.acquire(bucket)
+        except QueueFullError as e:
+            raise UpstreamError(self.name, str(e), 429, e.wait) from e
+
+    def _penalize(self, limiter, bucket: Optional[str], error: Exception) -> None:
+        """A 429 from the upstream pauses the bucket for every worker"""
+        if limiter is None:
+            return
+        _, retry_after, status_code = classify_error(error)
+        if status_code == 429:
+            limiter.penalize(bucket, retry_after or self.retry.base_delay)
+
+    async def _hedged(self, fn: Callable[[], Awaitable[T]], limiter=None, bucket: Optional[str] = None) -> T:
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(fn())
+        if delay is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+
+        async def hedge_call():
+            if limiter is not None:
+                await self._acquire(limiter, bucket)
+            return await fn()
+
+        backup = asyncio.ensure_future(hedge_call())
+        pending = {primary, backup}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _check_breaker(self) -> bool:
+        """Fail fast while the circuit is open; returns whether this call is the half-open probe"""
+        probe = self.breaker.admit()
+        if probe is None:
+            self._count("short_circuited")
+            raise CircuitOpenError(self.name, "circuit open, failing fast", retry_after=self.breaker.retry_after())
+        return probe
+
+    def _on_success(self, latency: float) -> None:
+        self.breaker.record_success()
+        with self._lock:
+            self.counters["successes"] += 1
+            self._latencies.append(latency)
+
+    def _on_failure(self, error: Exception, attempt: int, idempotent: bool, probe: bool = False) -> float:
+        """Record the failure; return the backoff delay or raise if we're done"""
+        if not isinstance(error, UPSTREAM_CAUSED):
+            # Not the upstream's doing: leave the breaker alone and let the error through as it is
+            if probe:
+                self.breaker.release_probe()
+            self._count("failures")
+            raise error
+
+        retryable, retry_after, status_code = classify_error(error, idempotent)
+        if retryable or classify_error(error)[0]:
+            self.breaker.record_failure()
+        else:
+            # The upstream answered (a 4xx for our request), so it is up
+            self.breaker.record_success()
+
+        if not retryable or attempt + 1 >= self.retry.max_attempts:
+            self._count("failures")
+            raise UpstreamError(self.name, str(error), status_code, retry_after) from error
+
+        self._count("retries")
+        delay = self.retry.delay(attempt, retry_after)
+        print(f"{self.name}: attempt {attempt + 1} failed ({error}), retrying in {delay:.2f}s")
+        return delay
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+
+_upstreams: Dict[str, Upstream] = {}
+
+
+def get_upstream(name: str) -> Upstream:
+    """
+    Process-wide Upstream configured from <NAME>_RETRY_ATTEMPTS,
+    <NAME>_RETRY_BASE_DELAY, <NAME>_BREAKER_THRESHOLD,
+    <NAME>_BREAKER_RECOVERY and <NAME>_HEDGE (e.g. QWEN_HEDGE=1)
+    """
+    upstream = _upstreams.get(name)
+    if upstream is None:
+        prefix = name.upper()
+        upstream = Upstream(
+            name,
+            retry=RetryPolicy(
+                max_attempts=int(os.getenv(f"{prefix}_RETRY_ATTEMPTS", "3")),
+                base_delay=float(os.getenv(f"{prefix}_RETRY_BASE_DELAY", "0.5")),
+            ),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv(f"{prefix}_BREAKER_THRESHOLD", "5")),
+                recovery_timeout=float(os.getenv(f"{prefix}_BREAKER_RECOVERY", "30")),
+            ),
+            hedging=os.getenv(f"{prefix}_HEDGE", "0").lower() in ("1", "true", "yes"),
+        )
+        upstream = _upstreams.setdefault(name, upstream)
+        metrics.register(f"upstream.{name}", upstream.stats)
+    return upstream
@@ -0,0 +1,302 @@
+"""
+Near-duplicate index over generated lecture topics
+MinHash signatures of normalized topic shingles, bucketed with LSH so a
+lookup only compares against a handful of candidates
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from itertools import chain
+from contextlib import contextmanager
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from app.src.services import metrics
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MIN_BAND_MATCHES = 2
+# Buckets larger than this are only used to confirm candidates, never scanned
+MAX_BUCKET_SCAN = 256
+# The persisted index is rewritten once this many of its lines (at least) are stale
+COMPACT_MIN_STALE = 1000
+_PRIME = (1 << 31) - 1
+
+STOPWORDS = frozenset("""
+a an the of for to in on and or with about into from by at as is are how what why
+introduction intro overview guide tutorial lecture course lesson
+""".split())
+
+# Words that give the words after them a role ("Java for Python developers"
+# is not "Python for Java developers"); they only count after the subject
+DIRECTIONAL = frozenset(("for", "to", "into", "from"))
+
+_rng = np.random.RandomState(2024)
+_A = _rng.randint(1, _PRIME, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, _PRIME, size=NUM_PERM, dtype=np.uint64)
+
+
+def topic_shingles(topic: str) -> FrozenSet[str]:
+    """
+    Word shingles of a topic, lowercased, without stopwords and plural "s".
+    Words after a directional word are prefixed with it ("for:python"), so
+    word order matters across "for"/"to" but not within the subject.
+    """
+    shingles = set()
+    role = ""
+    for word in re.findall(r"[a-z0-9+#]+", (topic or "").lower()):
+        if word in DIRECTIONAL and shingles:
+            role = word + ":"
+            continue
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        shingles.add(role + word)
+    return frozenset(shingles)
+
+
+def _hash32(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+def minhash(shingles: FrozenSet[str]) -> np.ndarray:
+    hashes = np.fromiter((_hash32(s) for s in shingles), dtype=np.uint64, count=len(shingles))
+    if not len(hashes):
+        return np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    # (a * x + b) mod p for every permutation/shingle pair, minimum per permutation
+    return ((np.outer(_A, hashes) + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class SimilarityIndex:
+    """
+    Maps (parameter signature, topic) to a lecture cache key. Entries only
+    match within the same parameter signature (duration, difficulty, tone,
+    add-ons...); topics are compared by MinHash/LSH, and candidates are
+    confirmed with the exact Jaccard similarity of their shingles.
+
+    With a path, adds and removals are appended to a JSONL file shared by
+    all workers. The file is compacted when the index is loaded and, in a
+    background thread, once as many of its lines are stale (removed,
+    evicted or replaced entries) as there are entries.
+    """
+
+    def __init__(self, threshold: float = 0.75, max_entries: int = 200000, path: Optional[str] = None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.path = path
+        self._entries: "OrderedDict[str, Tuple[str, str, FrozenSet[str], Tuple[bytes, ...]]]" = OrderedDict()
+        self._buckets: Dict[bytes, set] = {}
+        self._lock = threading.Lock()
+        self.counters = {"lookups": 0, "near_hits": 0, "candidates": 0, "adds": 0, "evictions": 0, "compactions": 0}
+        self._stale = 0
+        self._compacting = False
+        if path:
+            self._load()
+
+    def add(self, cache_key: str, params_key: str, topic: str, persist: bool = True) -> None:
+        shingles = topic_shingles(topic)
+        if not shingles:
+            return
+        bands = self._bands(params_key, minhash(shingles))
+        with self._lock:
+            if cache_key in self._entries:
+                self._drop(cache_key)
+                self._stale += 1
+            self._entries[cache_key] = (params_key, topic, shingles, bands)
+            for band in bands:
+                self._buckets.setdefault(band, set()).add(cache_key)
+            self.counters["adds"] += 1
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.counters["evictions"] += 1
+                self._stale += 1
+        if persist and self.path:
+            self._append({"key": cache_key, "params": params_key, "topic": topic})
+            self._maybe_compact()
+
+    def lookup(self, params_key: str, topic: str, exclude: Tuple[str, ...] = ()) -> Optional[Tuple[str, str, float]]:
+        """Best stored (cache_key, topic, similarity) at or above the threshold, or None"""
+        shingles = topic_shingles(topic)
+        if not shingles:
+            return None
+        bands = self._bands(params_key, minhash(shingles))
+        best = None
+        with self._lock:
+            self.counters["lookups"] += 1
+            buckets = [self._buckets[band] for band in bands if band in self._buckets]
+            # A band made of very common words collects thousands of keys; such
+            # buckets are not scanned, they only add to the count of keys found
+            # in the selective ones
+            small = [bucket for bucket in buckets if len(bucket) <= MAX_BUCKET_SCAN]
+            large = [bucket for bucket in buckets if len(bucket) > MAX_BUCKET_SCAN]
+            matches = Counter(chain.from_iterable(small))
+            for bucket in large:
+                for cache_key in matches:
+                    if cache_key in bucket:
+                        matches[cache_key] += 1
+            # A single shared band is what unrelated topics with a couple of
+            # common words look like; real near-duplicates share several
+            candidates = [key for key, count in matches.items() if count >= MIN_BAND_MATCHES]
+            self.counters["candidates"] += len(candidates)
+            for cache_key in candidates:
+                if cache_key in exclude:
+                    continue
+                _, stored_topic, stored_shingles, _ = self._entries[cache_key]
+                similarity = jaccard(shingles, stored_shingles)
+                if similarity >= self.threshold and (best is None or similarity > best[2]):
+                    best = (cache_key, stored_topic, similarity)
+            if best is not None:
+                self.counters["near_hits"] += 1
+        return best
+
+    def remove(self, cache_key: str) -> None:
+        """Forget an entry whose cached lecture is gone (expired or evicted)"""
+        with self._lock:
+            if cache_key not in self._entries:
+                return
+            self._drop(cache_key)
+            self._stale += 2
+        if self.path:
+            self._append({"key": cache_key, "removed": True})
+            self._maybe_compact()
+
+    def compact(self) -> List[dict]:
+        """
+        Rewrite the file with only its live entries (as of the file, which
+        other workers append to as well); returns them oldest first
+        """
+        with self._file_lock():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    lines: List[str] = f.readlines()
+            except FileNotFoundError:
+                return []
+            live: "OrderedDict[str, dict]" = OrderedDict()
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                    if record.get("removed"):
+                        live.pop(record["key"], None)
+                    else:
+                        live.pop(record["key"], None)
+                        live[record["key"]] = {"key": record["key"], "params": record["params"], "topic": record["topic"]}
+                except (ValueError, KeyError, AttributeError):
+                    continue
+            while len(live) > self.max_entries:
+                live.popitem(last=False)
+            records = list(live.values())
+            if len(records) < len(lines):
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                os.replace(tmp_path, self.path)
+                with self._lock:
+                    self.counters["compactions"] += 1
+        return records
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "threshold": self.threshold}
+
+    @staticmethod
+    def _bands(params_key: str, signature: np.ndarray) -> Tuple[bytes, ...]:
+        prefix = params_key.encode("ascii")
+        return tuple(
+            hashlib.blake2b(prefix + bytes([band]) + signature[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=12).digest()
+            for band in range(BANDS)
+        )
+
+    def _drop(self, cache_key: str) -> None:
+        """Remove an entry and its bucket memberships; caller holds the lock"""
+        _, _, _, bands = self._entries.pop(cache_key)
+        for band in bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(cache_key)
+                if not bucket:
+                    del self._buckets[band]
+
+    @contextmanager
+    def _file_lock(self):
+        """Held across workers while appending or compacting, so no append lands in a replaced file"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _append(self, record: dict) -> None:
+        try:
+            with self._file_lock():
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Similarity index: failed to append to {self.path}: {e}")
+
+    def _maybe_compact(self) -> None:
+        with self._lock:
+            if self._compacting or self._stale < max(COMPACT_MIN_STALE, len(self._entries)):
+                return
+            self._compacting = True
+            self._stale = 0
+        threading.Thread(target=self._compact_in_background, name="similarity-compact", daemon=True).start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except OSError as e:
+            print(f"Similarity index: failed to compact {self.path}: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def _load(self) -> None:
+        try:
+            records = self.compact()
+        except OSError as e:
+            print(f"Similarity index: unreadable {self.path}: {e}")
+            return
+        for record in records:
+            self.add(record["key"], record["params"], record["topic"], persist=False)
+
+
+_similarity_index: Optional[SimilarityIndex] = None
+
+
+def get_similarity_index() -> Optional[SimilarityIndex]:
+    """
+    Process-wide index configured from LECTURE_SIMILARITY_THRESHOLD
+    (0 disables near-match lookups), LECTURE_SIMILARITY_MAX_ENTRIES and
+    LECTURE_CACHE_DIR, where the index is persisted next to the cache.
+    Loading a large index takes seconds: the lifespan builds it in a thread.
+    """
+    global _similarity_index
+    threshold = float(os.getenv("LECTURE_SIMILARITY_THRESHOLD", "0.75"))
+    if threshold <= 0:
+        return None
+    if _similarity_index is None:
+        cache_dir = os.getenv("LECTURE_CACHE_DIR", ".cache/lectures")
+        _similarity_index = SimilarityIndex(
+            threshold=threshold,
+            max_entries=int(os.getenv("LECTURE_SIMILARITY_MAX_ENTRIES", "200000")),
+            path=os.path.join(cache_dir, "similarity_index.jsonl") if cache_dir else None,
+        )
+        metrics.register("lecture_similarity", _similarity_index.stats)
+    return _similarity_index
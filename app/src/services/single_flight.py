@@ -0,0 +1,60 @@
+"""
+Single-flight request coalescing
+Concurrent calls with the same key share one execution and its result
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from app.src.services import metrics
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    The first caller for a key does the work; callers arriving while it is
+    in flight wait for the same result (or exception) instead of repeating it.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[str, "asyncio.Task[Any]"] = {}
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "executions": 0, "collapsed": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._tasks.get(key)
+        with self._lock:
+            self.counters["calls"] += 1
+            if task is None:
+                self.counters["executions"] += 1
+            else:
+                self.counters["collapsed"] += 1
+
+        if task is None:
+            # Run as a task so a disconnecting first caller doesn't cancel the others
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counters,
+                "in_flight": len(self._tasks),
+            }
+
+
+_groups: Dict[str, SingleFlight] = {}
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """Process-wide coalescing group, published under single_flight.<name> in /metrics"""
+    group: Optional[SingleFlight] = _groups.get(name)
+    if group is None:
+        group = _groups.setdefault(name, SingleFlight(name))
+        metrics.register(f"single_flight.{name}", group.stats)
+    return group
@@ -0,0 +1,275 @@
+"""
+Incremental, repairing parser for streamed lecture JSON
+Pulls each slide object out of the "slides" array as soon as it closes and
+recovers every complete slide from truncated or slightly malformed output
+"""
+
+import json
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+WHITESPACE = " \t\r\n"
+VALID_ESCAPES = '"\\/bfnrtu'
+HEX_DIGITS = "0123456789abcdefABCDEF"
+CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+SLIDE_NUMBER_PATTERN = re.compile(r'"slide_number"\s*:\s*(\d+)')
+
+
+class SlideStreamParser:
+    """
+    Feed raw completion chunks, get back every slide object completed by them.
+
+    Slides are the objects inside the "slides" array (or inside a bare root
+    array). Text around the JSON document (code fences, chatter) is ignored.
+    While copying a slide the parser repairs the usual LLM mistakes:
+
+    - unescaped quotes inside strings (a quote only closes a string when the
+      next significant character could follow a JSON string)
+    - raw newlines/control characters and invalid escapes inside strings
+    - trailing commas and missing commas between members
+
+    Slides that still don't parse, and a slide cut off by the end of the
+    stream, are recorded in lost_slides instead of failing the whole document.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.slides_seen = 0
+        self.lost_slides: List[Dict[str, Any]] = []
+        self.repairs = 0
+        self._pos = 0
+        # (container char, key it was opened under)
+        self._stack: List[Tuple[str, Optional[str]]] = []
+        self._in_string = False
+        self._string_chars: List[str] = []
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        self._after_value = False
+        # Repaired text of the slide being read, None between slides
+        self._slide: Optional[List[str]] = None
+        self._slide_start = 0
+        self._slide_depth = 0
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consume a chunk and return the slides it completed"""
+        self.buffer += chunk
+        return self._consume(final=False)
+
+    def close(self) -> List[Dict[str, Any]]:
+        """Flush at end of stream; an unfinished slide is reported as lost"""
+        completed = self._consume(final=True)
+        if self._slide is not None:
+            self._lose("truncated", self.buffer[self._slide_start:])
+            self._slide = None
+        return completed
+
+    def _consume(self, final: bool) -> List[Dict[str, Any]]:
+        completed = []
+        buf = self.buffer
+        n = len(buf)
+        i = self._pos
+
+        while i < n:
+            char = buf[i]
+
+            if self._in_string:
+                if char == "\\":
+                    if i + 1 >= n:
+                        if not final:
+                            break
+                        i += 1
+                        continue
+                    escape = buf[i + 1]
+                    if escape == "u":
+                        digits = buf[i + 2:i + 6]
+                        if len(digits) < 4 and not final:
+                            break
+                        if len(digits) == 4 and all(d in HEX_DIGITS for d in digits):
+                            self._emit_string(buf[i:i + 6])
+                            i += 6
+                            continue
+                    elif escape in VALID_ESCAPES:
+                        self._emit_string(buf[i:i + 2])
+                        i += 2
+                        continue
+                    elif escape == "'":
+                        # JS-style \' - JSON needs no escape here
+                        self._emit_string("'")
+                        self.repairs += 1
+                        i += 2
+                        continue
+                    # Lone backslash - keep it literally
+                    self._emit_string("\\\\")
+                    self.repairs += 1
+                    i += 1
+                    continue
+
+                if char == '"':
+                    closes = self._quote_closes_string(buf, i + 1, final)
+                    if closes is None:
+                        break
+                    if closes:
+                        self._in_string = False
+                        self._last_string = "".join(self._string_chars)
+                        self._after_value = True
+                        self._emit('"')
+                    else:
+                        self._emit_string('\\"')
+                        self.repairs += 1
+                    i += 1
+                    continue
+
+                if char < " ":
+                    self._emit_string(CONTROL_ESCAPES.get(char, "\\u%04x" % ord(char)))
+                    self.repairs += 1
+                else:
+                    self._emit_string(char)
+                i += 1
+                continue
+
+            # Outside of any string
+            if not self._stack and char not in "{[":
+                i += 1
+                continue
+
+            if char == '"':
+                self._insert_missing_comma()
+                self._in_string = True
+                self._string_chars = []
+                self._emit(char)
+            elif char == ":":
+                self._pending_key = self._last_string
+                self._after_value = False
+                self._emit(char)
+            elif char == ",":
+                self._pending_key = None
+                self._after_value = False
+                self._emit(char)
+            elif char in "{[":
+                self._insert_missing_comma()
+                parent = self._stack[-1] if self._stack else None
+                key = self._pending_key if parent is not None and parent[0] == "{" else None
+                if (
+                    char == "{"
+                    and self._slide is None
+                    and parent is not None
+                    and parent[0] == "["
+                    and (parent[1] == "slides" or len(self._stack) == 1)
+                ):
+                    self._slide = []
+                    self._slide_start = i
+                    self._slide_depth = len(self._stack)
+                self._stack.append((char, key))
+                self._pending_key = None
+                self._after_value = False
+                self._emit(char)
+            elif char in "}]":
+                if self._stack:
+                    self._strip_trailing_comma()
+                    opener, _ = self._stack.pop()
+                    # Close whatever is actually open, even if the model mixed them up
+                    self._emit("}" if opener == "{" else "]")
+                    self._after_value = True
+                    if self._slide is not None and len(self._stack) == self._slide_depth:
+                        slide = self._finish_slide(buf[self._slide_start:i + 1])
+                        if slide is not None:
+                            completed.append(slide)
+            else:
+                self._emit(char)
+            i += 1
+
+        self._pos = i
+        return completed
+
+    def _quote_closes_string(self, buf: str, j: int, final: bool) -> Optional[bool]:
+        """
+        Decide whether the quote before buf[j] ends the current string.
+        Returns None when more input is needed to tell.
+        """
+        n = len(buf)
+        while j < n and buf[j] in WHITESPACE:
+            j += 1
+        if j >= n:
+            return True if final else None
+
+        char = buf[j]
+        if char in ":}]":
+            return True
+        in_array = bool(self._stack) and self._stack[-1][0] == "["
+        if char == ",":
+            j += 1
+            while j < n and buf[j] in WHITESPACE:
+                j += 1
+            if j >= n:
+                return True if final else None
+            if in_array:
+                return buf[j] in '"{[]-0123456789tfn'
+            return buf[j] in '"}'
+        if char == '"' and not in_array:
+            # Missing comma before the next key: "value" "key": ...
+            end = buf.find('"', j + 1)
+            if end == -1:
+                return False if final else None
+            k = end + 1
+            while k < n and buf[k] in WHITESPACE:
+                k += 1
+            if k >= n:
+                return False if final else None
+            return buf[k] == ":"
+        return False
+
+    def _emit(self, text: str) -> None:
+        if self._slide is not None:
+            self._slide.append(text)
+
+    def _emit_string(self, text: str) -> None:
+        self._string_chars.append(text)
+        self._emit(text)
+
+    def _insert_missing_comma(self) -> None:
+        if self._after_value and self._slide is not None:
+            self._emit(",")
+            self.repairs += 1
+        self._after_value = False
+
+    def _strip_trailing_comma(self) -> None:
+        if self._slide is None:
+            return
+        j = len(self._slide) - 1
+        while j >= 0 and self._slide[j] in WHITESPACE:
+            j -= 1
+        if j >= 0 and self._slide[j] == ",":
+            del self._slide[j]
+            self.repairs += 1
+
+    def _finish_slide(self, raw: str) -> Optional[Dict[str, Any]]:
+        text = "".join(self._slide)
+        self._slide = None
+        try:
+            slide = json.loads(text)
+        except json.JSONDecodeError as e:
+            self._lose(f"malformed: {e}", raw)
+            return None
+        if not isinstance(slide, dict):
+            self._lose("not an object", raw)
+            return None
+        self.slides_seen += 1
+        return slide
+
+    def _lose(self, reason: str, raw: str) -> None:
+        self.slides_seen += 1
+        match = SLIDE_NUMBER_PATTERN.search(raw)
+        self.lost_slides.append({
+            "position": self.slides_seen,
+            "slide_number": int(match.group(1)) if match else None,
+            "reason": reason,
+        })
+        print(f"Lost slide at position {self.slides_seen}: {reason}")
+
+
+def recover_slides(content: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Parse a complete (possibly truncated or malformed) completion in one go"""
+    parser = SlideStreamParser()
+    slides = parser.feed(content)
+    slides.extend(parser.close())
+    return slides, parser.lost_slides
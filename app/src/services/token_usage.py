@@ -0,0 +1,103 @@
+"""
+Token accounting for Qwen completions
+Records prompt/completion usage per request and aggregates it per
+operation and per add-on combination for capacity tuning
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from app.src.services import metrics
+
+RECENT_REQUESTS = 200
+
+
+def empty_usage() -> Dict[str, int]:
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "calls": 0, "continuations": 0, "truncated": 0}
+
+
+def add_usage(usage: Dict[str, int], response_usage: Any) -> None:
+    """Add a completion's usage (object or dict) into a usage dict in place"""
+    if response_usage is None:
+        return
+    if not isinstance(response_usage, dict):
+        response_usage = {
+            "prompt_tokens": getattr(response_usage, "prompt_tokens", 0),
+            "completion_tokens": getattr(response_usage, "completion_tokens", 0),
+        }
+    prompt_tokens = response_usage.get("prompt_tokens") or 0
+    completion_tokens = response_usage.get("completion_tokens") or 0
+    usage["prompt_tokens"] += prompt_tokens
+    usage["completion_tokens"] += completion_tokens
+    usage["total_tokens"] += prompt_tokens + completion_tokens
+
+
+def merge_usage(total: Dict[str, int], usage: Dict[str, int]) -> None:
+    for name, value in usage.items():
+        total[name] = total.get(name, 0) + value
+
+
+def add_on_combination(add_ons: Optional[Dict[str, bool]]) -> str:
+    """Stable label for the enabled add-ons, e.g. "code_examples+exercises" or "none" """
+    enabled = sorted(name for name, on in (add_ons or {}).items() if on)
+    return "+".join(enabled) or "none"
+
+
+class TokenUsageTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=RECENT_REQUESTS)
+        self._by_operation: Dict[str, Dict[str, int]] = {}
+        self._by_add_ons: Dict[str, Dict[str, int]] = {}
+
+    def record(self, operation: str, add_ons: Optional[Dict[str, bool]], usage: Dict[str, int], max_tokens: Optional[int]) -> None:
+        combination = add_on_combination(add_ons)
+        with self._lock:
+            self._recent.append({
+                "at": round(time.time(), 3),
+                "operation": operation,
+                "add_ons": combination,
+                "max_tokens": max_tokens,
+                **usage,
+            })
+            for bucket in (
+                self._by_operation.setdefault(operation, {}),
+                self._by_add_ons.setdefault(f"{operation}:{combination}", {}),
+            ):
+                merge_usage(bucket, usage)
+                bucket["requests"] = bucket.get("requests", 0) + 1
+                bucket["max_completion_tokens"] = max(bucket.get("max_completion_tokens", 0), usage["completion_tokens"])
+                if max_tokens:
+                    bucket["budget_tokens"] = bucket.get("budget_tokens", 0) + max_tokens * max(1, usage["calls"])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "by_operation": {name: self._summarize(bucket) for name, bucket in self._by_operation.items()},
+                "by_add_ons": {name: self._summarize(bucket) for name, bucket in self._by_add_ons.items()},
+                "recent": list(self._recent)[-20:],
+            }
+
+    @staticmethod
+    def _summarize(bucket: Dict[str, int]) -> Dict[str, Any]:
+        summary: Dict[str, Any] = dict(bucket)
+        requests = bucket.get("requests") or 1
+        summary["avg_prompt_tokens"] = round(bucket.get("prompt_tokens", 0) / requests, 1)
+        summary["avg_completion_tokens"] = round(bucket.get("completion_tokens", 0) / requests, 1)
+        if bucket.get("budget_tokens"):
+            # How much of the reserved completion budget was actually used
+            summary["budget_utilization"] = round(bucket.get("completion_tokens", 0) / bucket["budget_tokens"], 3)
+        return summary
+
+
+_tracker: Optional[TokenUsageTracker] = None
+
+
+def get_token_usage() -> TokenUsageTracker:
+    global _tracker
+    if _tracker is None:
+        _tracker = TokenUsageTracker()
+        metrics.register("token_usage", _tracker.stats)
+    return _tracker
@@ -0,0 +1,373 @@
+"""
+Concatenation of slide videos into the lecture video
+Clips are appended as they arrive. Clips with matching codecs are joined at
+the container level by ffmpeg (no decoding, audio kept), optionally as a
+fragmented MP4 that is playable while it grows; anything else goes through
+the OpenCV re-encode
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+
+from app.src.services import metrics
+
+# Stream fields that have to match across clips for a stream copy
+VIDEO_FIELDS = ("codec_name", "profile", "width", "height", "pix_fmt", "time_base")
+AUDIO_FIELDS = ("codec_name", "sample_rate", "channels", "time_base")
+
+
+class VideoMerger:
+    """
+    open() starts a merge that clips are appended to one at a time, in
+    order, so the merge keeps up with downloads instead of waiting for all
+    of them. The mode is picked per merge: "copy" when ffmpeg and ffprobe
+    are available and every clip has the same video (and audio) parameters,
+    "reencode" otherwise or when the copy fails. mode="reencode" always
+    re-encodes.
+    """
+
+    def __init__(
+        self,
+        ffmpeg: Optional[str] = None,
+        ffprobe: Optional[str] = None,
+        mode: str = "auto",
+        timeout: float = 600.0
+    ):
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.mode = mode
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.counters = {
+            "fragmented": 0, "copy": 0, "reencode": 0, "fragment_failures": 0, "copy_failures": 0,
+            "incompatible": 0, "fragmented_seconds": 0.0, "copy_seconds": 0.0, "reencode_seconds": 0.0,
+            "tail_seconds": 0.0,
+        }
+
+    def open(
+        self, output_file: str, progressive: bool = False, on_stream_end: Optional[Callable[[], None]] = None
+    ) -> "MergeSession":
+        """
+        Start a merge into output_file. With stream copy available, the
+        output is written as a fragmented MP4 while the clips are appended;
+        progressive=True lets it be served before the merge is done. If
+        that stops working, on_stream_end is called before the merge falls
+        back and the file is replaced.
+        """
+        copy = self.mode != "reencode" and bool(self.ffmpeg and self.ffprobe)
+        return MergeSession(
+            self, output_file, "copy" if copy else "reencode", progressive=progressive, on_stream_end=on_stream_end
+        )
+
+    def merge(self, video_files: List[str], output_file: str) -> Optional[str]:
+        """Join video_files into output_file; returns the mode that was used"""
+        session = self.open(output_file)
+        for path in video_files:
+            session.append(path)
+        return session.close()
+
+    def _probe(self, path: str) -> Tuple[Optional[Tuple], float]:
+        """
+        Video and audio stream parameters of a clip (None if it can't be
+        probed) and its duration in seconds
+        """
+        try:
+            probe = subprocess.run(
+                [self.ffprobe, "-v", "error", "-show_streams", "-show_format", "-of", "json", path],
+                capture_output=True, timeout=60, check=True,
+            )
+            info = json.loads(probe.stdout)
+            streams = info.get("streams", [])
+            duration = float(info.get("format", {}).get("duration") or 0.0)
+        except (OSError, subprocess.SubprocessError, ValueError) as e:
+            print(f"Video merge: failed to probe {path}: {e}")
+            return None, 0.0
+        video = [tuple(s.get(f) for f in VIDEO_FIELDS) for s in streams if s.get("codec_type") == "video"]
+        audio = [tuple(s.get(f) for f in AUDIO_FIELDS) for s in streams if s.get("codec_type") == "audio"]
+        if len(video) != 1:
+            return None, duration
+        return (video[0], tuple(audio)), duration
+
+    def _concat_copy(self, video_files: List[str], output_file: str) -> bool:
+        output_dir = os.path.dirname(os.path.abspath(output_file))
+        fd, list_path = tempfile.mkstemp(dir=output_dir, suffix=".txt")
+        tmp_output = output_file + ".tmp.mp4"
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for path in video_files:
+                    escaped = os.path.abspath(path).replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+            subprocess.run(
+                [self.ffmpeg, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+                 "-map", "0", "-c", "copy", "-movflags", "+faststart", tmp_output],
+                capture_output=True, timeout=self.timeout, check=True,
+            )
+            os.replace(tmp_output, output_file)
+            return True
+        except subprocess.CalledProcessError as e:
+            print(f"Video merge: stream copy failed, re-encoding: {e.stderr.decode(errors='replace')[-500:]}")
+            return False
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Video merge: stream copy failed, re-encoding: {e}")
+            return False
+        finally:
+            for path in (list_path, tmp_output):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _record(self, mode: str, seconds: float, tail_seconds: float) -> None:
+        with self._lock:
+            self.counters[mode] += 1
+            self.counters[f"{mode}_seconds"] += seconds
+            self.counters["tail_seconds"] += tail_seconds
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **{name: round(value, 3) if name.endswith("_seconds") else value for name, value in self.counters.items()},
+                "ffmpeg": self.ffmpeg,
+                "mode": self.mode,
+            }
+
+
+class MergeSession:
+    """
+    One merge in progress. In "copy" mode append() probes each clip as it
+    arrives and remuxes it to MPEG-TS, shifted to follow the previous
+    clips, into one long-running ffmpeg that writes the output as a
+    fragmented MP4, so close() only has to finish that file. In "reencode"
+    mode append() decodes the clip into the output right away. A clip that
+    doesn't match the earlier ones switches the merge to "reencode".
+
+    With progressive=True, `streaming` tells whether the output file is
+    playable while it grows. If the remux fails, on_stream_end is called
+    and the merge falls back to a plain stream copy of every clip at
+    close(). Fallbacks write to a separate file that replaces the output
+    once it is complete, so readers of the growing file never see it
+    rewritten underneath them.
+
+    Not thread-safe: append() and close() are called one after another.
+    """
+
+    def __init__(
+        self, merger: VideoMerger, output_file: str, mode: str, progressive: bool = False,
+        on_stream_end: Optional[Callable[[], None]] = None
+    ):
+        self.merger = merger
+        self.output_file = output_file
+        self.mode = mode
+        self.progressive = progressive and mode == "copy"
+        self.on_stream_end = on_stream_end
+        # Clips go through the fragmented MP4 muxer until it fails
+        self._feeding = mode == "copy"
+        self.files: List[str] = []
+        self._signature: Optional[Tuple] = None
+        self._encoder: Optional[_Reencoder] = _Reencoder(output_file) if mode == "reencode" else None
+        self._muxer: Optional[subprocess.Popen] = None
+        self._muxer_log = None
+        self._offset = 0.0
+        # Time spent merging, as opposed to waiting for clips
+        self._busy = 0.0
+
+    def append(self, path: str) -> None:
+        started = time.monotonic()
+        self.files.append(path)
+        if self.mode == "copy":
+            signature, duration = self.merger._probe(path)
+            if signature is not None and self._signature in (None, signature):
+                self._signature = signature
+                if self._feeding and not self._feed(path, duration):
+                    self._stop_feeding()
+            else:
+                self.merger._count("incompatible")
+                self._stop_feeding()
+                self._switch_to_reencode()
+        else:
+            self._encoder.append(path)
+        self._busy += time.monotonic() - started
+
+    def close(self) -> Optional[str]:
+        """Finish the output file; returns the mode used, or None if no clips were appended"""
+        if not self.files:
+            if self._encoder is not None:
+                self._encoder.close()
+            return None
+        started = time.monotonic()
+        if self.mode == "copy" and self._feeding:
+            if self._finish_muxer():
+                self.mode = "fragmented"
+            else:
+                self._stop_feeding()
+        if self.mode == "copy" and not self.merger._concat_copy(self.files, self.output_file):
+            self.merger._count("copy_failures")
+            self._switch_to_reencode()
+        if self.mode == "reencode":
+            self._encoder.close()
+        tail = time.monotonic() - started
+        self.merger._record(self.mode, self._busy + tail, tail)
+        return self.mode
+
+    @property
+    def streaming(self) -> bool:
+        """Whether the output file can be served (as a fragmented MP4) while it grows"""
+        return self.progressive and self._muxer is not None
+
+    def abort(self) -> None:
+        """Give up on the merge and remove any partial output"""
+        self._kill_muxer()
+        if self._encoder is not None:
+            self._encoder.discard()
+        try:
+            os.remove(self.output_file)
+        except OSError:
+            pass
+
+    def _feed(self, path: str, duration: float) -> bool:
+        """Remux one clip into the fragmented output; returns whether it worked"""
+        ffmpeg = self.merger.ffmpeg
+        if duration <= 0:
+            return False
+        try:
+            if self._muxer is None:
+                self._muxer_log = tempfile.TemporaryFile()
+                self._muxer = subprocess.Popen(
+                    [ffmpeg, "-y", "-v", "error", "-f", "mpegts", "-i", "pipe:0", "-map", "0", "-c", "copy",
+                     "-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", self.output_file],
+                    stdin=subprocess.PIPE, stderr=self._muxer_log,
+                )
+            subprocess.run(
+                [ffmpeg, "-v", "error", "-i", path, "-map", "0", "-c", "copy",
+                 "-muxdelay", "0", "-muxpreload", "0", "-output_ts_offset", f"{self._offset:.6f}",
+                 "-f", "mpegts", "pipe:1"],
+                stdout=self._muxer.stdin, stderr=subprocess.PIPE, timeout=self.merger.timeout, check=True,
+            )
+            self._muxer.stdin.flush()
+        except subprocess.CalledProcessError as e:
+            print(f"Video merge: failed to remux {path}: {e.stderr.decode(errors='replace')[-500:]}")
+            return False
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Video merge: failed to remux {path}: {e}")
+            return False
+        self._offset += duration
+        return True
+
+    def _finish_muxer(self) -> bool:
+        try:
+            self._muxer.stdin.close()
+            returncode = self._muxer.wait(timeout=self.merger.timeout)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Video merge: fragmented output failed: {e}")
+            return False
+        if returncode != 0:
+            self._muxer_log.seek(0)
+            print(f"Video merge: fragmented output failed: {self._muxer_log.read().decode(errors='replace')[-500:]}")
+            return False
+        self._muxer_log.close()
+        self._muxer = self._muxer_log = None
+        return True
+
+    def _stop_feeding(self) -> None:
+        if self._feeding:
+            self._feeding = False
+            if self.progressive:
+                self.progressive = False
+                # Readers of the growing file are told before anything else happens to it
+                if self.on_stream_end is not None:
+                    self.on_stream_end()
+            self._kill_muxer()
+            self.merger._count("fragment_failures")
+
+    def _kill_muxer(self) -> None:
+        if self._muxer is not None:
+            self._muxer.kill()
+            self._muxer.wait()
+            self._muxer = None
+        if self._muxer_log is not None:
+            self._muxer_log.close()
+            self._muxer_log = None
+
+    def _switch_to_reencode(self) -> None:
+        self.mode = "reencode"
+        self._encoder = _Reencoder(self.output_file)
+        for path in self.files:
+            self._encoder.append(path)
+
+
+class _Reencoder:
+    """
+    Decodes clips frame by frame and writes them out with OpenCV (mp4v);
+    drops audio. Writes next to output_file and moves it into place on close().
+    """
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+        self.path = output_file + ".reencode.mp4"
+        self._out = None
+        self._size = None
+
+    def append(self, path: str) -> None:
+        cap = cv2.VideoCapture(path)
+        if self._out is None:
+            # The first clip sets frame size and FPS
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            self._size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            self._out = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*"mp4v"), fps, self._size)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if (frame.shape[1], frame.shape[0]) != self._size:
+                frame = cv2.resize(frame, self._size)
+            self._out.write(frame)
+        cap.release()
+
+    def close(self) -> None:
+        if self._out is not None:
+            self._out.release()
+            self._out = None
+            if os.path.exists(self.path):
+                os.replace(self.path, self.output_file)
+
+    def discard(self) -> None:
+        if self._out is not None:
+            self._out.release()
+            self._out = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+_video_merger: Optional[VideoMerger] = None
+
+
+def get_video_merger() -> VideoMerger:
+    """
+    Process-wide merger using FFMPEG_PATH / FFPROBE_PATH (default: found on
+    PATH) and VIDEO_MERGE_MODE ("auto" or "reencode")
+    """
+    global _video_merger
+    if _video_merger is None:
+        _video_merger = VideoMerger(
+            ffmpeg=os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg"),
+            ffprobe=os.getenv("FFPROBE_PATH") or shutil.which("ffprobe"),
+            mode=os.getenv("VIDEO_MERGE_MODE", "auto"),
+        )
+        metrics.register("video_merge", _video_merger.stats)
+        if _video_merger.ffmpeg is None and _video_merger.mode != "reencode":
+            print("WARNING: ffmpeg not found, slide videos will be re-encoded without audio")
+    return _video_merger
@@ -0,0 +1,292 @@
+"""
+Per-request working directories for the video pipeline
+Every /generate-video run (synchronous or as a job) downloads and merges
+in its own directory, so concurrent runs never share file names; the
+directories are removed when the run is done with them and are bounded by
+a disk-usage cap
+"""
+
+import asyncio
+import fcntl
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.src.services import metrics
+from app.src.services.job_ledger import OWNER, owner_alive
+
+# A worker's directory under the root: "<pid>-<token>", like a ledger OWNER
+_OWNER_DIR = re.compile(r"^(\d+)-([0-9a-f]{32})$")
+# Written into a workspace while it's in use, with the bytes reserved for it
+RESERVATION_FILE = ".reserved"
+
+
+class WorkspaceFullError(Exception):
+    """No room for another workspace under the disk cap"""
+
+
+class Workspace:
+    def __init__(self, name: str, path: str, reserved: int = 0):
+        self.name = name
+        self.path = path
+        self.created_at = time.time()
+        # Set once the owner no longer writes to it; only released workspaces are evicted
+        self.released_at: Optional[float] = None
+        self.size = 0
+        # Counted instead of the size while the workspace is in use and smaller
+        self.reserved = reserved
+
+
+class WorkspaceManager:
+    """
+    create() makes a fresh directory under this worker's own directory in
+    root; release() marks it as finished but kept (a job's result waits
+    there to be fetched) and remove() deletes it.
+
+    max_bytes caps everything under root, all workers included. A workspace
+    in use counts as at least reserve_bytes, the expected size of a deck,
+    from the moment it is created; workers see each other's reservations
+    through a file in the workspace. create() measures root and reserves
+    under a lock on root, so concurrent creates can't overshoot the cap
+    together. When there isn't room for another reservation, this worker's
+    released workspaces are evicted oldest first and on_evict is told about
+    each; if that isn't enough, create() raises WorkspaceFullError.
+    Directories of workers that are no longer running are deleted at
+    startup.
+
+    Directory sizes are measured in a thread and directories are deleted by
+    a background thread, so none of the disk work runs on the event loop.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int = 10 * 1024 ** 3,
+        reserve_bytes: int = 256 * 1024 ** 2,
+        stale_seconds: float = 3600.0
+    ):
+        self.root = root
+        # Other workers may share root; each only ever touches its own directory
+        self.path = os.path.join(root, OWNER.replace(":", "-"))
+        self.max_bytes = max_bytes
+        self.reserve_bytes = reserve_bytes
+        self.stale_seconds = stale_seconds
+        self.on_evict: Optional[Callable[[Workspace], None]] = None
+        self._workspaces: "OrderedDict[str, Workspace]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._cleanup = ThreadPoolExecutor(max_workers=1, thread_name_prefix="workspace-cleanup")
+        self.counters = {"created": 0, "removed": 0, "evicted": 0, "rejected": 0, "stale_removed": 0}
+        # Bytes under the other workers' directories, as last measured
+        self._others = 0
+        os.makedirs(self.path, exist_ok=True)
+        self._remove_stale()
+
+    async def create(self, name: str) -> Workspace:
+        workspace, evicted = await asyncio.to_thread(self._create, name)
+        self._notify(evicted)
+        if workspace is None:
+            raise WorkspaceFullError(f"No room for another {self.reserve_bytes} bytes under the {self.max_bytes} byte cap")
+        return workspace
+
+    async def release(self, workspace: Workspace) -> None:
+        # Measured while still in use, so this workspace's final size is included
+        await asyncio.to_thread(self._release, workspace)
+        with self._lock:
+            evicted = self._make_room()
+        self._notify(evicted)
+
+    def remove(self, workspace: Workspace) -> None:
+        with self._lock:
+            if self._workspaces.pop(workspace.name, None) is not None:
+                self.counters["removed"] += 1
+        self._delete(workspace.path)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counters,
+                "workspaces": len(self._workspaces),
+                "in_use": sum(1 for w in self._workspaces.values() if w.released_at is None),
+                "bytes": self._usage() - self._others,
+                "all_workers_bytes": self._usage(),
+                "max_bytes": self.max_bytes,
+                "reserve_bytes": self.reserve_bytes,
+            }
+
+    def _create(self, name: str) -> Tuple[Optional[Workspace], list]:
+        """Measure root, make room and reserve, all under the lock on root; runs in a thread"""
+        with self._root_lock():
+            self._measure()
+            with self._lock:
+                evicted = self._make_room(self.reserve_bytes)
+                if self._usage() + self.reserve_bytes > self.max_bytes:
+                    self.counters["rejected"] += 1
+                    return None, evicted
+                workspace = Workspace(name, os.path.join(self.path, name), reserved=self.reserve_bytes)
+                os.makedirs(workspace.path, exist_ok=True)
+                with open(os.path.join(workspace.path, RESERVATION_FILE), "w") as f:
+                    f.write(str(self.reserve_bytes))
+                self._workspaces[name] = workspace
+                self.counters["created"] += 1
+        return workspace, evicted
+
+    def _release(self, workspace: Workspace) -> None:
+        """Measure, then drop the reservation; runs in a thread"""
+        self._measure()
+        try:
+            os.remove(os.path.join(workspace.path, RESERVATION_FILE))
+        except OSError:
+            pass
+        with self._lock:
+            workspace.released_at = time.time()
+            workspace.reserved = 0
+
+    def _usage(self) -> int:
+        """Bytes under root as last measured, reservations included; caller holds the lock"""
+        return self._others + sum(max(w.size, w.reserved) for w in self._workspaces.values())
+
+    def _measure(self) -> None:
+        """
+        Update the size of every workspace still in use, and of the other
+        workers' directories; runs in a thread
+        """
+        with self._lock:
+            in_use = [w for w in self._workspaces.values() if w.released_at is None]
+        for workspace in in_use:
+            workspace.size = _dir_size(workspace.path)
+        others = 0
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(self.root, name)
+            if path != self.path and os.path.isdir(path):
+                others += _owner_usage(path)
+        with self._lock:
+            self._others = others
+
+    @contextmanager
+    def _root_lock(self):
+        """Held across workers while measuring root and reserving"""
+        with open(os.path.join(self.root, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _delete(self, path: str) -> None:
+        self._cleanup.submit(shutil.rmtree, path, True)
+
+    def _make_room(self, needed: int = 0):
+        """
+        Evict released workspaces, oldest first, until `needed` more bytes
+        fit under the cap; caller holds the lock
+        """
+        evicted = []
+        usage = self._usage() + needed
+        released = sorted((w for w in self._workspaces.values() if w.released_at is not None), key=lambda w: w.released_at)
+        for workspace in released:
+            if usage <= self.max_bytes:
+                break
+            del self._workspaces[workspace.name]
+            self._delete(workspace.path)
+            usage -= workspace.size
+            self.counters["evicted"] += 1
+            evicted.append(workspace)
+        return evicted
+
+    def _notify(self, evicted) -> None:
+        if self.on_evict is None:
+            return
+        for workspace in evicted:
+            try:
+                self.on_evict(workspace)
+            except Exception as e:
+                print(f"Workspaces: eviction callback failed for {workspace.name}: {e}")
+
+    def _remove_stale(self) -> None:
+        """
+        Directories of workers that have exited. Anything else under root
+        (an older layout) goes once it's older than stale_seconds.
+        """
+        cutoff = time.time() - self.stale_seconds
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if path == self.path:
+                continue
+            match = _OWNER_DIR.match(name)
+            try:
+                if not os.path.isdir(path):
+                    continue
+                if match and owner_alive(f"{match.group(1)}:{match.group(2)}"):
+                    continue
+                if not match and os.path.getmtime(path) >= cutoff:
+                    continue
+            except OSError:
+                continue
+            self._delete(path)
+            self.counters["stale_removed"] += 1
+
+
+def _owner_usage(path: str) -> int:
+    """Bytes under another worker's directory, its workspaces in use counted as at least their reservation"""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if not entry.is_dir(follow_symlinks=False):
+                total += entry.stat(follow_symlinks=False).st_size
+                continue
+        except OSError:
+            continue
+        size = _dir_size(entry.path)
+        try:
+            with open(os.path.join(entry.path, RESERVATION_FILE), "r") as f:
+                size = max(size, int(f.read() or 0))
+        except (OSError, ValueError):
+            pass
+        total += size
+    return total
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+_workspaces: Optional[WorkspaceManager] = None
+
+
+def get_workspaces() -> WorkspaceManager:
+    """
+    Process-wide workspaces under WORKSPACE_DIR, capped at
+    WORKSPACE_MAX_BYTES for all workers together, with WORKSPACE_RESERVE_BYTES
+    reserved per run; directories of exited workers are removed at startup
+    """
+    global _workspaces
+    if _workspaces is None:
+        _workspaces = WorkspaceManager(
+            root=os.getenv("WORKSPACE_DIR", ".cache/workspaces"),
+            max_bytes=int(os.getenv("WORKSPACE_MAX_BYTES", str(10 * 1024 ** 3))),
+            reserve_bytes=int(os.getenv("WORKSPACE_RESERVE_BYTES", str(256 * 1024 ** 2))),
+            stale_seconds=float(os.getenv("JOB_TTL", "3600")),
+        )
+        metrics.register("workspaces", _workspaces.stats)
+    return _workspaces
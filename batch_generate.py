@@ -0,0 +1,64 @@
+"""
+Bulk lecture generation from the command line
+
+Reads JSONL (one LectureTopicRequest per line) and writes JSONL results in
+completion order, each tagged with its input index - the same format as
+POST /lecture/generate-batch, but without going through the HTTP server.
+
+    python batch_generate.py catalog.jsonl -o lectures.jsonl --concurrency 16
+    cat catalog.jsonl | python batch_generate.py - > lectures.jsonl
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from app.src.endpoints.lecture_endpoints import lecture_batch_handler, BATCH_DEFAULT_CONCURRENCY
+from app.src.services.batch_runner import iter_lines, run_jsonl_batch
+from app.src.services.qwen_service import init_async_client, close_async_client
+
+
+async def run(args):
+    source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    init_async_client()
+    started = time.time()
+    done = failed = 0
+    try:
+        async for result in run_jsonl_batch(
+            iter_lines(source), lecture_batch_handler(args.no_cache), args.concurrency
+        ):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            done += 1
+            if result.get("status") != 1:
+                failed += 1
+            print(f"[{done}] index={result['index']} status={result.get('status')}", file=sys.stderr)
+    finally:
+        await close_async_client()
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    print(f"Finished {done} lectures ({failed} failed) in {time.time() - started:.1f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate lectures in bulk from a JSONL file")
+    parser.add_argument("input", help="JSONL file of LectureTopicRequest records, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="where to write JSONL results (default: stdout)")
+    parser.add_argument("-c", "--concurrency", type=int, default=BATCH_DEFAULT_CONCURRENCY,
+                        help=f"lectures generated at once (default: {BATCH_DEFAULT_CONCURRENCY})")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the lecture cache")
+    args = parser.parse_args()
+
+    load_dotenv()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
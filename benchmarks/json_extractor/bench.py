@@ -0,0 +1,104 @@
+"""
+Benchmark: legacy find/rfind + json.loads extraction vs the repairing
+SlideStreamParser, over a corpus of malformed lecture completions.
+
+Usage (from the repo root):
+    python -m benchmarks.json_extractor.bench [--repeat 50] [--chunk 24]
+
+Add more completions by dropping .txt files into corpus/ and listing their
+expected slide count in corpus/manifest.json.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+from app.src.services.slide_stream_parser import SlideStreamParser, recover_slides
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+
+
+def legacy_extract(content: str) -> int:
+    """The original QwenService extraction; returns recovered slide count (0 = fallback)"""
+    try:
+        content = content.strip()
+        if content.startswith("```"):
+            content = content.split("```")[1]
+            if content.startswith("json"):
+                content = content[4:]
+        start_idx = content.find('{')
+        end_idx = content.rfind('}') + 1
+        if start_idx == -1 or end_idx == 0:
+            raise ValueError("No JSON found in response")
+        return len(json.loads(content[start_idx:end_idx]).get("slides", []))
+    except (json.JSONDecodeError, ValueError):
+        return 0
+
+
+def repairing_extract(content: str) -> int:
+    slides, _ = recover_slides(content)
+    return len(slides)
+
+
+def streaming_extract(content: str, chunk_size: int) -> int:
+    parser = SlideStreamParser()
+    count = 0
+    for i in range(0, len(content), chunk_size):
+        count += len(parser.feed(content[i:i + chunk_size]))
+    return count + len(parser.close())
+
+
+def time_it(fn, repeat: int) -> float:
+    """Median wall time in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--repeat", type=int, default=50)
+    arg_parser.add_argument("--chunk", type=int, default=24, help="stream chunk size in characters")
+    args = arg_parser.parse_args()
+
+    with open(os.path.join(CORPUS_DIR, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    header = f"{'completion':<28}{'chars':>7}{'expected':>10}{'legacy':>8}{'repair':>8}{'stream':>8}{'legacy ms':>11}{'repair ms':>11}{'stream ms':>11}"
+    print(header)
+    print("-" * len(header))
+
+    totals = {"expected": 0, "legacy": 0, "repair": 0, "stream": 0}
+    for name, meta in manifest.items():
+        with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+            content = f.read()
+
+        legacy = legacy_extract(content)
+        repair = repairing_extract(content)
+        stream = streaming_extract(content, args.chunk)
+        totals["expected"] += meta["expected_slides"]
+        totals["legacy"] += legacy
+        totals["repair"] += repair
+        totals["stream"] += stream
+
+        print(
+            f"{name:<28}{len(content):>7}{meta['expected_slides']:>10}{legacy:>8}{repair:>8}{stream:>8}"
+            f"{time_it(lambda: legacy_extract(content), args.repeat):>11.3f}"
+            f"{time_it(lambda: repairing_extract(content), args.repeat):>11.3f}"
+            f"{time_it(lambda: streaming_extract(content, args.chunk), args.repeat):>11.3f}"
+        )
+
+    print("-" * len(header))
+    print(
+        f"{'total slides recovered':<35}{totals['expected']:>10}{totals['legacy']:>8}"
+        f"{totals['repair']:>8}{totals['stream']:>8}"
+    )
+
+
+if __name__ == "__main__":
+    main()
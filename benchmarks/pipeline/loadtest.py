@@ -0,0 +1,97 @@
+"""
+Load test for a running server, meant to be pointed at the stub upstreams:
+
+    python -m stubs.qwen_stub &
+    python -m stubs.higgsfield_stub &
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8101/v1 DASHSCOPE_API_KEY=stub \
+    HF_BASE_URL=http://127.0.0.1:8102 HF_API_KEY=stub HF_SECRET=stub \
+    uvicorn main:app --port 8000 &
+
+    python -m benchmarks.pipeline.loadtest --requests 200 --concurrency 32 --no-cache
+
+Reports throughput, latency percentiles, status codes and X-Cache results.
+"""
+
+import argparse
+import asyncio
+import collections
+import statistics
+import time
+
+import httpx
+
+SCENARIOS = {
+    "lecture": ("POST", "/lecture/generate-lecture"),
+    "fanout": ("POST", "/lecture/generate-lecture"),
+    "stream": ("POST", "/lecture/generate-lecture/stream"),
+    "text": ("POST", "/generate-text"),
+    "image": ("POST", "/generate-image"),
+}
+
+
+def request_for(scenario: str, i: int, unique: bool):
+    topic = f"Load test topic {i}" if unique else "Load test topic"
+    if scenario == "text":
+        return {"json": {"text": f"Explain {topic}"}}
+    if scenario == "image":
+        return {"json": {"text": f"## {topic}\nA slide about {topic}"}}
+    body = {"topic": topic, "duration_minutes": 10, "add_ons": {"code_examples": True}}
+    if scenario == "fanout":
+        body["generation_mode"] = "fanout"
+    return {"json": body}
+
+
+async def run(args):
+    method, path = SCENARIOS[args.scenario]
+    headers = {"X-Cache-Bypass": "1"} if args.no_cache else {}
+    latencies = []
+    statuses = collections.Counter()
+    cache = collections.Counter()
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        async def one(i: int):
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    response = await client.request(
+                        method, path, headers=headers, **request_for(args.scenario, i, args.unique)
+                    )
+                    await response.aread()
+                    statuses[response.status_code] += 1
+                    cache[response.headers.get("x-cache", "-")] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(q: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+
+    print(f"{args.scenario}: {args.requests} requests, concurrency {args.concurrency}, {elapsed:.2f}s "
+          f"({args.requests / elapsed:.1f} req/s)")
+    print(f"latency ms  p50 {pct(0.50):.0f}  p95 {pct(0.95):.0f}  p99 {pct(0.99):.0f}  "
+          f"max {latencies[-1] * 1000:.0f}  mean {statistics.mean(latencies) * 1000:.0f}")
+    print(f"status      {dict(statuses)}")
+    print(f"x-cache     {dict(cache)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the lecture API")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="lecture")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--unique", action="store_true", help="give every request its own topic")
+    parser.add_argument("--no-cache", action="store_true", help="send X-Cache-Bypass: 1")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark: near-duplicate topic lookups against a large SimilarityIndex
+
+Usage (from the repo root):
+    python -m benchmarks.similarity.bench [--entries 100000] [--lookups 5000]
+
+Fills the index with synthetic topics under a few parameter signatures,
+then times lookups of paraphrased (hit) and unrelated (miss) topics and
+exits non-zero when a p99 is over --p99-budget-us (default 1000).
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from app.src.services.similarity_index import SimilarityIndex, topic_shingles
+
+SUBJECTS = [
+    "react", "python", "rust", "kubernetes", "postgres", "linear algebra", "calculus", "photosynthesis",
+    "machine learning", "neural networks", "docker", "graphql", "typescript", "statistics", "thermodynamics",
+    "world war", "renaissance art", "microeconomics", "options trading", "cryptography", "compilers",
+]
+ASPECTS = [
+    "hooks", "basics", "performance", "testing", "security", "internals", "patterns", "history",
+    "best practices", "debugging", "deployment", "theory", "applications", "pitfalls", "advanced topics",
+]
+
+
+# (topic, topic, should they match) pairs checked before timing
+REGRESSIONS = [
+    ("React Hooks Basics", "Basics of React hooks", True),
+    ("React Hooks Basics", "react hooks basics for beginners", True),
+    ("Java for Python developers", "Python for Java developers", False),
+    ("Migrating from Python to Go", "Migrating from Go to Python", False),
+]
+
+
+def check_regressions(threshold: float) -> bool:
+    index = SimilarityIndex(threshold=threshold)
+    ok = True
+    for i, (stored, query, expected) in enumerate(REGRESSIONS):
+        index.add(f"regression{i}", f"regression{i}", stored)
+        matched = index.lookup(f"regression{i}", query) is not None
+        if matched != expected:
+            ok = False
+            print(f"REGRESSION: {stored!r} vs {query!r} {'matched' if matched else 'did not match'}")
+    print(f"regression checks {'passed' if ok else 'FAILED'}")
+    return ok
+
+
+def make_topic(rng: random.Random) -> str:
+    words = rng.sample(SUBJECTS, 2) + rng.sample(ASPECTS, 2) + [f"part {rng.randint(1, 400)}"]
+    return " ".join(words)
+
+
+def paraphrase(topic: str, rng: random.Random) -> str:
+    words = topic.split()
+    rng.shuffle(words)
+    return "Introduction to " + " ".join(words).title() + " for beginners"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time SimilarityIndex lookups")
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--threshold", type=float, default=0.75)
+    parser.add_argument("--p99-budget-us", type=float, default=1000.0, help="fail when a lookup p99 exceeds this")
+    args = parser.parse_args()
+    if not check_regressions(args.threshold):
+        raise SystemExit(1)
+
+    rng = random.Random(7)
+    params = [f"params{i}" for i in range(4)]
+    index = SimilarityIndex(threshold=args.threshold, max_entries=args.entries)
+    stored = []
+    started = time.perf_counter()
+    for i in range(args.entries):
+        topic = make_topic(rng)
+        param = rng.choice(params)
+        index.add(f"key{i}", param, topic)
+        stored.append((param, topic))
+    print(f"indexed {args.entries} topics in {time.perf_counter() - started:.1f}s")
+
+    over_budget = []
+    for label, queries in (
+        ("paraphrase", [(p, paraphrase(t, rng)) for p, t in rng.sample(stored, args.lookups)]),
+        ("unrelated", [(rng.choice(params), f"{rng.choice(SUBJECTS)} cooking recipes {rng.randint(1, 10**6)}")
+                       for _ in range(args.lookups)]),
+    ):
+        timings = []
+        hits = 0
+        for param, topic in queries:
+            t0 = time.perf_counter()
+            match = index.lookup(param, topic)
+            timings.append(time.perf_counter() - t0)
+            hits += match is not None
+        timings.sort()
+        p99 = timings[int(len(timings) * 0.99)] * 1e6
+        if p99 > args.p99_budget_us:
+            over_budget.append(label)
+        print(f"{label:<10} hits {hits}/{len(queries)}  "
+              f"p50 {timings[len(timings) // 2] * 1e6:.0f}us  p99 {p99:.0f}us  "
+              f"mean {statistics.mean(timings) * 1e6:.0f}us")
+    print(index.stats())
+    print(f"p99 budget {args.p99_budget_us:.0f}us: {'exceeded by ' + ', '.join(over_budget) if over_budget else 'met'}")
+    if over_budget:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
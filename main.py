@@ -1,9 +1,25 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.routes.text_route import router as api_router
 from app.routes.image_route import router as image_router
 from app.routes.lecture_route import router as lecture_router
 from app.routes.video_route import router as video_router
+from app.routes.metrics_route import router as metrics_router
+from app.routes.job_route import router as job_router
+from app.routes.webhook_route import router as webhook_router
+from app.src.services.qwen_service import init_async_client, close_async_client
+from app.src.services.higgsfield_client import init_higgsfield_client, close_higgsfield_client
+from app.src.services.job_poller import get_job_poller, close_job_poller
+from app.src.services.job_store import get_job_store, close_job_store
+from app.src.services.job_ledger import start_job_ledger, close_job_ledger
+from app.src.services.downloader import get_downloader, close_downloader
+from app.src.services.generation_cache import get_generation_cache, close_generation_cache
+from app.src.services.video_merge import get_video_merger
+from app.src.services.lecture_cache import get_lecture_cache
+from app.src.services.similarity_index import get_similarity_index
+from app.src.services.token_usage import get_token_usage
 from dotenv import load_dotenv
+import asyncio
 import os
 
 load_dotenv()
@@ -25,10 +41,40 @@ if DASHSCOPE_API_KEY is None:
     DASHSCOPE_API_KEY = "test_dashscope_api_key"
     print("WARNING: DASHSCOPE_API_KEY not set, using test value")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled Qwen client for the whole process
+    try:
+        init_async_client()
+    except ValueError as e:
+        print(f"WARNING: Qwen client not initialized: {e}")
+    # ...and one pooled Higgsfield client
+    init_higgsfield_client()
+    get_job_poller()
+    # Pick up job sets a previous process left unfinished
+    start_job_ledger()
+    get_job_store()
+    get_downloader()
+    get_generation_cache()
+    get_video_merger()
+    get_lecture_cache()
+    # Loading the persisted near-match index takes seconds; keep it off the event loop
+    await asyncio.to_thread(get_similarity_index)
+    get_token_usage()
+    yield
+    await close_job_store()
+    await close_downloader()
+    await close_job_poller()
+    close_job_ledger()
+    close_generation_cache()
+    await close_higgsfield_client()
+    await close_async_client()
+
 app = FastAPI(
     title="Higgsfield Lecture Generator API",
     description="API for generating lecture presentations using Qwen LLM and Higgsfield image generation",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 @app.get("/")
@@ -39,7 +85,8 @@ def root():
         "endpoints": {
             "lecture": "/lecture/generate-lecture",
             "text": "/generate-text", 
-            "image": "/generate-image"
+            "image": "/generate-image",
+            "jobs": "/jobs/{job_id}"
         }
     }
 
@@ -47,4 +94,7 @@ app.include_router(api_router)
 app.include_router(image_router)
 app.include_router(lecture_router)
 
-app.include_router(video_router)
\ No newline at end of file
+app.include_router(video_router)
+app.include_router(metrics_router)
+app.include_router(job_router)
+app.include_router(webhook_router)
\ No newline at end of file
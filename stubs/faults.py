@@ -0,0 +1,133 @@
+"""
+Fault and latency injection shared by the stub servers
+
+Every knob can be set through STUB_* environment variables at startup and
+changed at runtime with POST /_stub/config, e.g.
+
+    {"latency": "lognormal:400,0.6", "error_rate": 0.05, "truncate_rate": 0.1}
+
+Distributions are written as "<kind>:<params>" in milliseconds:
+    fixed:250            always 250ms
+    uniform:100,900      uniformly between 100 and 900ms
+    lognormal:400,0.6    median 400ms, sigma 0.6 (long tail)
+"""
+
+import asyncio
+import math
+import os
+import random
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+
+
+def sample_ms(spec: str, rng: random.Random = random) -> float:
+    """Draw one value in milliseconds from a distribution spec"""
+    kind, _, params = (spec or "fixed:0").partition(":")
+    values = [float(v) for v in params.split(",") if v.strip()] or [0.0]
+    if kind == "fixed":
+        return values[0]
+    if kind == "uniform":
+        return rng.uniform(values[0], values[1] if len(values) > 1 else values[0])
+    if kind == "lognormal":
+        sigma = values[1] if len(values) > 1 else 0.5
+        return rng.lognormvariate(math.log(max(values[0], 1e-3)), sigma)
+    raise ValueError(f"Unknown distribution: {spec}")
+
+
+class FaultConfig:
+    DEFAULTS = {
+        # Time before the response starts (both stubs)
+        "latency": "fixed:50",
+        # Fraction of requests answered with error_status instead
+        "error_rate": 0.0,
+        "error_status": 503,
+        # Qwen stub: delay between streamed chunks, and output faults
+        "token_delay": "fixed:5",
+        "truncate_rate": 0.0,
+        "malform_rate": 0.0,
+        # Higgsfield stub: time until a job completes, and jobs that end as failed
+        "job_delay": "uniform:2000,6000",
+        "job_fail_rate": 0.0,
+        # Higgsfield stub: skip the job queue, completing jobs immediately
+        "instant_jobs": False,
+        # Higgsfield stub: extra delay before a webhook callback, and callbacks never sent
+        "webhook_delay": "fixed:0",
+        "webhook_drop_rate": 0.0,
+        # Higgsfield stub: asset downloads whose connection is cut halfway through
+        "download_drop_rate": 0.0,
+        "seed": None,
+    }
+
+    def __init__(self, prefix: str = "STUB_"):
+        self.values: Dict[str, Any] = {}
+        for name, default in self.DEFAULTS.items():
+            raw = os.getenv(prefix + name.upper())
+            self.values[name] = default if raw is None else self._coerce(name, raw)
+        self.rng = random.Random(self.values["seed"])
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self.__dict__["values"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def update(self, changes: Dict[str, Any]) -> Dict[str, Any]:
+        for name, value in changes.items():
+            if name not in self.DEFAULTS:
+                raise ValueError(f"Unknown stub setting: {name}")
+            self.values[name] = self._coerce(name, value) if isinstance(value, str) else value
+            if name == "latency" or name.endswith("_delay"):
+                sample_ms(self.values[name])  # validate the spec
+        if "seed" in changes:
+            self.rng = random.Random(self.values["seed"])
+        return dict(self.values)
+
+    def chance(self, rate: float) -> bool:
+        return rate > 0 and self.rng.random() < rate
+
+    def sample(self, name: str) -> float:
+        """Sample a distribution setting, in seconds"""
+        return sample_ms(self.values[name], self.rng) / 1000
+
+    async def before_response(self) -> Optional[JSONResponse]:
+        """Sleep for the configured latency; return an error response when one is injected"""
+        await asyncio.sleep(self.sample("latency"))
+        if self.chance(self.error_rate):
+            status = int(self.error_status)
+            headers = {"Retry-After": "1"} if status in (429, 503) else None
+            return JSONResponse(
+                {"error": {"message": "Injected failure", "code": status}},
+                status_code=status,
+                headers=headers,
+            )
+        return None
+
+    def _coerce(self, name: str, raw: str) -> Any:
+        default = self.DEFAULTS[name]
+        if isinstance(default, bool):
+            return raw.lower() in ("1", "true", "yes")
+        if isinstance(default, int) or name == "seed":
+            return int(raw)
+        if isinstance(default, float):
+            return float(raw)
+        return raw
+
+
+def config_router(config: FaultConfig) -> APIRouter:
+    """GET/POST /_stub/config for inspecting and changing faults at runtime"""
+    router = APIRouter()
+
+    @router.get("/_stub/config")
+    async def get_config():
+        return config.values
+
+    @router.post("/_stub/config")
+    async def set_config(changes: Dict[str, Any]):
+        try:
+            return config.update(changes)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return router
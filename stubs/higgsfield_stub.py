@@ -0,0 +1,223 @@
+"""
+Stand-in for platform.higgsfield.ai
+
+Implements the endpoints the app uses - POST /v1/text2image/,
+/v1/text2image/seedream and /v1/speak/veo3 (each returns a job set id) and
+GET /v1/job-sets/{id} - with jobs that move queued -> in_progress ->
+completed (or failed) after a configurable delay. Completed jobs point at
+small synthetic PNG/MP4 assets served by the stub itself (with Range
+support and an MD5 ETag). A submission with
+"webhook": {"url", "secret"} gets the final job set POSTed to that URL
+(with an X-Webhook-Secret header) when it finishes. Faults are configured
+as described in stubs/faults.py.
+
+    python -m stubs.higgsfield_stub --port 8102
+    HF_BASE_URL=http://127.0.0.1:8102 HF_API_KEY=stub HF_SECRET=stub uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict
+
+import cv2
+import httpx
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from stubs.faults import FaultConfig, config_router
+
+ASSET_WIDTH = 320
+ASSET_HEIGHT = 180
+VIDEO_FPS = 12
+VIDEO_SECONDS = 2
+
+config = FaultConfig()
+app = FastAPI(title="Higgsfield stub")
+app.include_router(config_router(config))
+
+_jobs: Dict[str, Dict[str, Any]] = {}
+_jobs_lock = threading.Lock()
+_webhook_tasks = set()
+
+
+def _frame(seed: int, index: int = 0) -> np.ndarray:
+    """A solid-colour frame with a moving bar, distinct per job"""
+    colour = ((seed * 67) % 256, (seed * 131) % 256, (seed * 29) % 256)
+    frame = np.full((ASSET_HEIGHT, ASSET_WIDTH, 3), colour, dtype=np.uint8)
+    x = (index * 8) % ASSET_WIDTH
+    frame[:, x:x + 8] = 255
+    return frame
+
+
+@functools.lru_cache(maxsize=64)
+def synthetic_png(seed: int) -> bytes:
+    ok, encoded = cv2.imencode(".png", _frame(seed))
+    return encoded.tobytes()
+
+
+@functools.lru_cache(maxsize=64)
+def synthetic_mp4(seed: int) -> bytes:
+    fd, path = tempfile.mkstemp(suffix=".mp4")
+    os.close(fd)
+    try:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), VIDEO_FPS, (ASSET_WIDTH, ASSET_HEIGHT))
+        for index in range(VIDEO_FPS * VIDEO_SECONDS):
+            writer.write(_frame(seed, index))
+        writer.release()
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def _check_credentials(request: Request) -> None:
+    if not request.headers.get("hf-api-key") or not request.headers.get("hf-secret"):
+        raise HTTPException(status_code=401, detail="Missing hf-api-key / hf-secret")
+
+
+async def _submit(request: Request, kind: str) -> Response:
+    _check_credentials(request)
+    body = await request.json()
+    if not isinstance(body.get("params"), dict):
+        raise HTTPException(status_code=422, detail="params is required")
+    injected = await config.before_response()
+    if injected is not None:
+        return injected
+
+    job_set_id = str(uuid.uuid4())
+    delay = 0.0 if config.instant_jobs else config.sample("job_delay")
+    now = time.time()
+    job = {
+        "id": job_set_id,
+        "kind": kind,
+        "params": body["params"],
+        "created_at": now,
+        "started_at": now + delay * 0.2,
+        "done_at": now + delay,
+        "fails": config.chance(config.job_fail_rate),
+    }
+    with _jobs_lock:
+        job["seed"] = len(_jobs) + 1
+        _jobs[job_set_id] = job
+    webhook = body.get("webhook")
+    if isinstance(webhook, dict) and webhook.get("url") and not config.chance(config.webhook_drop_rate):
+        task = asyncio.create_task(_send_webhook(job, webhook, str(request.base_url)))
+        _webhook_tasks.add(task)
+        task.add_done_callback(_webhook_tasks.discard)
+    return JSONResponse({"id": job_set_id, "type": kind, "jobs": [{"id": job_set_id, "status": "queued"}]})
+
+
+def job_status(job: Dict[str, Any], now: float) -> str:
+    if now >= job["done_at"]:
+        return "failed" if job["fails"] else "completed"
+    if now >= job["started_at"]:
+        return "in_progress"
+    return "queued"
+
+
+def job_set_payload(job: Dict[str, Any], base_url: str) -> Dict[str, Any]:
+    status = job_status(job, time.time())
+    entry: Dict[str, Any] = {"id": job["id"], "status": status, "results": None}
+    if status == "completed":
+        extension = "mp4" if job["kind"] == "veo3" else "png"
+        url = f"{base_url}assets/{job['id']}.{extension}"
+        entry["results"] = {
+            "min": {"type": extension, "url": url},
+            "raw": {"type": extension, "url": url},
+        }
+    return {"id": job["id"], "type": job["kind"], "jobs": [entry]}
+
+
+async def _send_webhook(job: Dict[str, Any], webhook: Dict[str, Any], base_url: str) -> None:
+    """POST the finished job set to the submitter's callback URL"""
+    await asyncio.sleep(max(0.0, job["done_at"] - time.time()) + config.sample("webhook_delay"))
+    headers = {"X-Webhook-Secret": webhook["secret"]} if webhook.get("secret") else {}
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            await client.post(webhook["url"], json=job_set_payload(job, base_url), headers=headers)
+    except httpx.HTTPError as e:
+        print(f"Higgsfield stub: webhook to {webhook['url']} failed: {e}")
+
+
+@app.post("/v1/text2image/")
+async def text2image(request: Request):
+    return await _submit(request, "text2image")
+
+
+@app.post("/v1/text2image/seedream")
+async def seedream(request: Request):
+    return await _submit(request, "seedream")
+
+
+@app.post("/v1/speak/veo3")
+async def speak_veo3(request: Request):
+    return await _submit(request, "veo3")
+
+
+@app.get("/v1/job-sets/{job_set_id}")
+async def get_job_set(job_set_id: str, request: Request):
+    _check_credentials(request)
+    injected = await config.before_response()
+    if injected is not None:
+        return injected
+    job = _jobs.get(job_set_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job set not found")
+    return job_set_payload(job, str(request.base_url))
+
+
+@app.get("/assets/{job_set_id}.{extension}")
+async def get_asset(job_set_id: str, extension: str, request: Request):
+    job = _jobs.get(job_set_id)
+    if job is None or job_status(job, time.time()) != "completed":
+        raise HTTPException(status_code=404, detail="Asset not found")
+    if extension == "png":
+        body, media_type = synthetic_png(job["seed"]), "image/png"
+    elif extension == "mp4":
+        body, media_type = synthetic_mp4(job["seed"]), "video/mp4"
+    else:
+        raise HTTPException(status_code=404, detail="Asset not found")
+
+    headers = {"Accept-Ranges": "bytes", "ETag": f'"{hashlib.md5(body).hexdigest()}"'}
+    start, status = 0, 200
+    match = re.fullmatch(r"bytes=(\d+)-", request.headers.get("range", ""))
+    if match:
+        start = int(match.group(1))
+        if start >= len(body):
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(body)}"})
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+    part = body[start:]
+    headers["Content-Length"] = str(len(part))
+
+    async def stream():
+        if config.chance(config.download_drop_rate):
+            # Send half and cut the connection
+            yield part[:len(part) // 2]
+            raise ConnectionResetError("Injected dropped download")
+        yield part
+
+    return StreamingResponse(stream(), status_code=status, media_type=media_type, headers=headers)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the Higgsfield stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8102)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
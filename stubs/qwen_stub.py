@@ -0,0 +1,242 @@
+"""
+Stand-in for the DashScope OpenAI-compatible endpoint
+
+Implements POST /v1/chat/completions (plain and streamed, with usage) and
+answers QwenService's lecture, outline, per-slide and text prompts with
+deterministic JSON shaped like the real model's. max_tokens is honoured
+(finish_reason "length"), and the continuation prompt picks up where the
+cut-off completion stopped. Faults are configured as described in
+stubs/faults.py.
+
+    python -m stubs.qwen_stub --port 8101
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8101/v1 DASHSCOPE_API_KEY=stub uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from stubs.faults import FaultConfig, config_router
+
+CHARS_PER_TOKEN = 4
+STREAM_CHUNK_CHARS = 12
+
+config = FaultConfig()
+app = FastAPI(title="Qwen stub")
+app.include_router(config_router(config))
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _topic(prompt: str) -> str:
+    match = re.search(r'(?:on|lecture on): "(.+?)"', prompt)
+    return match.group(1) if match else "the topic"
+
+
+def _slide(rng: random.Random, topic: str, number: int, total: int, slide_type: str,
+           code: bool, exercise: bool) -> Dict[str, Any]:
+    title = {
+        "title": f"Introduction to {topic}",
+        "conclusion": f"Key Takeaways: {topic}",
+    }.get(slide_type, f"{topic}: Concept {number - 1}")
+    bullets = "\n".join(
+        f"• Point {i + 1} about {title.lower()} with a concrete example ({rng.randint(10, 99)})"
+        for i in range(rng.randint(3, 5))
+    )
+    slide = {
+        "slide_number": number,
+        "title": title,
+        "content": bullets,
+        "image_prompt": f"Clean, professional diagram illustrating {title}, blue and white palette, flat style",
+        "slide_type": slide_type,
+        "script": f"Now let's look at {title.lower()}. This is slide {number} of {total}, and it builds on what we covered so far. Keep it in mind for the next part.",
+    }
+    if code:
+        slide["code_example"] = f"# {title}\ndef example_{number}(value: int) -> int:\n    # Double the input\n    return value * 2\n"
+    if exercise:
+        slide["exercise"] = f"Apply {title.lower()} to a small example and describe the result."
+    return slide
+
+
+def _slide_type(number: int, total: int) -> str:
+    if number == 1:
+        return "title"
+    if number == total:
+        return "conclusion"
+    return "content"
+
+
+def build_completion(messages: List[Dict[str, str]]) -> str:
+    """The full, deterministic answer for a conversation"""
+    prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+    topic = _topic(prompt)
+
+    outline = re.search(r"Exactly (\d+) slides", prompt)
+    if outline:
+        total = int(outline.group(1))
+        entries = []
+        for number in range(1, total + 1):
+            slide = _slide(rng, topic, number, total, _slide_type(number, total), False, False)
+            entries.append({
+                "slide_number": number,
+                "title": slide["title"],
+                "slide_type": slide["slide_type"],
+                "summary": f"Explains {slide['title'].lower()}",
+            })
+        return json.dumps({"outline": entries}, ensure_ascii=False, indent=2)
+
+    single = re.search(r"You are writing slide (\d+) of (\d+)", prompt)
+    if single:
+        number, total = int(single.group(1)), int(single.group(2))
+        slide = _slide(rng, topic, number, total, _slide_type(number, total),
+                       '"code_example"' in prompt, '"exercise"' in prompt)
+        title = re.search(r"^Title: (.+)$", prompt, re.MULTILINE)
+        if title:
+            slide["title"] = title.group(1)
+        for name in ("slide_number", "slide_type"):
+            slide.pop(name)
+        return json.dumps(slide, ensure_ascii=False, indent=2)
+
+    lecture = re.search(r"\((\d+) slides\)", prompt)
+    if lecture:
+        total = int(lecture.group(1))
+        code = "### Code Examples (REQUIRED)" in prompt
+        exercise = "### Practice Exercises (REQUIRED)" in prompt
+        slides = [
+            _slide(rng, topic, number, total, _slide_type(number, total), code, exercise)
+            for number in range(1, total + 1)
+        ]
+        return json.dumps({"slides": slides}, ensure_ascii=False, indent=2)
+
+    words = re.findall(r"\w+", prompt)[:12]
+    return (
+        f"Here is a short answer about {' '.join(words)}. "
+        + " ".join(f"Sentence {i + 1} adds a relevant detail." for i in range(rng.randint(3, 8)))
+    )
+
+
+def malform(content: str, rng: random.Random) -> str:
+    """Inject the kinds of damage the repairing parser knows how to undo"""
+    damage = rng.choice(["trailing_comma", "raw_newline", "missing_comma"])
+    if damage == "trailing_comma" and '"\n    }' in content:
+        return content.replace('"\n    }', '",\n    }', 1)
+    if damage == "raw_newline" and "\\n" in content:
+        return content.replace("\\n", "\n", 1)
+    if "},\n    {" in content:
+        return content.replace("},\n    {", "}\n    {", 1)
+    return content
+
+
+def answer(messages: List[Dict[str, str]], max_tokens: Optional[int]) -> Tuple[str, str]:
+    """(content, finish_reason) for this request, applying truncation and malformation faults"""
+    original = messages
+    already = ""
+    # QwenService continues a cut-off completion by replaying it as an assistant turn
+    if len(messages) >= 3 and messages[-1]["content"].startswith("Your previous response was cut off"):
+        original = messages[:-2]
+        already = messages[-2]["content"]
+
+    full = build_completion(original)
+    if not already and config.chance(config.malform_rate):
+        full = malform(full, config.rng)
+    content = full[len(already):]
+
+    finish_reason = "stop"
+    if max_tokens and count_tokens(content) > max_tokens:
+        content = content[:max_tokens * CHARS_PER_TOKEN]
+        finish_reason = "length"
+    elif config.chance(config.truncate_rate) and len(content) > 40:
+        # Model stopped early (or the upstream cut the stream) without saying so
+        content = content[:config.rng.randint(len(content) // 3, len(content) - 10)]
+    return content, finish_reason
+
+
+def usage_for(messages: List[Dict[str, str]], content: str) -> Dict[str, int]:
+    prompt_tokens = sum(count_tokens(m.get("content") or "") for m in messages)
+    completion_tokens = count_tokens(content)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    injected = await config.before_response()
+    if injected is not None:
+        return injected
+
+    messages = body.get("messages", [])
+    model = body.get("model", "qwen-stub")
+    content, finish_reason = answer(messages, body.get("max_tokens"))
+    usage = usage_for(messages, content)
+    completion_id = "chatcmpl-" + uuid.uuid4().hex
+    created = int(time.time())
+
+    if not body.get("stream"):
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }],
+            "usage": usage,
+        })
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    def chunk(delta: Dict[str, Any], finish: Optional[str] = None, with_usage: bool = False) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [] if with_usage else [{"index": 0, "delta": delta, "finish_reason": finish}],
+        }
+        if with_usage:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    async def events():
+        yield chunk({"role": "assistant", "content": ""})
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            await asyncio.sleep(config.sample("token_delay"))
+            yield chunk({"content": content[start:start + STREAM_CHUNK_CHARS]})
+        yield chunk({}, finish_reason)
+        if include_usage:
+            yield chunk({}, with_usage=True)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the Qwen (DashScope) stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from app.src.services.similarity_index import SimilarityIndex, jaccard, topic_shingles
+
+
+def test_shingles_drop_stopwords_and_plurals():
+    assert topic_shingles("An Introduction to the Basics of Neural Networks") == {"basic", "neural", "network"}
+    assert topic_shingles("CSS classes") == {"css", "classe"}
+    assert topic_shingles("Glass") == {"glass"}
+
+
+def test_shingles_keep_direction_across_for_and_to():
+    java_for_python = topic_shingles("Java for Python developers")
+    python_for_java = topic_shingles("Python for Java developers")
+
+    assert java_for_python == {"java", "for:python", "for:developer"}
+    assert java_for_python != python_for_java
+    assert jaccard(java_for_python, python_for_java) < 0.75
+    assert topic_shingles("Migrating from Python 2 to Python 3") != topic_shingles("Migrating from Python 3 to Python 2")
+
+
+def test_shingles_ignore_order_within_the_subject():
+    assert topic_shingles("Machine learning with Python") == topic_shingles("Python machine learning")
+    # A leading directional word has nothing to give a role to
+    assert topic_shingles("To Python") == {"python"}
+
+
+def test_near_match_hits_at_or_above_the_threshold():
+    index = SimilarityIndex(threshold=0.75)
+    index.add("key-1", "params", "React hooks state effects context")
+
+    # 4 of 5 shingles shared: similarity 0.8
+    match = index.lookup("params", "React hooks state effects")
+    assert match is not None
+    assert match[0] == "key-1"
+    assert match[1] == "React hooks state effects context"
+    assert abs(match[2] - 0.8) < 1e-9
+    assert index.lookup("params", "React hooks state effects context")[2] == 1.0
+
+
+def test_near_match_misses_below_the_threshold():
+    index = SimilarityIndex(threshold=0.75)
+    index.add("key-1", "params", "React hooks state effects context")
+
+    # 0.8 is below a stricter threshold
+    strict = SimilarityIndex(threshold=0.85)
+    strict.add("key-1", "params", "React hooks state effects context")
+    assert strict.lookup("params", "React hooks state effects") is None
+    assert strict.lookup("params", "React hooks state effects context") is not None
+    # 3 of 6 shingles shared: similarity 0.5
+    assert index.lookup("params", "React hooks state reducers refs") is None
+    assert index.lookup("params", "Java for Python developers") is None
+
+
+def test_near_match_needs_the_same_params_and_honours_exclude():
+    index = SimilarityIndex(threshold=0.75)
+    index.add("key-1", "params", "React hooks state effects context")
+
+    assert index.lookup("other-params", "React hooks state effects context") is None
+    assert index.lookup("params", "React hooks state effects context", exclude=("key-1",)) is None
+    index.remove("key-1")
+    assert index.lookup("params", "React hooks state effects context") is None
@@ -0,0 +1,53 @@
+from app.src.services.slide_stream_parser import SlideStreamParser, recover_slides
+
+
+def feed_in_chunks(text, size=7):
+    parser = SlideStreamParser()
+    slides = []
+    for start in range(0, len(text), size):
+        slides.extend(parser.feed(text[start:start + size]))
+    slides.extend(parser.close())
+    return parser, slides
+
+
+def test_repairs_common_llm_mistakes_across_chunks():
+    text = (
+        'Here is the lecture:\n```json\n{"title": "T", "slides": [\n'
+        '  {"slide_number": 1, "title": "Say "hello"", "content": "line one\nline two",},\n'
+        '  {"slide_number": 2, "title": "C:\\path" "content": "ok"}\n'
+        ']}\n```'
+    )
+    parser, slides = feed_in_chunks(text)
+
+    assert slides == [
+        {"slide_number": 1, "title": 'Say "hello"', "content": "line one\nline two"},
+        {"slide_number": 2, "title": "C:\\path", "content": "ok"},
+    ]
+    assert parser.lost_slides == []
+    assert parser.repairs >= 4
+
+
+def test_slides_are_returned_as_soon_as_they_close():
+    parser = SlideStreamParser()
+    assert parser.feed('{"slides": [{"slide_number": 1, "title": "A"}, {"slide_') == [{"slide_number": 1, "title": "A"}]
+    assert parser.feed('number": 2, "title": "B"}]}') == [{"slide_number": 2, "title": "B"}]
+    assert parser.close() == []
+
+
+def test_truncated_slide_is_reported_as_lost():
+    slides, lost = recover_slides('{"slides": [{"slide_number": 1, "title": "A"}, {"slide_number": 2, "title": "B')
+
+    assert slides == [{"slide_number": 1, "title": "A"}]
+    assert lost == [{"position": 2, "slide_number": 2, "reason": "truncated"}]
+
+
+def test_unparseable_slide_is_lost_without_dropping_the_others():
+    slides, lost = recover_slides(
+        '{"slides": [{"slide_number": 1, "title": tru}, {"slide_number": 2, "title": "B"}]}'
+    )
+
+    assert slides == [{"slide_number": 2, "title": "B"}]
+    assert len(lost) == 1
+    assert lost[0]["position"] == 1
+    assert lost[0]["slide_number"] == 1
+    assert lost[0]["reason"].startswith("malformed")